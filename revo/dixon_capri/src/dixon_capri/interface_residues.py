@@ -4,11 +4,79 @@ Functions used to determine the interface residues.
 
 import mdtraj as mdj
 import numpy as np
+from scipy.spatial import cKDTree
+
+def neighbor_minimum_distance(trajectory,
+                              prot_1_idx,
+                              prot_2_idx,
+                              horizon):
+    """
+    Determines the minimum distance between two sets of atoms by only
+    looking at the atom pairs within a horizon distance using a
+    KD-tree. Periodic boundaries are respected for rectangular unit
+    cells, for other unit cells all pairs are computed exactly.
+
+    Parameters
+    ----------
+
+    trajectory: MDTRAJ Trajectory Object.
+
+    prot_1_idx: list of ints
+        List of atomic indices for the first set.
+
+    prot_2_idx: list of ints
+        List of atomic indices for the second set.
+
+    horizon: float
+        Only atom pairs closer than this are considered.
+
+    Outputs
+    --------
+
+    min_dist: float
+        minimum distance between the atomic indice sets, inf if no
+        pair is within the horizon.
+    """
+
+    unitcell_lengths = trajectory.unitcell_lengths
+
+    if unitcell_lengths is not None and not np.allclose(trajectory.unitcell_angles, 90.0):
+        atom_pairs = np.stack(np.meshgrid(prot_1_idx, prot_2_idx, indexing='ij'),
+                              axis=-1).reshape(-1, 2)
+        return np.min(mdj.compute_distances(trajectory, atom_pairs))
+
+    min_dist = np.inf
+    for frame_idx in range(trajectory.n_frames):
+
+        coords_1 = trajectory.xyz[frame_idx, prot_1_idx].astype(np.float64)
+        coords_2 = trajectory.xyz[frame_idx, prot_2_idx].astype(np.float64)
+
+        boxsize = None
+        if unitcell_lengths is not None:
+            boxsize = unitcell_lengths[frame_idx].astype(np.float64)
+
+            # the periodic KD-tree needs all the points in the box
+            coords_1 = np.mod(coords_1, boxsize)
+            coords_1[coords_1 >= boxsize] = 0.0
+            coords_2 = np.mod(coords_2, boxsize)
+            coords_2[coords_2 >= boxsize] = 0.0
+
+        tree_1 = cKDTree(coords_1, boxsize=boxsize)
+        tree_2 = cKDTree(coords_2, boxsize=boxsize)
+
+        close_pairs = tree_1.sparse_distance_matrix(tree_2, horizon,
+                                                    output_type='ndarray')
+
+        if len(close_pairs) > 0:
+            min_dist = min(min_dist, np.min(close_pairs['v']))
+
+    return min_dist
 
 def calculate_residue_minimum_distance(trajectory,
                                        prot_1_idx,
                                        prot_2_idx,
-                                       h_idx):
+                                       h_idx,
+                                       horizon=None):
                                        
     """
     Determines the minimum distance between sets of heavy atoms.
@@ -30,6 +98,11 @@ def calculate_residue_minimum_distance(trajectory,
     
    h_idx: list of ints
        list of hydrogen atom indices in the system
+
+   horizon: float or None
+       If given only atom pairs closer than this are computed using a
+       neighbor search and inf is returned if there are none. If None
+       all pairs are computed exactly.
        
    Outputs
    --------
@@ -40,22 +113,21 @@ def calculate_residue_minimum_distance(trajectory,
     """
                                        
     # Slice out hydrogen atoms
-    prot_1_idx_no_h = []
-    prot_2_idx_no_h = []
-     
-    for atom_idx in prot_1_idx:
-        if atom_idx not in h_idx:
-            prot_1_idx_no_h.append(atom_idx)
-            
-    for atom_idx in prot_2_idx:
-        if atom_idx not in h_idx:
-            prot_2_idx_no_h.append(atom_idx)  
-                  
+    prot_1_idx = np.asarray(prot_1_idx)
+    prot_2_idx = np.asarray(prot_2_idx)
+
+    prot_1_idx_no_h = prot_1_idx[~np.isin(prot_1_idx, h_idx)]
+    prot_2_idx_no_h = prot_2_idx[~np.isin(prot_2_idx, h_idx)]
+
+    if horizon is not None:
+        return neighbor_minimum_distance(trajectory,
+                                         prot_1_idx_no_h,
+                                         prot_2_idx_no_h,
+                                         horizon)
+
     # Generate atom pairs
-    atom_pairs = []
-    for atom_1 in prot_1_idx_no_h:
-        for atom_2 in prot_2_idx_no_h:
-            atom_pairs.append((atom_1, atom_2))
+    atom_pairs = np.stack(np.meshgrid(prot_1_idx_no_h, prot_2_idx_no_h, indexing='ij'),
+                          axis=-1).reshape(-1, 2)
            
     # Calculate the atomic distance between sets of atomic indicies
     dists = mdj.compute_distances(trajectory, atom_pairs)
@@ -70,7 +142,8 @@ def determine_binary_interface_residues(pdb,
                                         target_atom_idx, 
                                         ligase_resid_list,
                                         ligase_atom_idx,
-                                        interface_cutoff):
+                                        interface_cutoff,
+                                        neighbor_search=False):
 
     """
     Determines which residues on the target and ligase that
@@ -99,6 +172,10 @@ def determine_binary_interface_residues(pdb,
     interface_cutoff: float
         How far each residue can be from the protein to be considered in the 
         interface.
+
+    neighbor_search: bool
+        If True only atom pairs within the interface_cutoff are computed
+        using a neighbor search, otherwise all pairs are computed.
         
     Outputs:
     --------
@@ -114,6 +191,10 @@ def determine_binary_interface_residues(pdb,
 
     # Get hydrogen atom list so we can exclude them from the distance calculation
     h_idx = top.select('element "H"')
+
+    # residues further apart than the cutoff never count so they
+    # don't need to be computed exactly
+    horizon = interface_cutoff if neighbor_search else None
  
     # Find target protein interface   
     target_interface_residue_id = []
@@ -123,7 +204,8 @@ def determine_binary_interface_residues(pdb,
         min_dist = calculate_residue_minimum_distance(pdb, 
                                                       target_residue_atom_idx, 
                                                       ligase_atom_idx,
-                                                      h_idx)
+                                                      h_idx,
+                                                      horizon=horizon)
         if min_dist < interface_cutoff:
             target_interface_residue_id.append(target_residue)
          
@@ -135,7 +217,8 @@ def determine_binary_interface_residues(pdb,
         min_dist = calculate_residue_minimum_distance(pdb, 
                                                       ligase_residue_atom_idx, 
                                                       target_atom_idx,
-                                                      h_idx)
+                                                      h_idx,
+                                                      horizon=horizon)
         if min_dist < interface_cutoff:
             ligase_interface_residue_id.append(ligase_residue)
             
@@ -144,7 +227,8 @@ def determine_binary_interface_residues(pdb,
 def determine_fnat_residue_contacts(pdb, 
                                     target_resid_list, 
                                     ligase_resid_list,
-                                    interface_cutoff):
+                                    interface_cutoff,
+                                    neighbor_search=False):
 
     """
     Determines which residues are in contact between the target
@@ -171,6 +255,10 @@ def determine_fnat_residue_contacts(pdb,
     interface_cutoff: float
         How far each residue can be from the protein to be considered in the 
         interface.
+
+    neighbor_search: bool
+        If True only atom pairs within the interface_cutoff are computed
+        using a neighbor search, otherwise all pairs are computed.
         
     Outputs:
     --------
@@ -186,6 +274,10 @@ def determine_fnat_residue_contacts(pdb,
 
     # Get hydrogen atom list so we can exclude them from the distance calculation
     h_idx = top.select('element "H"')
+
+    # residues further apart than the cutoff never count so they
+    # don't need to be computed exactly
+    horizon = interface_cutoff if neighbor_search else None
  
     # Get lists of atom indicies for each residue
     target_residue_idx_list = []
@@ -207,7 +299,8 @@ def determine_fnat_residue_contacts(pdb,
             min_dist = calculate_residue_minimum_distance(pdb, 
                                                           target_residue_idx_list[target_residue], 
                                                           ligase_residue_idx_list[ligase_residue],
-                                                          h_idx)
+                                                          h_idx,
+                                                          horizon=horizon)
                                                           
             # Determine if the target-ligase residue pair forms a contact
             if min_dist < interface_cutoff:
@@ -33,11 +33,12 @@ from wepy.runners.openmm import OpenMMRunner, OpenMMState, OpenMMGPUWorker, Open
 from wepy.walker import Walker
 
 # classes for making the resampler
-from stx_wepy.resampling.distances.new_rebinding_distance import RebindingDistance
+from stx_wepy.resampling.distances.rebinding import RebindingDistance
 from stx_wepy.resampling.resamplers.epsilon_variation_loss_revo import EpsilonVariationLossREVOResampler
 
 # A standard Boundary condition object for unbinding
 from stx_wepy.boundary_conditions.new_rebinding_bc import NewRebindingBC
+from stx_wepy.util.state_cache import StatePreprocessingCache
 
 # standard reporters
 from wepy.reporter.hdf5 import WepyHDF5Reporter
@@ -939,11 +940,17 @@ def main(n_runs, n_cycles, steps, n_walkers, n_workers=1, seed=None):
     # indices for selecting atoms for the image and for doing the
     # alignments to only the binding site. All images will be aligned
     # to the reference initial state
+    # the distance metric and the boundary conditions superimpose the
+    # same atoms onto the same reference so they share the images of
+    # each cycle
+    state_cache = StatePreprocessingCache()
+
     reb_distance = RebindingDistance(ligand_idxs = start_guest_idx,
                                      binding_site_idxs = start_bs_idx,
                                      native_ligand_idxs = native_guest_idx,
                                      native_binding_site_idxs = native_bs_idx,
-                                     ref_state = native_init_state)
+                                     ref_state = native_init_state,
+                                     state_cache = state_cache)
 
     ## Make the Boundary Conditions
 
@@ -955,7 +962,8 @@ def main(n_runs, n_cycles, steps, n_walkers, n_workers=1, seed=None):
                          ligand_idxs=start_guest_idx,
                          binding_site_idxs=start_bs_idx,
                          native_state_ligand_idxs=native_guest_idx,
-                         native_state_binding_site_idxs=native_bs_idx)
+                         native_state_binding_site_idxs=native_bs_idx,
+                         state_cache=state_cache)
 
 
     ## Make the resampler
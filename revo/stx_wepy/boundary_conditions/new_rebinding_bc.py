@@ -9,6 +9,9 @@ from geomm.superimpose import superimpose
 from geomm.rmsd import calc_rmsd
 from geomm.centering import center_around
 
+import multiprocessing as mulproc
+from functools import partial
+
 import mdtraj as mdj
 
 from wepy.walker import WalkerState
@@ -17,6 +20,222 @@ from wepy.util.mdtraj import json_to_mdtraj_topology
 
 from wepy.boundary_conditions.receptor import ReceptorBC
 
+from stx_wepy.util.state_cache import ProgressCache
+from stx_wepy.util import batch_geometry
+from stx_wepy.util.shared_arrays import frozen_array, SharedArrays
+from stx_wepy.resampling.executors import make_executor
+
+
+class RebindingReference():
+    """The precomputed index arrays and reference images of the
+    rebinding boundary conditions.
+
+    The images are the positions of the ligand followed by the binding
+    site. All the arrays are contiguous, read only and made once, the
+    indices as int32 and the reference images as float64 by default,
+    so the progress of a walker never needs the full native state.
+    With `shared_memory` the arrays are kept in a `SharedArrays` block
+    so workers of a process executor map them instead of getting a
+    copy with every task.
+
+    A reference in shared memory is pickled only by the location of
+    the block, which is what the workers need, so it can't be
+    unpickled once the process that made it has removed the block.
+    Use `with_shared_memory(False)` for a copy that can be saved, the
+    rebinding boundary conditions do this when they are pickled.
+    """
+
+    ARRAY_FIELDS = ('image_idxs', 'image_lig_idxs', 'image_bs_idxs',
+                    'ref_image', 'ref_centered_image')
+
+    def __init__(self, native_positions,
+                 ligand_idxs, binding_site_idxs,
+                 native_ligand_idxs, native_binding_site_idxs,
+                 ref_dtype=np.float64,
+                 shared_memory=False):
+        """Constructor for RebindingReference.
+
+        Parameters
+        ----------
+
+        native_positions : arraylike of shape (n_atoms, 3)
+            The positions of the native state, only the image atoms are
+            kept.
+
+        ligand_idxs : arraylike of int
+            The indices of the ligand in the walker states.
+
+        binding_site_idxs : arraylike of int
+            The indices of the binding site in the walker states.
+
+        native_ligand_idxs : arraylike of int
+            The indices of the ligand in the native state.
+
+        native_binding_site_idxs : arraylike of int
+            The indices of the binding site in the native state.
+
+        ref_dtype : numpy dtype
+            The dtype of the reference images, float64 by default.
+            With np.float32 the references are half the size but the
+            native positions are rounded to about 7 significant
+            digits, so the RMSDs differ from the float64 ones in
+            roughly the 7th digit, which can change whether walkers
+            right at the cutoff are warped.
+
+        shared_memory : bool
+            Keep the arrays in shared memory.
+
+        """
+
+        n_lig_atoms = len(ligand_idxs)
+        n_bs_atoms = len(binding_site_idxs)
+
+        assert len(native_ligand_idxs) == n_lig_atoms, \
+            "The native state must have the same number of ligand atoms"
+        assert len(native_binding_site_idxs) == n_bs_atoms, \
+            "The native state must have the same number of binding site atoms"
+
+        native_image_idxs = np.concatenate((native_ligand_idxs, native_binding_site_idxs))
+
+        ref_image = np.asarray(native_positions)[native_image_idxs].astype(ref_dtype)
+
+        # the reference centered around its binding site
+        ref_centered_image = ref_image - ref_image[n_lig_atoms:].mean(axis=0)
+
+        arrays = {
+            # the idxs of the image atoms in the walker states
+            'image_idxs' : frozen_array(np.concatenate((ligand_idxs, binding_site_idxs)),
+                                        dtype=np.int32),
+            # the idxs of the ligand and binding site within the image
+            'image_lig_idxs' : frozen_array(np.arange(n_lig_atoms), dtype=np.int32),
+            'image_bs_idxs' : frozen_array(np.arange(n_lig_atoms, n_lig_atoms + n_bs_atoms),
+                                           dtype=np.int32),
+            'ref_image' : frozen_array(ref_image),
+            'ref_centered_image' : frozen_array(ref_centered_image, dtype=ref_dtype),
+        }
+
+        if shared_memory:
+            arrays = SharedArrays(arrays)
+
+        self._arrays = arrays
+        self._set_fields()
+
+        # the ligand to binding site centroid distance of the native
+        # state
+        self.ref_centroid_dist = float(np.linalg.norm(
+            self.ref_centered_image[self.image_lig_idxs].mean(axis=0)))
+
+    def _set_fields(self):
+
+        for field in self.ARRAY_FIELDS:
+
+            # unpickled arrays are writeable again
+            self._arrays[field].setflags(write=False)
+
+            setattr(self, field, self._arrays[field])
+
+    @property
+    def shared_memory(self):
+        """Whether the arrays are in shared memory."""
+        return isinstance(self._arrays, SharedArrays)
+
+    def with_shared_memory(self, shared_memory):
+        """A copy of the reference with or without its arrays in shared
+        memory.
+
+        Parameters
+        ----------
+
+        shared_memory : bool
+
+        Returns
+        -------
+
+        reference : RebindingReference
+
+        """
+
+        arrays = {field : frozen_array(self._arrays[field])
+                  for field in self.ARRAY_FIELDS}
+
+        if shared_memory:
+            arrays = SharedArrays(arrays)
+
+        reference = RebindingReference.__new__(RebindingReference)
+        reference.__setstate__({'arrays' : arrays,
+                                'ref_centroid_dist' : self.ref_centroid_dist})
+
+        return reference
+
+    def __getstate__(self):
+
+        # the arrays are pickled only once, or only by their location
+        # in the shared memory
+        return {'arrays' : self._arrays,
+                'ref_centroid_dist' : self.ref_centroid_dist}
+
+    def __setstate__(self, state):
+
+        self._arrays = state['arrays']
+        self.ref_centroid_dist = state['ref_centroid_dist']
+        self._set_fields()
+
+    def stack_images(self, states):
+        """Slice the image atoms out of many states.
+
+        Parameters
+        ----------
+        states : list of objects implementing WalkerState
+
+        Returns
+        -------
+        images : arraylike of shape (n_states, n_image_atoms, 3)
+
+        box_lengths : arraylike of shape (n_states, 3)
+
+        """
+
+        images = np.stack([state['positions'][self.image_idxs] for state in states])
+        box_lengths = batch_geometry.box_vectors_to_lengths(
+            np.stack([state['box_vectors'] for state in states]))
+
+        return images, box_lengths
+
+
+def native_rmsds(reference, images, box_lengths):
+    """The ligand RMSDs of stacked images to the native state when
+    superimposed over the binding site.
+
+    Parameters
+    ----------
+    reference : RebindingReference
+
+    images : arraylike of shape (n_images, n_image_atoms, 3)
+        As made by `RebindingReference.stack_images`.
+
+    box_lengths : arraylike of shape (n_images, 3)
+
+    Returns
+    -------
+    native_rmsds : arraylike of shape (n_images,)
+
+    """
+
+    # regroup the ligand into the binding site periodic image and
+    # center around the binding site
+    grouped_images = batch_geometry.group_pair(images, box_lengths,
+                                               reference.image_bs_idxs,
+                                               reference.image_lig_idxs)
+    centered_images = batch_geometry.center_around(grouped_images,
+                                                   reference.image_bs_idxs)
+
+    # superimpose over the native state, which is centered the same,
+    # matching the binding site only
+    sup_images, _ = batch_geometry.superimpose(reference.ref_centered_image, centered_images,
+                                               idxs=reference.image_bs_idxs)
+
+    return batch_geometry.calc_rmsd(reference.ref_centered_image, sup_images,
+                                    idxs=reference.image_lig_idxs)
 
 
 class RebindingBC(ReceptorBC):
@@ -40,6 +259,9 @@ class RebindingBC(ReceptorBC):
     ligands is calculated. If this RMSD is less than the 'cutoff_rmsd'
     argument the walker is warped.
     PROGRESS is reported for each walker from this rmsd.
+    The progress of all the walkers is computed at once by `progress`
+    on stacked images of the ligand and binding site, optionally split
+    into chunks for an executor.
     The BC records are never updated.
     """
 
@@ -81,6 +303,12 @@ class RebindingBC(ReceptorBC):
                  initial_weights=None,
                  ligand_idxs=None,
                  binding_site_idxs=None,
+                 progress_cache=None,
+                 state_cache=None,
+                 executor='serial',
+                 num_workers=None,
+                 ref_dtype=np.float64,
+                 shared_memory=False,
                  **kwargs):
         """Constructor for RebindingBC.
         Arguments
@@ -101,6 +329,37 @@ class RebindingBC(ReceptorBC):
         binding_site_idxs : arraylike of int
             The indices of the atom positions in the state considered
             the binding site.
+        progress_cache : ProgressCache, optional
+            Cache of the progress of each walker state in the current
+            cycle, so resamplers asking for the progress of the same
+            walkers (e.g. EpsilonVariationLossREVOResampler) don't
+            compute it again. A new one is made if not given.
+        state_cache : StatePreprocessingCache, optional
+            Cache of the superimposed images of the walker states,
+            shared with a distance metric using the same ligand and
+            binding site (e.g. RebindingDistance) so the images are
+            only made once per cycle. It is cleared at the start of
+            every cycle.
+        executor : str or object with a `map` method, optional
+            Used to compute the progress of chunks of the walkers in
+            parallel. One of 'serial' (default), 'thread' or
+            'process', or an executor like
+            `concurrent.futures.ThreadPoolExecutor`.
+        num_workers : int, optional
+            The number of workers for thread and process executors,
+            defaults to the number of CPUs.
+        ref_dtype : numpy dtype, optional
+            The dtype of the precomputed reference images, float64 by
+            default. np.float32 is opt-in and loses precision, see
+            `RebindingReference`. To share images with a distance
+            metric through the state_cache its reference must have the
+            same dtype, e.g. np.float64 for RebindingDistance.
+        shared_memory : bool, optional
+            Keep the precomputed indices and reference images in shared
+            memory for the workers of a process executor. A pickled
+            boundary condition holds a copy of the values, not the
+            shared memory, so it can be saved and loaded in another
+            process.
         Raises
         ------
         AssertionError
@@ -129,11 +388,80 @@ class RebindingBC(ReceptorBC):
         self._native_state = native_state
         self._cutoff_rmsd = cutoff_rmsd
 
+        # the progress only depends on the ligand and binding site so
+        # it is computed on images of just those atoms
+        native_ligand_idxs, native_bs_idxs = self._native_image_member_idxs()
+        self.reference = RebindingReference(self._native_state['positions'],
+                                            self.ligand_idxs, self.binding_site_idxs,
+                                            native_ligand_idxs, native_bs_idxs,
+                                            ref_dtype=ref_dtype,
+                                            shared_memory=shared_memory)
+
+        if progress_cache is None:
+            progress_cache = ProgressCache()
+
+        self.progress_cache = progress_cache
+
+        self.state_cache = state_cache
+
+        # the executor for the progress, pools are only made when
+        # first used
+        self._executor_spec = executor
+        self.num_workers = num_workers if num_workers is not None else mulproc.cpu_count()
+        self._executor = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+
+        # pools made by the boundary condition can't be pickled, they
+        # will be remade when needed
+        if isinstance(self._executor_spec, str):
+            state['_executor'] = None
+
+        # a reference in shared memory is only valid while this process
+        # exists so its values are saved instead
+        if self.reference.shared_memory:
+            state['reference'] = self.reference.with_shared_memory(False)
+            state['_shared_reference'] = True
+
+        return state
+
+    def __setstate__(self, state):
+
+        shared_reference = state.pop('_shared_reference', False)
+
+        self.__dict__.update(state)
+
+        if shared_reference:
+            self.reference = self.reference.with_shared_memory(True)
+
+    @property
+    def executor(self):
+        """The executor used for computing the progress."""
+
+        if self._executor is None:
+            self._executor = make_executor(self._executor_spec,
+                                           num_workers=self.num_workers)
+
+        return self._executor
+
+    def _native_image_member_idxs(self):
+        """The ligand and binding site indices of the native state."""
+
+        return self.ligand_idxs, self.binding_site_idxs
+
     @property
     def native_state(self):
         """The reference bound state to which walkers are compared."""
         return self._native_state
 
+    @property
+    def ref_image(self):
+        """The image of the native state the walkers are superimposed
+        onto, see `RebindingReference`."""
+        return self.reference.ref_image
+
     @property
     def cutoff_rmsd(self):
         """The cutoff RMSD for considering a walker bound."""
@@ -145,8 +473,135 @@ class RebindingBC(ReceptorBC):
 
         return self._receptor_idxs
 
+    def warp_walkers(self, walkers, cycle):
+        """Test the progress of all the walkers, warp if required, and update
+        the boundary conditions.
+
+        See `WarpBC.warp_walkers`, the progress and state caches are
+        cleared at the start of every cycle and then the progress cache
+        is filled for all the walkers at once by `progress`.
+
+        """
+
+        self.progress_cache.clear()
+
+        if self.state_cache is not None:
+            self.state_cache.clear()
+
+        self.progress(walkers)
+
+        return super().warp_walkers(walkers, cycle)
+
+    def progress(self, walkers):
+        """Calculate if the walkers have bound and provide their progress
+        records.
+
+        Gives the same results as calling `_progress` on each walker
+        but the regrouping, centering, superposition and RMSD are done
+        for all the walkers not already in the progress cache together
+        on stacked arrays, split into chunks for the executor.
+
+        Parameters
+        ----------
+        walkers : list of objects implementing the Walker interface
+
+        Returns
+        -------
+        progresses : list of tuple of (bool, dict of str : value)
+           The `_progress` results of the walkers.
+
+        """
+
+        progresses = [self.progress_cache.get(walker.state) for walker in walkers]
+
+        missing_idxs = [walker_idx for walker_idx, progress in enumerate(progresses)
+                        if progress is None]
+
+        if len(missing_idxs) == 0:
+            return progresses
+
+        missing_progresses = self._calc_progresses([walkers[walker_idx].state
+                                                    for walker_idx in missing_idxs])
+
+        for walker_idx, progress in zip(missing_idxs, missing_progresses):
+            self.progress_cache.add(walkers[walker_idx].state, progress)
+            progresses[walker_idx] = progress
+
+        return progresses
+
+    def _calc_progresses(self, states):
+        """Calculate the progress of many states at once without the
+        cache, see `progress`.
+
+        Parameters
+        ----------
+        states : list of objects implementing WalkerState
+
+        Returns
+        -------
+        progresses : list of tuple of (bool, dict of str : value)
+
+        """
+
+        reference = self.reference
+
+        if self.state_cache is not None:
+
+            # reuse or share the images with the distance metric
+            sup_images = self.state_cache.superimposed_images(states, reference.image_idxs,
+                                                              reference.image_bs_idxs,
+                                                              reference.image_lig_idxs,
+                                                              reference.ref_image)
+
+            rmsds = batch_geometry.calc_rmsd(reference.ref_image, sup_images,
+                                             idxs=reference.image_lig_idxs)
+
+        else:
+            # only the ligand and binding site atoms are needed for all
+            # of the steps so the rest of the system is never copied,
+            # and only they are sent to the workers
+            images, box_lengths = reference.stack_images(states)
+
+            rmsds = self._native_rmsds(images, box_lengths)
+
+        return [(bool(native_rmsd <= self.cutoff_rmsd), {'native_rmsd' : native_rmsd})
+                for native_rmsd in rmsds]
+
+    def _native_rmsds(self, images, box_lengths):
+        """Compute `native_rmsds` with the executor.
+
+        Parameters
+        ----------
+        images : arraylike of shape (n_images, n_image_atoms, 3)
+
+        box_lengths : arraylike of shape (n_images, 3)
+
+        Returns
+        -------
+        native_rmsds : arraylike of shape (n_images,)
+
+        """
+
+        num_images = images.shape[0]
+
+        if self._executor_spec == 'serial':
+            return native_rmsds(self.reference, images, box_lengths)
+
+        # split the images into a few chunks per worker
+        chunksize = max(1, -(-num_images // (4 * self.num_workers)))
+        chunk_starts = range(0, num_images, chunksize)
+
+        # only the reference is sent with each chunk
+        chunk_rmsds = self.executor.map(partial(native_rmsds, self.reference),
+                                        [images[i:i + chunksize] for i in chunk_starts],
+                                        [box_lengths[i:i + chunksize] for i in chunk_starts])
+
+        return np.concatenate(list(chunk_rmsds))
+
     def _progress(self, walker):
         """Calculate if the walker has bound and provide progress record.
+        The result is cached for the walker state for the rest of the
+        cycle.
         Parameters
         ----------
         walker : object implementing the Walker interface
@@ -159,35 +614,50 @@ class RebindingBC(ReceptorBC):
            for this walker alone.
         """
 
-        # first recenter the ligand and the receptor in the walker
-        box_lengths, box_angles = box_vectors_to_lengths_angles(walker.state['box_vectors'])
-        grouped_walker_pos = group_pair(walker.state['positions'], box_lengths,
-                                     self.binding_site_idxs, self.ligand_idxs)
-
-        # center the positions around the center of the binding site
-        centered_walker_pos = center_around(grouped_walker_pos, self.binding_site_idxs)
+        progress = self.progress_cache.get(walker.state)
 
-        # superimpose the walker state positions over the native state
-        # matching the binding site indices only
-        sup_walker_pos, _, _ = superimpose(self.native_state['positions'], centered_walker_pos,
-                                 idxs=self.binding_site_idxs)
+        if progress is None:
+            progress = self._calc_progress(walker)
+            self.progress_cache.add(walker.state, progress)
 
-        # calculate the rmsd of the walker ligand (superimposed
-        # according to the binding sites) to the native state ligand
-        native_rmsd = calc_rmsd(self.native_state['positions'], sup_walker_pos,
-                                idxs=self.ligand_idxs)
+        return progress
 
-        # test to see if the ligand is re-bound
-        rebound = False
-        if native_rmsd <= self.cutoff_rmsd:
-            rebound = True
+    def _calc_progress(self, walker):
+        """Calculate the progress of a walker without the cache, see
+        `_progress`."""
 
-        progress_data = {'native_rmsd' : native_rmsd}
-
-        return rebound, progress_data
+        return self._calc_progresses([walker.state])[0]
 
 
 class NewRebindingBC(RebindingBC):
+    """RebindingBC with separate ligand and binding site indices for
+    the native state.
+
+    Optionally only computes the exact ligand RMSD of all walkers every
+    `exact_rmsd_stride` cycles. On the other cycles a lower bound of the
+    RMSD is computed from the centroids of the ligand and binding site:
+    the superposition maps the binding site centroid of a walker onto
+    the native one, so the distance of the superimposed ligand centroid
+    to the native ligand centroid is at least the difference of the
+    ligand to binding site centroid distances in the walker and the
+    native state, and the RMSD is at least that centroid distance. Only
+    walkers whose bound is within the cutoff are superimposed and can
+    be warped, the others are recorded with a 'native_rmsd' of NaN.
+
+    The 'native_rmsd' is always the exact RMSD when it isn't NaN, and
+    `progress`, which resamplers use, always gives the exact RMSD of
+    every walker. The bounds are only used when warping and are never
+    added to the progress cache.
+    """
+
+    # progress fields only recorded when the prefilter is used, i.e.
+    # with an exact_rmsd_stride over 1, see `progress_field_names`
+    PREFILTER_PROGRESS_FIELDS = ('native_rmsd_lower_bound',)
+    PREFILTER_PROGRESS_SHAPES = (Ellipsis,)
+    PREFILTER_PROGRESS_DTYPES = (np.float,)
+    """The 'native_rmsd_lower_bound' is the centroid lower bound of
+    the RMSD of the walkers that weren't superimposed and the exact
+    RMSD of the others."""
 
     def __init__(self,
                  native_state=None,
@@ -198,17 +668,35 @@ class NewRebindingBC(RebindingBC):
                  binding_site_idxs=None,
                  native_state_ligand_idxs=None,
                  native_state_binding_site_idxs=None,
+                 exact_rmsd_stride=1,
                  **kwargs):
+        """Constructor for NewRebindingBC.
 
+        Arguments
+        ---------
 
-        super().__init__(native_state=native_state,
-                         cutoff_rmsd = cutoff_rmsd,
-                         initial_states = initial_states,
-                         initial_weights = initial_weights,
-                         ligand_idxs = ligand_idxs,
-                         binding_site_idxs = binding_site_idxs,
-                         **kwargs)
+        See RebindingBC arguments
 
+        native_state_ligand_idxs : arraylike of int, optional
+            The indices of the ligand in the native state, defaults to
+            ligand_idxs.
+
+        native_state_binding_site_idxs : arraylike of int, optional
+            The indices of the binding site in the native state,
+            defaults to binding_site_idxs.
+
+        exact_rmsd_stride : int, optional
+            The exact RMSD of all walkers is computed on the cycles
+            that are multiples of this, on the others only for the
+            walkers that pass the centroid prefilter. The default of 1
+            computes it for all walkers every cycle. The prefilter
+            saves nothing if the superimposed images are shared with
+            the distance metric through the state_cache, since the
+            distance metric needs them for every walker anyway.
+
+        """
+
+        # needed for the reference made by the RebindingBC constructor
         if type(native_state_ligand_idxs) == type(None):
            self.native_ligand_idxs = ligand_idxs
         else:
@@ -220,111 +708,202 @@ class NewRebindingBC(RebindingBC):
         else:
             self.native_bs_idxs = native_state_binding_site_idxs
 
+        super().__init__(native_state=native_state,
+                         cutoff_rmsd = cutoff_rmsd,
+                         initial_states = initial_states,
+                         initial_weights = initial_weights,
+                         ligand_idxs = ligand_idxs,
+                         binding_site_idxs = binding_site_idxs,
+                         **kwargs)
+
+        assert exact_rmsd_stride >= 1, "exact_rmsd_stride must be at least 1"
+        self.exact_rmsd_stride = exact_rmsd_stride
+
+        # the progress of the walkers ruled out by the prefilter this
+        # cycle, only set while warping, see `warp_walkers`
+        self._bound_progresses = None
+
+    def _native_image_member_idxs(self):
+        """The ligand and binding site indices of the native state."""
+
+        return self.native_ligand_idxs, self.native_bs_idxs
+
+    @property
+    def _prefilter_fields(self):
+        """Whether the progress records have the prefilter fields."""
+
+        return self.exact_rmsd_stride > 1
+
+    def progress_field_names(self):
+        """The names of the progress record fields, with the prefilter
+        fields if the prefilter is used."""
+
+        if self._prefilter_fields:
+            return self.PROGRESS_FIELDS + self.PREFILTER_PROGRESS_FIELDS
+
+        return self.PROGRESS_FIELDS
 
-        # number of atoms of in the ligand and binding site
+    def progress_field_shapes(self):
+        """The shapes of the progress record fields, see
+        `progress_field_names`."""
 
-        self._n_lig_atoms = len(self.ligand_idxs)
-        self._n_bs_atoms = len(self.binding_site_idxs)
+        if self._prefilter_fields:
+            return self.PROGRESS_SHAPES + self.PREFILTER_PROGRESS_SHAPES
 
+        return self.PROGRESS_SHAPES
 
-        # the idxs used for the whole image
-        self._image_idxs = np.concatenate( (self.ligand_idxs,
-                                            self.binding_site_idxs) )
+    def progress_field_dtypes(self):
+        """The dtypes of the progress record fields, see
+        `progress_field_names`."""
 
-        self._native_image_idxs = np.concatenate((self.native_ligand_idxs,
-                                                  self.native_bs_idxs))
+        if self._prefilter_fields:
+            return self.PROGRESS_DTYPES + self.PREFILTER_PROGRESS_DTYPES
 
-        # the idxs of the ligand and binding site within the image
-        self._image_lig_idxs = np.arange(self._n_lig_atoms)
+        return self.PROGRESS_DTYPES
 
-        self._image_bs_idxs = np.arange(self._n_lig_atoms,
-                                        self._n_lig_atoms + self._n_bs_atoms)
+    def progress_record_field_names(self):
+        """The progress record fields used for tables, see
+        `progress_field_names`."""
 
-        self.ref_image = self._native_state['positions'][self._native_image_idxs]
+        if self._prefilter_fields:
+            return self.PROGRESS_RECORD_FIELDS + self.PREFILTER_PROGRESS_FIELDS
 
+        return self.PROGRESS_RECORD_FIELDS
 
+    def warp_walkers(self, walkers, cycle):
+        """Test the progress of all the walkers, warp if required, and update
+        the boundary conditions.
+
+        See `RebindingBC.warp_walkers`, the centroid prefilter is used
+        on the cycles that aren't multiples of exact_rmsd_stride.
+
+        """
+
+        if cycle % self.exact_rmsd_stride == 0:
+            return super().warp_walkers(walkers, cycle)
+
+        self._bound_progresses = ProgressCache()
+
+        try:
+            return super().warp_walkers(walkers, cycle)
+
+        finally:
+            self._bound_progresses = None
+
+    def progress(self, walkers):
+        """Calculate if the walkers have bound and provide their progress
+        records.
+
+        See `RebindingBC.progress`. While warping with the prefilter
+        only the walkers whose RMSD lower bound is within the cutoff
+        get the exact RMSD, otherwise all of them do.
 
-    def _unaligned_image(self, state, ref_state = False):
-        """The preprocessing method of states.
-        First it groups the binding site and ligand into the same
-        periodic box image and then centers the box around their
-        mutual center of mass and returns only the positions of the
-        binding site and ligand.
         Parameters
         ----------
-        state : object implementing WalkerState
-            State with 'positions' (Nx3 dims) and 'box_vectors' (3x3
-            array) attributes.
+        walkers : list of objects implementing the Walker interface
+
         Returns
         -------
-        """
+        progresses : list of tuple of (bool, dict of str : value)
+           The `_progress` results of the walkers.
 
-        if ref_state:
-            bs_idxs = self.native_bs_idxs
-            lig_idxs = self.native_ligand_idxs
-            image_idxs = self._native_image_idxs
+        """
 
-        else:
-            bs_idxs = self.binding_site_idxs
-            lig_idxs = self.ligand_idxs
-            image_idxs = self._image_idxs
+        if self._bound_progresses is None:
+            return super().progress(walkers)
 
-        # get the box lengths from the vectors
-        box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
+        missing_walkers = [walker for walker in walkers
+                           if self.progress_cache.get(walker.state) is None]
 
-        # recenter the protein-ligand complex into the center of the
-        # periodic boundary conditions
+        if len(missing_walkers) > 0:
 
-        # regroup the ligand and protein in together
-        grouped_positions = group_pair(state['positions'], box_lengths,
-                                       bs_idxs, lig_idxs)
+            lower_bounds = self._native_rmsd_lower_bounds([walker.state
+                                                           for walker in missing_walkers])
 
-        # then center them around the binding site
-        centered_positions = center_around(grouped_positions, bs_idxs)
+            # the others can't be bound, their bounds are kept apart
+            # from the exact progresses
+            passing_walkers = []
+            for walker, lower_bound in zip(missing_walkers, lower_bounds):
+                if lower_bound > self.cutoff_rmsd:
+                    self._bound_progresses.add(walker.state,
+                                               (False, {'native_rmsd' : np.nan,
+                                                        'native_rmsd_lower_bound' : lower_bound}))
+                else:
+                    passing_walkers.append(walker)
 
-        # slice these positions to get the image
-        state_image = centered_positions[image_idxs]
+            # the exact progress of the rest is computed together and
+            # cached
+            if len(passing_walkers) > 0:
+                super().progress(passing_walkers)
 
-        return state_image
+        return [self._progress(walker) for walker in walkers]
 
-
-    def _progress(self, walker):
-        """Calculate if the walker has bound and provide progress record.
+    def _native_rmsd_lower_bounds(self, states):
+        """Lower bounds of the ligand RMSD of many states from the
+        centroids of their ligand and binding site.
 
         Parameters
         ----------
-        walker : object implementing the Walker interface
+        states : list of objects implementing WalkerState
 
         Returns
         -------
-        is_bound : bool
-           Whether the walker is unbound (warped) or not
+        lower_bounds : arraylike of shape (n_states,)
 
-        progress_data : dict of str : value
-           Dictionary of the progress record group fields
-           for this walker alone.
+        """
+
+        reference = self.reference
+
+        images, box_lengths = reference.stack_images(states)
+        lig_centroids = images[:, reference.image_lig_idxs].mean(axis=1)
+        bs_centroids = images[:, reference.image_bs_idxs].mean(axis=1)
+
+        # the same periodic image of the ligand as `group_pair`
+        centroid_diffs = bs_centroids - lig_centroids
+        half_box_lengths = box_lengths * 0.5
+        centroid_diffs -= (np.where(centroid_diffs > half_box_lengths, box_lengths, 0.0) -
+                           np.where(centroid_diffs < -half_box_lengths, box_lengths, 0.0))
+
+        centroid_dists = np.linalg.norm(centroid_diffs, axis=1)
+
+        return np.abs(centroid_dists - reference.ref_centroid_dist)
+
+    def _progress(self, walker):
+        """Calculate if the walker has bound and provide progress record.
+
+        See `RebindingBC._progress`, while warping with the prefilter
+        the walkers it ruled out get their lower bound progress.
 
         """
 
-        # first recenter the ligand and the receptor in the walker
-        state_image = self._unaligned_image(walker.state, ref_state=False)
+        if self._bound_progresses is not None:
+
+            progress = self._bound_progresses.get(walker.state)
+
+            if progress is not None:
+                return progress
+
+        return super()._progress(walker)
 
-        # superimpose the walker state positions over the native state
-        # matching the binding site indices only
-        sup_walker_pos, _, _ = superimpose(self.ref_image,
-                                           state_image,
-                                           idxs=self._image_bs_idxs)
+    def _calc_progresses(self, states):
+        """Calculate the exact progress of many states at once without
+        the cache, see `RebindingBC._calc_progresses`.
 
-        # calculate the rmsd of the walker ligand (superimposed
-        # according to the binding sites) to the native state ligand
-        native_rmsd = calc_rmsd(self.ref_image, sup_walker_pos,
-                                idxs=self._image_lig_idxs)
+        Parameters
+        ----------
+        states : list of objects implementing WalkerState
+
+        Returns
+        -------
+        progresses : list of tuple of (bool, dict of str : value)
+
+        """
 
-        # test to see if the ligand is re-bound
-        rebound = False
-        if native_rmsd <= self.cutoff_rmsd:
-            rebound = True
+        progresses = super()._calc_progresses(states)
 
-        progress_data = {'native_rmsd' : native_rmsd}
+        # the RMSD is its own tightest lower bound
+        if self._prefilter_fields:
+            for rebound, progress_data in progresses:
+                progress_data['native_rmsd_lower_bound'] = progress_data['native_rmsd']
 
-        return rebound, progress_data
+        return progresses
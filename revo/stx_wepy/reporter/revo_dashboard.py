@@ -6,6 +6,9 @@ import logging
 from wepy.resampling.decisions.clone_merge import MultiCloneMergeDecision
 from wepy.reporter.dashboard import ResamplerDashboardSection
 
+from stx_wepy.resampling.distance_records import upper_triangle_from_record
+from stx_wepy.resampling.instrumentation import PHASES
+
 import numpy as np
 import pandas as pd
 
@@ -26,6 +29,12 @@ Average All to All Distance: {{ avg_distance }}
 Minimum All to All Distance: {{ min_distance }}
 Maximum All to All Distance: {{ max_distance }}
 Variation value = {{ variation }}
+** Instrumentation
+Trial moves: {{ num_trial_moves }}
+Accepted moves: {{ num_accepted_moves }}
+Image time (s): {{ phase_times['image'] }}
+Distance time (s): {{ phase_times['distance'] }}
+Decide time (s): {{ phase_times['decide'] }}
 """
 
     def __init__(self, resampler=None,
@@ -86,6 +95,10 @@ Variation value = {{ variation }}
         self.min_distance = None
         self.max_distance = None
         self.variation_values = None
+        # instrumentation, None if not measured
+        self.num_trial_moves = None
+        self.num_accepted_moves = None
+        self.phase_times = {phase : None for phase in PHASES}
 
     def update_values(self, **kwargs):
 
@@ -105,18 +118,49 @@ Variation value = {{ variation }}
         for resampler_record in kwargs['resampler_data']:
 
             self.variation_value = resampler_record['variation'][0]
-            distance_matrix = resampler_record['distance_matrix']
+
+            #get the upper triangle values of the distance_matrix, this
+            #works for records of any distance storage
+            distance_values = upper_triangle_from_record(resampler_record['distance_matrix'],
+                                                         resampler_record['num_walkers'][0])
+
+            self.update_instrumentation(resampler_record)
 
 
-        #get the upper triangle values of the distance_matrix
-        distance_matrix = np.triu(distance_matrix)
-        distance_values= distance_matrix[np.where(distance_matrix>0)]
+        distance_values= distance_values[np.where(distance_values>0)]
         self.avg_distance = np.average(distance_values)
         self.min_distance = np.min(distance_values)
         self.max_distance  = np.max(distance_values)
 
         self.cycle_idx = kwargs['cycle_idx']
 
+    def update_instrumentation(self, resampler_record):
+        """Update the counters and phase times from a resampler record.
+
+        The record only has the fields measured at the instrumentation
+        level of the resampler, the values of the missing ones, e.g.
+        all of them at the 'off' level or for resamplers without
+        instrumentation, are set to None.
+
+        Parameters
+        ----------
+
+        resampler_record : dict of str : arraylike
+
+        """
+
+        if 'num_trial_moves' in resampler_record:
+            self.num_trial_moves = int(resampler_record['num_trial_moves'][0])
+            self.num_accepted_moves = int(resampler_record['num_accepted_moves'][0])
+        else:
+            self.num_trial_moves = None
+            self.num_accepted_moves = None
+
+        if 'phase_times' in resampler_record:
+            self.phase_times = dict(zip(PHASES, resampler_record['phase_times']))
+        else:
+            self.phase_times = {phase : None for phase in PHASES}
+
     def gen_fields(self, **kwargs):
 
         fields = super().gen_fields(**kwargs)
@@ -131,7 +175,10 @@ Variation value = {{ variation }}
             'avg_distance' : self.avg_distance,
             'min_distance' : self.min_distance,
             'max_distance' : self.max_distance,
-            'variation' : self.variation_value
+            'variation' : self.variation_value,
+            'num_trial_moves' : self.num_trial_moves,
+            'num_accepted_moves' : self.num_accepted_moves,
+            'phase_times' : self.phase_times,
         }
 
         fields.update(new_fields)
@@ -1,42 +1,204 @@
 import os
 import os.path as osp
+import copy
 import pickle
 import logging
+from collections import deque
+
+import numpy as np
 
 from wepy.reporter.reporter import Reporter
 
+from stx_wepy.resampling.executors import make_executor
+
+
+def snapshot_walkers(walkers):
+    """Copy the walkers so they can be written while the simulation
+    goes on.
+
+    The values states keep in their `_data` dict, which is all of them
+    for a `WalkerState` and the extra values of an `OpenMMState`, are
+    copied if they are arrays. The OpenMM State an `OpenMMState`
+    wraps is shared with the copy, it is a snapshot of the simulation
+    that can't be modified.
+
+    Parameters
+    ----------
+    walkers : list of objects implementing the Walker interface
+
+    Returns
+    -------
+    walkers : list of objects implementing the Walker interface
+
+    """
+
+    snapshot = []
+    for walker in walkers:
+
+        state = copy.copy(walker.state)
+
+        data = getattr(state, '_data', None)
+        if isinstance(data, dict):
+            state._data = {key : np.array(value) if isinstance(value, np.ndarray) else value
+                           for key, value in data.items()}
+
+        snapshot.append(type(walker)(state, walker.weight))
+
+    return snapshot
+
+
+def write_checkpoint(walkers, pkl_path, old_pkl_path=None):
+    """Pickle walkers and then remove an old pickle.
+
+    The pickle is written to a temporary file which is renamed to
+    `pkl_path` when it is complete, so a pickle at `pkl_path` is never
+    partially written even if the simulation is killed.
+
+    Parameters
+    ----------
+    walkers : list of objects implementing the Walker interface
+
+    pkl_path : str
+
+    old_pkl_path : str, optional
+        The pickle to remove once the new one is written.
+
+    """
+
+    tmp_pkl_path = pkl_path + '.tmp'
+
+    with open(tmp_pkl_path, 'wb') as wf:
+        pickle.dump(walkers, wf)
+        wf.flush()
+        os.fsync(wf.fileno())
+
+    os.replace(tmp_pkl_path, pkl_path)
+
+    if old_pkl_path is not None:
+        try:
+            os.remove(old_pkl_path)
+        except FileNotFoundError:
+            pass
+
+
 class WalkersPickleReporter(Reporter):
-     def __init__(self, save_dir='./', freq=100, num_backups=2):
-         # the directory to save the pickles in                                                                                                                                                            
+     """Backs up the walkers as pickles every `freq` cycles.
+
+     The walkers are copied (see `snapshot_walkers`) and written by the
+     executor while the next cycle runs. At most `max_in_flight`
+     pickles are waiting to be written, when there are more `report`
+     waits for the oldest one, which caps the memory held by the
+     copies. Errors from writing are raised by the next call to
+     `report` or by `cleanup`. With the 'serial' executor the pickles
+     are written in `report`.
+
+     A pickled reporter makes its executor again when it is first
+     used, an executor instance that was given is replaced by a
+     'thread' one since pools can't be pickled.
+     """
+
+     def __init__(self, save_dir='./', freq=100, num_backups=2,
+                  executor='thread', max_in_flight=1):
+         # the directory to save the pickles in
          self.save_dir = save_dir
-         # the frequency of cycles to backup the walkers as a pickle                                                                                                                                       
+         # the frequency of cycles to backup the walkers as a pickle
          self.backup_freq = freq
-         # the number of sets of walker pickles to keep, this will keep                                                                                                                                    
-         # the last `num_backups`                                                                                                                                                                          
+         # the number of sets of walker pickles to keep, this will keep
+         # the last `num_backups`
          self.num_backups = num_backups
 
+         assert max_in_flight >= 1, "max_in_flight must be at least 1"
+         # the number of pickles that can be waiting to be written
+         self.max_in_flight = max_in_flight
+
+         # the executor writing the pickles, made when first used. It
+         # has a single worker so the pickles are written and removed
+         # in order
+         self._executor_spec = executor
+         self._executor = None
+
+         # futures of the pickles not known to be written, oldest first
+         self._in_flight = deque()
+
+     def __getstate__(self):
+
+         state = self.__dict__.copy()
+
+         # pools and futures can't be pickled, the executor is made
+         # again when first used. An executor that was given is
+         # replaced by a thread like the default
+         state['_executor'] = None
+         if not isinstance(self._executor_spec, str):
+             state['_executor_spec'] = 'thread'
+         state['_in_flight'] = deque()
+
+         return state
+
+     @property
+     def executor(self):
+         """The executor writing the pickles."""
+
+         if self._executor is None:
+             self._executor = make_executor(self._executor_spec, num_workers=1)
+
+         return self._executor
+
+     def _wait(self, max_in_flight=0):
+         """Wait until at most `max_in_flight` pickles are being written,
+         raising any errors from writing them."""
+
+         # finished pickles are taken off in order
+         while self._in_flight and (len(self._in_flight) > max_in_flight or
+                                    self._in_flight[0].done()):
+             self._in_flight.popleft().result()
+
      def init(self, *args, **kwargs):
-         # make sure the save_dir exists                                                                                                                                                                   
+         # finish writing the pickles of a previous run
+         self._wait()
+         # make sure the save_dir exists
          if not osp.exists(self.save_dir):
              os.makedirs(self.save_dir)
-         # delete backup pickles in the save_dir if they exist                                                                                                                                             
+         # delete backup pickles in the save_dir if they exist
          else:
              for pkl_fname in os.listdir(self.save_dir):
                  os.remove(osp.join(self.save_dir, pkl_fname))
 
      def report(self, cycle_idx=None, new_walkers=None,
                 **kwargs):
-         # ignore all args and kwargs                                                                                                                                                                      
-         # total number of cycles completed                                                                                                                                                                
+         # ignore all args and kwargs
+         # total number of cycles completed
          n_cycles = cycle_idx + 1
-         # if the cycle is on the frequency backup walkers to a pickle                                                                                                                                     
+         # if the cycle is on the frequency backup walkers to a pickle
          if n_cycles % self.backup_freq == 0:
              pkl_name = "walkers_cycle_{}.pkl".format(cycle_idx)
              pkl_path = osp.join(self.save_dir, pkl_name)
-             with open(pkl_path, 'wb') as wf:
-                 pickle.dump(new_walkers, wf)
-             # remove old pickles if we have more than the `num_backups`                                                                                                                                   
+             # remove old pickles if we have more than the
+             # `num_backups`, only after the new one is written
+             old_pkl_path = None
              if (cycle_idx // self.backup_freq) >= self.num_backups:
                  old_idx = cycle_idx - self.num_backups * self.backup_freq
                  old_pkl_fname = "walkers_cycle_{}.pkl".format(old_idx)
-                 os.remove(osp.join(self.save_dir, old_pkl_fname))
+                 old_pkl_path = osp.join(self.save_dir, old_pkl_fname)
+
+             walkers = snapshot_walkers(new_walkers)
+
+             # make room for this pickle
+             self._wait(self.max_in_flight - 1)
+
+             self._in_flight.append(self.executor.submit(write_checkpoint,
+                                                         walkers, pkl_path,
+                                                         old_pkl_path=old_pkl_path))
+
+             logging.debug("Backing up the walkers of cycle {}".format(cycle_idx))
+
+         # raise errors from the pickles already written
+         self._wait(len(self._in_flight))
+
+     def cleanup(self, *args, **kwargs):
+         # finish writing all the pickles
+         try:
+             self._wait()
+         finally:
+             if self._executor is not None and isinstance(self._executor_spec, str):
+                 self._executor.shutdown(wait=True)
+                 self._executor = None
@@ -0,0 +1,142 @@
+"""Storage of the all-to-all distance matrix in the resampler records.
+
+The distance matrix can be recorded either as the full square matrix
+flattened in row major order ('full') or as only its strict upper
+triangle in row major order and single precision ('triu32'), which is
+less than half the size.
+
+The reader functions here work with records in either format.
+
+"""
+
+import numpy as np
+
+DISTANCE_STORAGES = ('full', 'triu32')
+
+
+def compress_distance_matrix(distance_matrix, storage='full'):
+    """Make the resampler record value of a distance matrix.
+
+    Parameters
+    ----------
+
+    distance_matrix : list of arraylike of shape (num_walkers)
+
+    storage : str
+        One of `DISTANCE_STORAGES`.
+
+    Returns
+    -------
+
+    distance_record : arraylike of shape (num_walkers**2,) or (num_walkers * (num_walkers - 1) / 2,)
+
+    """
+
+    assert storage in DISTANCE_STORAGES, \
+        "storage must be one of {}, not {}".format(DISTANCE_STORAGES, storage)
+
+    distance_matrix = np.array(distance_matrix)
+
+    if storage == 'triu32':
+        num_walkers = distance_matrix.shape[0]
+        return distance_matrix[np.triu_indices(num_walkers, k=1)].astype(np.float32)
+
+    return np.ravel(distance_matrix)
+
+
+def _record_storage(distance_record, num_walkers=None):
+
+    num_values = len(distance_record)
+
+    if num_walkers is None:
+
+        square_num_walkers = int(round(np.sqrt(num_values)))
+        is_square = square_num_walkers**2 == num_values
+
+        triangle_num_walkers = int(round((1 + np.sqrt(1 + 8 * num_values)) / 2))
+        is_triangle = triangle_num_walkers * (triangle_num_walkers - 1) // 2 == num_values
+
+        # e.g. 36 values can be a full 6x6 matrix or the triangle of
+        # a 9x9 matrix
+        assert not (is_square and is_triangle), \
+            "The number of walkers must be given for a record of {} values".format(num_values)
+        assert is_square or is_triangle, \
+            "A distance record of {} values is not a square or triangular matrix".format(num_values)
+
+        num_walkers = square_num_walkers if is_square else triangle_num_walkers
+
+    if num_values == num_walkers**2:
+        return 'full', num_walkers
+
+    assert num_values == num_walkers * (num_walkers - 1) // 2, \
+        "A distance record of {} values does not match {} walkers".format(num_values,
+                                                                          num_walkers)
+
+    return 'triu32', num_walkers
+
+
+def upper_triangle_from_record(distance_record, num_walkers=None):
+    """The strict upper triangle of the distance matrix of a record.
+
+    Parameters
+    ----------
+
+    distance_record : arraylike
+        The 'distance_matrix' value of a resampler record in any of
+        the storage formats.
+
+    num_walkers : int, optional
+        The number of walkers, only needed when the format of the
+        record is ambiguous.
+
+    Returns
+    -------
+
+    distances : arraylike of shape (num_walkers * (num_walkers - 1) / 2,)
+        The distances of the pairs (i, j) with i < j in row major
+        order.
+
+    """
+
+    distance_record = np.asarray(distance_record)
+
+    storage, num_walkers = _record_storage(distance_record, num_walkers)
+
+    if storage == 'full':
+        return distance_record.reshape(num_walkers, num_walkers)[np.triu_indices(num_walkers, k=1)]
+
+    return distance_record
+
+
+def distance_matrix_from_record(distance_record, num_walkers=None):
+    """Reconstruct the square distance matrix of a record.
+
+    Parameters
+    ----------
+
+    distance_record : arraylike
+        The 'distance_matrix' value of a resampler record in any of
+        the storage formats.
+
+    num_walkers : int, optional
+        The number of walkers, only needed when the format of the
+        record is ambiguous.
+
+    Returns
+    -------
+
+    distance_matrix : arraylike of shape (num_walkers, num_walkers)
+
+    """
+
+    distance_record = np.asarray(distance_record)
+
+    storage, num_walkers = _record_storage(distance_record, num_walkers)
+
+    if storage == 'full':
+        return distance_record.reshape(num_walkers, num_walkers)
+
+    distance_matrix = np.zeros((num_walkers, num_walkers), dtype=distance_record.dtype)
+    distance_matrix[np.triu_indices(num_walkers, k=1)] = distance_record
+
+    return distance_matrix + distance_matrix.T
@@ -0,0 +1,129 @@
+"""Kernels for the minimum distances between pairs of residues that
+work directly on a coordinate array.
+
+These are alternatives to building an `mdtraj.Trajectory` for every
+image and calling `mdtraj.compute_distances`. The atoms of the two
+groups of residues are given ordered by residue so that the atoms of
+each residue are a contiguous segment starting at its offset, see
+`ProteinProteinContacts`.
+
+The kernels compute the distances in float64 while mdtraj uses
+float32, so the contacts differ from the mdtraj ones by ~1e-7 and
+'mdtraj' stays the default backend, the kernels are opt-in. The numba
+kernel is only available if numba is installed and is ~3x faster than
+mdtraj on the interface of the 6HAX crystal structure, the numpy
+kernel is the fallback without numba. `ProteinProteinContacts` checks
+the kernels against mdtraj on the native state when it is made.
+
+"""
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+CONTACT_BACKENDS = ('mdtraj', 'numpy', 'numba')
+
+DEFAULT_CONTACTS_BACKEND = 'mdtraj'
+
+
+def residue_min_distances_numpy(coords_1, coords_2, res_offsets_1, res_offsets_2):
+    """Minimum distance between the atoms of every pair of residues from
+    two groups.
+
+    Parameters
+    ----------
+
+    coords_1 : arraylike of shape (n_atoms_1, 3)
+        The coordinates of the atoms of group 1 ordered by residue.
+
+    coords_2 : arraylike of shape (n_atoms_2, 3)
+        The coordinates of the atoms of group 2 ordered by residue.
+
+    res_offsets_1 : arraylike of int of shape (n_residues_1,)
+        The index of the first atom of each residue of group 1.
+
+    res_offsets_2 : arraylike of int of shape (n_residues_2,)
+        The index of the first atom of each residue of group 2.
+
+    Returns
+    -------
+
+    min_distances : arraylike of float of shape (n_residues_1 * n_residues_2,)
+        The minimum distances with the group 1 residues as the outer
+        and the group 2 residues as the inner index.
+
+    """
+
+    sq_distances = cdist(np.asarray(coords_1, dtype=np.float64),
+                         np.asarray(coords_2, dtype=np.float64),
+                         'sqeuclidean')
+
+    # reduce over the residues of group 1 and then group 2 and only
+    # take the square root of the minimum of each pair of residues
+    min_sq_distances = np.minimum.reduceat(
+        np.minimum.reduceat(sq_distances, res_offsets_1, axis=0),
+        res_offsets_2, axis=1)
+
+    return np.sqrt(min_sq_distances).ravel()
+
+
+def _residue_min_distances_loop(coords_1, coords_2, res_offsets_1, res_offsets_2):
+
+    n_residues_1 = res_offsets_1.shape[0]
+    n_residues_2 = res_offsets_2.shape[0]
+
+    min_distances = np.empty(n_residues_1 * n_residues_2)
+
+    for res_1 in range(n_residues_1):
+
+        start_1 = res_offsets_1[res_1]
+        if res_1 + 1 < n_residues_1:
+            end_1 = res_offsets_1[res_1 + 1]
+        else:
+            end_1 = coords_1.shape[0]
+
+        for res_2 in range(n_residues_2):
+
+            start_2 = res_offsets_2[res_2]
+            if res_2 + 1 < n_residues_2:
+                end_2 = res_offsets_2[res_2 + 1]
+            else:
+                end_2 = coords_2.shape[0]
+
+            min_sq_distance = np.inf
+            for i in range(start_1, end_1):
+                for j in range(start_2, end_2):
+
+                    sq_distance = ((coords_1[i, 0] - coords_2[j, 0])**2 +
+                                   (coords_1[i, 1] - coords_2[j, 1])**2 +
+                                   (coords_1[i, 2] - coords_2[j, 2])**2)
+
+                    if sq_distance < min_sq_distance:
+                        min_sq_distance = sq_distance
+
+            min_distances[res_1 * n_residues_2 + res_2] = np.sqrt(min_sq_distance)
+
+    return min_distances
+
+
+if numba is not None:
+    _residue_min_distances_numba = numba.njit(cache=True, nogil=True)(_residue_min_distances_loop)
+
+
+def residue_min_distances_numba(coords_1, coords_2, res_offsets_1, res_offsets_2):
+    """Same as `residue_min_distances_numpy` but with a compiled loop
+    that doesn't make the full matrix of atom distances.
+
+    Requires numba.
+
+    """
+
+    assert numba is not None, "The numba contact kernel requires numba to be installed"
+
+    return _residue_min_distances_numba(np.ascontiguousarray(coords_1, dtype=np.float64),
+                                        np.ascontiguousarray(coords_2, dtype=np.float64),
+                                        res_offsets_1, res_offsets_2)
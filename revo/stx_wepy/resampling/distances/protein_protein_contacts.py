@@ -2,16 +2,24 @@ import logging
 
 import numpy as np
 import mdtraj as mdj
+from scipy.spatial import cKDTree
 
 from wepy.util.util import box_vectors_to_lengths_angles
 
-from geomm.grouping import group_pair
 from geomm.superimpose import superimpose
-from geomm.centering import center_around
 
 
 from wepy.resampling.distances.distance import Distance
 
+from stx_wepy.util.state_cache import centered_image
+from stx_wepy.resampling.distances.contacts import (
+    CONTACT_BACKENDS,
+    DEFAULT_CONTACTS_BACKEND,
+    numba,
+    residue_min_distances_numpy,
+    residue_min_distances_numba,
+)
+
 
 class ProteinProteinContacts(Distance):
     """Distance metric for measuring differences between walker states in
@@ -59,8 +67,40 @@ class ProteinProteinContacts(Distance):
 
     k : float
 
+    neighbor_search : bool
+        If True only the atom pairs closer than `contact_horizon` are
+        evaluated using a KD-tree, residue pairs with no atoms within
+        the horizon are treated as having no contact. If False
+        (default) all atom pairs are computed exactly, which is useful
+        for validating the neighbor search.
+
+    contact_horizon : float
+        The distance beyond which residues are considered to not be in
+        contact when `neighbor_search` is used. Defaults to
+        `distance_cutoff + CONTACT_HORIZON_TAIL / k` where the contact
+        strength is ~1e-9.
+
+    contacts_backend : str
+        One of `CONTACT_BACKENDS`, how the exact residue minimum
+        distances are computed when not using the neighbor search.
+        'mdtraj' (default) uses `mdtraj.compute_distances` in
+        float32. 'numpy' and 'numba' compute them in float64 directly
+        from the coordinates without making a Trajectory, see
+        `contacts`, so the contacts differ from the mdtraj ones by
+        ~1e-7. 'numba' falls back to 'numpy' with a warning if numba
+        isn't installed. The contacts of the native state from the
+        kernels are checked against 'mdtraj' when the metric is made.
+
+    state_cache : StatePreprocessingCache
+        Cache of the grouped and centered images of states that is
+        shared with other metrics making images of the same states.
+
     """
 
+    CONTACT_HORIZON_TAIL = 20.0
+    """The default contact horizon past the distance cutoff in units of
+    1/k."""
+
 
     def __init__(self,
                  prot_1_resids= None,
@@ -71,6 +111,10 @@ class ProteinProteinContacts(Distance):
                  native_state = None,
                  distance_cutoff = 0.5,
                  k = 1.0,
+                 neighbor_search = False,
+                 contact_horizon = None,
+                 contacts_backend = None,
+                 state_cache = None,
                  **kwargs):
 
         # Ensure all inputs have been given.
@@ -80,6 +124,14 @@ class ProteinProteinContacts(Distance):
         assert prot_2_idxs is not None, 'List of interface atomic indicies for protein 2 must be given'
         assert trajectory is not None, 'MDJ Trajectory must be given.'
         assert native_state is not None, 'Native state must be given.'
+        if contacts_backend is None:
+            contacts_backend = DEFAULT_CONTACTS_BACKEND
+
+        assert contacts_backend in CONTACT_BACKENDS, \
+            'Contacts backend must be one of {}'.format(CONTACT_BACKENDS)
+        if contacts_backend == 'numba' and numba is None:
+            logging.warning("numba is not installed, using the numpy contacts backend")
+            contacts_backend = 'numpy'
 
         # The resids for the residues of interest
         self.prot_1_resids = prot_1_resids
@@ -89,13 +141,22 @@ class ProteinProteinContacts(Distance):
         self.trajectory = trajectory
         self.distance_cutoff = distance_cutoff
         self.k = k
+        self.neighbor_search = neighbor_search
+        self.contacts_backend = contacts_backend
+
+        if contact_horizon is None:
+            self.contact_horizon = self.distance_cutoff + self.CONTACT_HORIZON_TAIL / self.k
+        else:
+            self.contact_horizon = contact_horizon
 
         # number of atoms in each
         self._n_prot_1_idxs = len(self.prot_1_idxs)
         self._n_prot_2_idxs = len(self.prot_2_idxs)
 
-        # the idxs used for the whole image
-        self._image_idxs = np.concatenate( (self.prot_1_idxs, self.prot_2_idxs) )
+        # the idxs used for the whole image, the image atoms are sliced
+        # out of the state before any other processing
+        self._image_idxs = np.ascontiguousarray(
+            np.concatenate( (self.prot_1_idxs, self.prot_2_idxs) ), dtype=np.intp)
 
         # Get topology of the image.
         self._image_traj = self.trajectory.atom_slice(self._image_idxs)
@@ -110,46 +171,98 @@ class ProteinProteinContacts(Distance):
         self.image_prot_1_resids = np.arange(len(self.prot_1_resids))
         self.image_prot_2_resids = np.arange(len(self.prot_1_resids), len(self.prot_1_resids) + len(self.prot_2_resids))
 
+        # mask of the heavy atoms in the image
+        image_heavy_atoms = np.ones(self._image_top.n_atoms, dtype=bool)
+        # select gives an empty float array without hydrogens
+        image_heavy_atoms[self._image_h_idx.astype(int)] = False
+
+        # the residue index of each atom in the image
+        image_atom_resids = np.array([atom.residue.index for atom in self._image_top.atoms])
+
         # Get heavy atom indicies for each residue in protein 1
         self.image_prot_1_residue_dic = {}
 
         for resid in self.image_prot_1_resids:
-            no_h_idx = []
-            resid_idx = self._image_top.select('resid {}'.format(resid))
-
-            for value in resid_idx:
-                if value not in self._image_h_idx:
-                    no_h_idx.append(value)
-
-            self.image_prot_1_residue_dic.update({resid:np.array(no_h_idx)})
+            no_h_idx = np.flatnonzero((image_atom_resids == resid) & image_heavy_atoms)
+            self.image_prot_1_residue_dic.update({resid:no_h_idx})
 
-        # Get heavy atom indicies for each residue in protein 1
+        # Get heavy atom indicies for each residue in protein 2
         self.image_prot_2_residue_dic = {}
 
         for resid in self.image_prot_2_resids:
-            no_h_idx = []
-            resid_idx = self._image_top.select('resid {}'.format(resid))
-
-            for value in resid_idx:
-                if value not in self._image_h_idx:
-                    no_h_idx.append(value)
+            no_h_idx = np.flatnonzero((image_atom_resids == resid) & image_heavy_atoms)
+            self.image_prot_2_residue_dic.update({resid:no_h_idx})
+
+        # Make the table of all heavy atom pairs between the residues
+        # of the two proteins, in the order of the contact strengths
+        # (protein 1 residues outer, protein 2 residues inner). The
+        # pairs of each residue pair are a contiguous segment
+        # starting at the corresponding `_atom_pair_segments` offset.
+        residue_atom_pairs = []
+        for resid_prot_1 in self.image_prot_1_resids:
 
-            self.image_prot_2_residue_dic.update({resid:np.array(no_h_idx)})
+            resid_1_idx = self.image_prot_1_residue_dic[resid_prot_1]
+            assert len(resid_1_idx) > 0, \
+                "Residue {} of protein 1 has no heavy atoms".format(resid_prot_1)
 
+            for resid_prot_2 in self.image_prot_2_resids:
 
-        # The image idxs for the native state
+                resid_2_idx = self.image_prot_2_residue_dic[resid_prot_2]
+                assert len(resid_2_idx) > 0, \
+                    "Residue {} of protein 2 has no heavy atoms".format(resid_prot_2)
+
+                residue_atom_pairs.append(
+                    np.stack(np.meshgrid(resid_1_idx, resid_2_idx, indexing='ij'),
+                             axis=-1).reshape(-1, 2))
+
+        self._atom_pairs = np.ascontiguousarray(np.concatenate(residue_atom_pairs),
+                                                dtype=np.int32)
+
+        segment_lengths = [len(pairs) for pairs in residue_atom_pairs]
+        self._atom_pair_segments = (np.cumsum(segment_lengths) - segment_lengths).astype(np.int32)
+
+        # for the neighbor search: the heavy atoms of each protein and
+        # the position of their residue in the residue lists
+        self._heavy_prot_1_idxs = np.concatenate(
+            [self.image_prot_1_residue_dic[resid] for resid in self.image_prot_1_resids])
+        self._heavy_prot_1_res_pos = np.concatenate(
+            [np.full(len(self.image_prot_1_residue_dic[resid]), res_pos)
+             for res_pos, resid in enumerate(self.image_prot_1_resids)])
+
+        self._heavy_prot_2_idxs = np.concatenate(
+            [self.image_prot_2_residue_dic[resid] for resid in self.image_prot_2_resids])
+        self._heavy_prot_2_res_pos = np.concatenate(
+            [np.full(len(self.image_prot_2_residue_dic[resid]), res_pos)
+             for res_pos, resid in enumerate(self.image_prot_2_resids)])
+
+        # for the numpy and numba contact kernels: the offset of the
+        # first heavy atom of each residue in the heavy atom lists
+        self._heavy_prot_1_res_offsets = np.searchsorted(
+            self._heavy_prot_1_res_pos, np.arange(len(self.image_prot_1_resids)))
+        self._heavy_prot_2_res_offsets = np.searchsorted(
+            self._heavy_prot_2_res_pos, np.arange(len(self.image_prot_2_resids)))
+
+
+        # The image idxs for the native state, the cache is only set
+        # afterwards so the native state isn't kept in it
+        self.state_cache = None
         self.ref_image = self._unaligned_image(native_state)
 
+        self.state_cache = state_cache
+
+        # the kernels must give the same contacts as mdtraj
+        if self.contacts_backend != 'mdtraj':
+            self._check_contacts_backend(self.ref_image)
+
 
 
 
     def _unaligned_image(self, state):
         """The preprocessing method of states.
 
-        First it groups the binding site and ligand into the same
-        periodic box image and then centers the box around their
-        mutual center of mass and returns only the positions of the
-        binding site and ligand.
+        First it slices out the positions of the two proteins, groups
+        them into the same periodic box image and then centers them
+        around protein 1.
 
         Parameters
         ----------
@@ -162,21 +275,23 @@ class ProteinProteinContacts(Distance):
         -------
         """
 
-        # get the box lengths from the vectors
-        box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
-
-        # recenter the protein-ligand complex into the center of the
-        # periodic boundary conditions
+        if self.state_cache is not None:
 
-        # regroup the ligand and protein in together
-        grouped_positions = group_pair(state['positions'], box_lengths,
-                                       self.prot_1_idxs, self.prot_2_idxs)
+            # reuse the preprocessing done by another metric
+            state_image = self.state_cache.centered_image(state, self._image_idxs,
+                                                          self._image_prot_1_idxs,
+                                                          self._image_prot_2_idxs)
 
-        # then center them around the binding site
-        centered_positions = center_around(grouped_positions, self.prot_1_idxs)
+        else:
+            # get the box lengths from the vectors
+            box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
 
-        # slice these positions to get the image
-        state_image = centered_positions[self._image_idxs]
+            # slice out the two proteins, regroup them together and
+            # then center them around protein 1
+            state_image = centered_image(state['positions'], box_lengths,
+                                         self._image_idxs,
+                                         self._image_prot_1_idxs,
+                                         self._image_prot_2_idxs)
 
         return state_image
 
@@ -221,8 +336,9 @@ class ProteinProteinContacts(Distance):
 
         return contact_strength
 
-    def determine_contacts(self, sup_image):
-        """Calculate the contact strength between the associated proteins.
+    def _neighbor_min_distances(self, sup_image):
+        """Minimum distances between the residue pairs using a KD-tree
+        neighbor search.
 
         Parameters
         ----------
@@ -230,54 +346,109 @@ class ProteinProteinContacts(Distance):
         sup_image : array of floats (n_atoms, 3)
             Coordinates of state aligned to reference state.
 
-
         Returns
         -------
 
-        contact_strengths : array of float (n_atoms * n_atoms, )
-            The strength for each individual contact.
+        min_distances : array of float (n_residue_pairs,)
+            The minimum heavy atom distance for each residue pair, or
+            inf if no atoms are within the contact horizon.
 
         """
 
-        # OPT: this works but might not be a efficient strategy. Could
-        # either use mdtraj.compute_contacts, change strategy for min
-        # distance, re-implement in Cython or C.
+        n_prot_2_residues = len(self.image_prot_2_resids)
+
+        prot_1_tree = cKDTree(sup_image[self._heavy_prot_1_idxs])
+        prot_2_tree = cKDTree(sup_image[self._heavy_prot_2_idxs])
+
+        # all the atom pairs within the horizon
+        close_pairs = prot_1_tree.sparse_distance_matrix(prot_2_tree,
+                                                         self.contact_horizon,
+                                                         output_type='ndarray')
+
+        residue_pair_idxs = (self._heavy_prot_1_res_pos[close_pairs['i']] * n_prot_2_residues +
+                             self._heavy_prot_2_res_pos[close_pairs['j']])
+
+        min_distances = np.full(len(self.image_prot_1_resids) * n_prot_2_residues, np.inf)
+        np.minimum.at(min_distances, residue_pair_idxs, close_pairs['v'])
 
-        # Make a vector for the contact strength
-        contact_strengths = np.zeros([len(self.image_prot_1_resids) * len(self.image_prot_2_resids)])
+        return min_distances
+
+    def _mdtraj_min_distances(self, sup_image):
+        """Minimum distances between the residue pairs using mdtraj."""
 
         # Create Trajectory object
-        traj = mdj.Trajectory(image, self._image_top)
+        traj = mdj.Trajectory(sup_image, self._image_top)
 
-        # Compute minimum distances between each residue
-        counter = 0
-        for resid_prot_1 in self.image_prot_1_resids:
+        # Compute the distances of all the atom pairs at once
+        distances = mdj.compute_distances(traj, self._atom_pairs)[0]
 
-            # get the atom indices for this residue
-            resid_1_idx = self.image_prot_1_residue_dic[resid_prot_1]
+        # the minimum distance between each pair of residues
+        return np.minimum.reduceat(distances, self._atom_pair_segments)
 
-            # same thing for protein 2
-            for resid_prot_2 in self.image_prot_2_resids:
+    def _kernel_min_distances(self, sup_image):
+        """Minimum distances between the residue pairs using the numpy or
+        numba kernel of the contacts backend, see `contacts`."""
 
-                resid_2_idx = self.image_prot_2_residue_dic[resid_prot_2]
+        if self.contacts_backend == 'numba':
+            residue_min_distances = residue_min_distances_numba
+        else:
+            residue_min_distances = residue_min_distances_numpy
 
-                # Get atom pairs to calculate minimum distance
-                atom_pair = []
-                for prot_1_idx in resid_1_idx:
+        return residue_min_distances(sup_image[self._heavy_prot_1_idxs],
+                                     sup_image[self._heavy_prot_2_idxs],
+                                     self._heavy_prot_1_res_offsets,
+                                     self._heavy_prot_2_res_offsets)
 
-                    for prot_2_idx in resid_2_idx:
+    def _check_contacts_backend(self, image, atol=1e-5):
+        """Check that the contacts backend gives the same residue minimum
+        distances as mdtraj for an image.
 
-                        atom_pair.append((prot_1_idx, prot_2_idx))
+        Parameters
+        ----------
 
-                # Compute the atomic distances
-                distances = mdj.compute_distances(traj, atom_pair)
-                min_distance = np.min(distances)
+        image : array of floats (n_atoms, 3)
 
-                # Compute contact strength
-                contact_strengths[counter] = self.calculate_contact_strength(min_distance)
+        atol : float
+            mdtraj computes the distances in float32.
+
+        """
 
-                counter += 1
+        min_distances = self._kernel_min_distances(image)
+        mdtraj_min_distances = self._mdtraj_min_distances(image)
 
+        assert np.allclose(min_distances, mdtraj_min_distances, rtol=0.0, atol=atol), \
+            "The {} contacts backend doesn't match mdtraj, max difference {}".format(
+                self.contacts_backend, np.abs(min_distances - mdtraj_min_distances).max())
+
+    def determine_contacts(self, sup_image):
+        """Calculate the contact strength between the associated proteins.
+
+        Parameters
+        ----------
+
+        sup_image : array of floats (n_atoms, 3)
+            Coordinates of state aligned to reference state.
+
+
+        Returns
+        -------
+
+        contact_strengths : array of float (n_atoms * n_atoms, )
+            The strength for each individual contact.
+
+        """
+
+        if self.neighbor_search:
+            min_distances = self._neighbor_min_distances(sup_image)
+
+        elif self.contacts_backend != 'mdtraj':
+            min_distances = self._kernel_min_distances(sup_image)
+
+        else:
+            min_distances = self._mdtraj_min_distances(sup_image)
+
+        # Compute contact strength
+        contact_strengths = self.calculate_contact_strength(min_distances.astype(np.float64))
 
         return contact_strengths
 
@@ -289,3 +460,24 @@ class ProteinProteinContacts(Distance):
         d = abs(image_a - image_b)
 
         return d
+
+    def image_distance_matrix(self, images):
+        """Compute the distances between all pairs of images at once.
+
+        Parameters
+        ----------
+
+        images : arraylike of shape (n_images,)
+            The stacked images as made by the `image` method.
+
+        Returns
+        -------
+
+        distance_matrix : arraylike of shape (n_images, n_images)
+
+        """
+
+        images = np.asarray(images)
+
+        # same as image_distance for every pair
+        return np.abs(images[:, None] - images[None, :])
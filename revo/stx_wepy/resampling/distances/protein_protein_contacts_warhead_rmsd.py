@@ -3,6 +3,7 @@ import numpy as np
 from wepy.resampling.distances.distance import Distance
 from stx_wepy.resampling.distances.protein_protein_contacts import ProteinProteinContacts
 from stx_wepy.resampling.distances.rebinding import RebindingDistance
+from stx_wepy.util.state_cache import StatePreprocessingCache
 
 class ProteinProteinContactsWarheadRMSD(Distance):
     """Distance metric for measuring differences between walker states in                                                        
@@ -38,14 +39,29 @@ class ProteinProteinContactsWarheadRMSD(Distance):
                  k = 1,
                  warhead_rmsd_weight = 1,
                  protein_protein_contact_dist_weight = 1,
+                 neighbor_search = False,
+                 contacts_backend = None,
+                 state_cache = None,
                  **kwargs):
 
+        # the components share the box conversion and the grouped and
+        # centered positions of each state. The cache can also be
+        # shared with a boundary condition, e.g. NewRebindingBC, but
+        # images are only shared if it uses the same ligand and
+        # binding site atoms as the warhead RMSD. That only helps
+        # in-process, with a 'process' executor each worker only
+        # shares between the components, see `state_cache`
+        if state_cache is None:
+            state_cache = StatePreprocessingCache()
+
+        self.state_cache = state_cache
 
         self.warhead_distance = RebindingDistance(ligand_idxs = ligand_idxs,
                                                   binding_site_idxs = binding_site_idxs,
                                                   native_ligand_idxs = native_ligand_idxs,
                                                   native_binding_site_idxs = native_binding_site_idxs,
-                                                  ref_state = ref_state)
+                                                  ref_state = ref_state,
+                                                  state_cache = self.state_cache)
 
         self.protein_protein_contact_distance = ProteinProteinContacts(prot_1_resids = prot_1_resids,
                                                                        prot_2_resids = prot_2_resids,
@@ -54,7 +70,10 @@ class ProteinProteinContactsWarheadRMSD(Distance):
                                                                        trajectory = trajectory,
                                                                        distance_cutoff = distance_cutoff,
                                                                        k = k,
-                                                                       native_state = ref_state)
+                                                                       native_state = ref_state,
+                                                                       neighbor_search = neighbor_search,
+                                                                       contacts_backend = contacts_backend,
+                                                                       state_cache = self.state_cache)
 
         self.warhead_rmsd_weight = warhead_rmsd_weight
         self.protein_protein_contact_dist_weight = protein_protein_contact_dist_weight
@@ -85,6 +104,9 @@ class ProteinProteinContactsWarheadRMSD(Distance):
 
         images = np.array([warhead_image, proten_protein_contact_image])
 
+        # the preprocessing of this state is not needed anymore
+        self.state_cache.evict(state)
+
 
         
         return images
@@ -117,3 +139,31 @@ class ProteinProteinContactsWarheadRMSD(Distance):
         distance = self.warhead_rmsd_weight * warhead_distance + self.protein_protein_contact_dist_weight * protein_protein_contact_distance
         
         return distance
+
+    def image_distance_matrix(self, images):
+        """Compute the distances between all pairs of images at once.
+
+        Parameters
+        ----------
+
+        images : arraylike of shape (n_images, 2)
+            The stacked images as made by the `image` method.
+
+        Returns
+        -------
+
+        distance_matrix : arraylike of shape (n_images, n_images)
+
+        """
+
+        images = np.asarray(images)
+
+        warhead_distances = self.warhead_distance.image_distance_matrix(images[:, 0])
+
+        protein_protein_contact_distances = \
+            self.protein_protein_contact_distance.image_distance_matrix(images[:, 1])
+
+        distances = (self.warhead_rmsd_weight * warhead_distances +
+                     self.protein_protein_contact_dist_weight * protein_protein_contact_distances)
+
+        return distances
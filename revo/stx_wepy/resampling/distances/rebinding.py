@@ -24,13 +24,14 @@ import numpy as np
 
 from wepy.util.util import box_vectors_to_lengths_angles
 
-from geomm.grouping import group_pair
 from geomm.superimpose import superimpose
 from geomm.rmsd import calc_rmsd
-from geomm.centering import center_around
 
 from wepy.resampling.distances.receptor import ReceptorDistance
 
+from stx_wepy.util import batch_geometry
+from stx_wepy.util.state_cache import centered_image
+
 class RebindingDistance(ReceptorDistance):
     """Distance metric for measuring differences between walker states in
     regards to the RMSDs between ligands.
@@ -47,6 +48,7 @@ class RebindingDistance(ReceptorDistance):
                  native_ligand_idxs = None,
                  native_binding_site_idxs = None,
                  ref_state=None,
+                 state_cache=None,
                  ):
 
 
@@ -60,8 +62,10 @@ class RebindingDistance(ReceptorDistance):
         self._n_lig_atoms = len(self._lig_idxs)
         self._n_bs_atoms = len(self._bs_idxs)
 
-        # the idxs used for the whole image
-        self._image_idxs = np.concatenate( (self._lig_idxs, self._bs_idxs) )
+        # the idxs used for the whole image, the image atoms are sliced
+        # out of the state before any other processing
+        self._image_idxs = np.ascontiguousarray(
+            np.concatenate( (self._lig_idxs, self._bs_idxs) ), dtype=np.intp)
 
         # the idxs of the ligand and binding site within the image
         self._image_lig_idxs = np.arange(self._n_lig_atoms)
@@ -80,25 +84,37 @@ class RebindingDistance(ReceptorDistance):
                                 else native_binding_site_idxs)
 
         # The image idxs for the native state
-        self._native_image_idxs = np.concatenate(
+        self._native_image_idxs = np.ascontiguousarray(np.concatenate(
             (
                 self._native_ligand_idxs,
                 self._native_bs_idxs
             ),
-        )
+        ), dtype=np.intp)
+
+        # the idxs of the native ligand and binding site within the image
+        n_native_lig_atoms = len(self._native_ligand_idxs)
+        self._native_image_lig_idxs = np.arange(n_native_lig_atoms)
+        self._native_image_bs_idxs = np.arange(n_native_lig_atoms,
+                                               n_native_lig_atoms + len(self._native_bs_idxs))
 
         self._ref_state = ref_state
 
-        self.ref_image = self._ref_state['positions'][self._native_image_idxs]
+        # float64 like the reference of the rebinding boundary
+        # conditions, images are only shared through the state_cache
+        # if the reference images are the same
+        self.ref_image = np.asarray(self._ref_state['positions'][self._native_image_idxs],
+                                    dtype=np.float64)
+
+        # optional StatePreprocessingCache shared with other metrics
+        self.state_cache = state_cache
 
 
     def _unaligned_image(self, state, ref_state = False):
         """The preprocessing method of states.
 
-        First it groups the binding site and ligand into the same
-        periodic box image and then centers the box around their
-        mutual center of mass and returns only the positions of the
-        binding site and ligand.
+        First it slices out the positions of the binding site and
+        ligand, groups them into the same periodic box image and then
+        centers them around the binding site.
 
         Parameters
         ----------
@@ -112,34 +128,34 @@ class RebindingDistance(ReceptorDistance):
 
         """
 
-        # Get correct atomic indicies
+        # Get correct atomic indicies, the ligand and binding site
+        # idxs are within the image
         if ref_state:
 
-            lig_idxs = self._native_ligand_idxs
-            bs_idxs = self._native_bs_idxs
+            lig_idxs = self._native_image_lig_idxs
+            bs_idxs = self._native_image_bs_idxs
             image_idxs = self._native_image_idxs
 
 
         else:
-            lig_idxs = self._lig_idxs
-            bs_idxs = self._bs_idxs
+            lig_idxs = self._image_lig_idxs
+            bs_idxs = self._image_bs_idxs
             image_idxs = self._image_idxs
 
-        # get the box lengths from the vectors
-        box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
+        if self.state_cache is not None:
 
-        # recenter the protein-ligand complex into the center of the
-        # periodic boundary conditions
+            # reuse the preprocessing done by another metric
+            state_image = self.state_cache.centered_image(state, image_idxs,
+                                                          bs_idxs, lig_idxs)
 
-        # regroup the ligand and protein in together
-        grouped_positions = group_pair(state['positions'], box_lengths,
-                                       bs_idxs, lig_idxs)
-
-        # then center them around the binding site
-        centered_positions = center_around(grouped_positions, bs_idxs)
+        else:
+            # get the box lengths from the vectors
+            box_lengths, box_angles = box_vectors_to_lengths_angles(state['box_vectors'])
 
-        # slice these positions to get the image
-        state_image = centered_positions[image_idxs]
+            # slice out the ligand and binding site, regroup them
+            # together and then center them around the binding site
+            state_image = centered_image(state['positions'], box_lengths,
+                                         image_idxs, bs_idxs, lig_idxs)
 
         return state_image
 
@@ -166,16 +182,78 @@ class RebindingDistance(ReceptorDistance):
 
         """
 
-        # get the unaligned image
-        state_image = self._unaligned_image(state, ref_state = False)
+        if self.state_cache is not None:
 
-        # then superimpose it to the reference structure
-        sup_image, _, _ = superimpose(self.ref_image, state_image, idxs=self._image_bs_idxs)
+            # the superimposed image may already have been made by a
+            # boundary condition sharing the cache
+            sup_image = self.state_cache.superimposed_image(state, self._image_idxs,
+                                                            self._image_bs_idxs,
+                                                            self._image_lig_idxs,
+                                                            self.ref_image)
+
+        else:
+            # get the unaligned image
+            state_image = self._unaligned_image(state, ref_state = False)
+
+            # then superimpose it to the reference structure
+            sup_image, _, _ = superimpose(self.ref_image, state_image, idxs=self._image_bs_idxs)
 
         rmsd_image = 1 / calc_rmsd(self.ref_image, sup_image, idxs=self._image_lig_idxs)
 
         return rmsd_image
 
+    def images(self, states):
+        """Transform many states to receptor images at once.
+
+        Gives the same images as calling `image` on each state but the
+        regrouping, centering, superposition and RMSD are done for all
+        of the states together on stacked arrays.
+
+        Parameters
+        ----------
+        states : list of objects implementing WalkerState
+
+        Returns
+        -------
+
+        receptor_images : array of float shape (n_states,)
+
+        """
+
+        if self.state_cache is not None:
+
+            # the superimposed images may already have been made by a
+            # boundary condition sharing the cache
+            sup_images = self.state_cache.superimposed_images(states, self._image_idxs,
+                                                              self._image_bs_idxs,
+                                                              self._image_lig_idxs,
+                                                              self.ref_image)
+
+            return 1 / batch_geometry.calc_rmsd(self.ref_image, sup_images,
+                                                idxs=self._image_lig_idxs)
+
+        # only the ligand and binding site atoms are needed for all
+        # of the steps so the rest of the system is never copied
+        positions = np.stack([state['positions'][self._image_idxs]
+                              for state in states])
+        box_lengths = batch_geometry.box_vectors_to_lengths(
+            np.stack([state['box_vectors'] for state in states]))
+
+        grouped_positions = batch_geometry.group_pair(positions, box_lengths,
+                                                      self._image_bs_idxs,
+                                                      self._image_lig_idxs)
+
+        centered_positions = batch_geometry.center_around(grouped_positions,
+                                                          self._image_bs_idxs)
+
+        sup_images, _ = batch_geometry.superimpose(self.ref_image, centered_positions,
+                                                   idxs=self._image_bs_idxs)
+
+        rmsd_images = 1 / batch_geometry.calc_rmsd(self.ref_image, sup_images,
+                                                   idxs=self._image_lig_idxs)
+
+        return rmsd_images
+
     def image_distance(self, image_a, image_b):
 
         # then we get the absolute value of the reciprocals of these rmsd
@@ -183,3 +261,24 @@ class RebindingDistance(ReceptorDistance):
         d = abs(image_a - image_b)
 
         return d
+
+    def image_distance_matrix(self, images):
+        """Compute the distances between all pairs of images at once.
+
+        Parameters
+        ----------
+
+        images : arraylike of shape (n_images,)
+            The stacked images as made by the `image` method.
+
+        Returns
+        -------
+
+        distance_matrix : arraylike of shape (n_images, n_images)
+
+        """
+
+        images = np.asarray(images)
+
+        # same as image_distance for every pair
+        return np.abs(images[:, None] - images[None, :])
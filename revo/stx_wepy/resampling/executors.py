@@ -0,0 +1,176 @@
+"""Executors for computing walker images and all-to-all distances in
+parallel during resampling.
+
+Anything with a `concurrent.futures.Executor` style `map` method can be
+used. The resamplers accept either such an object or one of the names
+in `EXECUTORS`, which is turned into an executor with `make_executor`.
+
+Functions submitted to the executors are module level so they can be
+pickled for process pools.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+import multiprocessing as mulproc
+
+import numpy as np
+
+EXECUTORS = ('serial', 'thread', 'process')
+
+
+class SerialExecutor():
+    """Executor that runs everything in the calling process.
+
+    Has the same `map` and `submit` signatures as the
+    `concurrent.futures` executors.
+    """
+
+    def map(self, func, *iterables, chunksize=1, **kwargs):
+        return map(func, *iterables)
+
+    def submit(self, func, *args, **kwargs):
+
+        # the returned future is already done
+        future = Future()
+
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def make_executor(executor='serial', num_workers=None):
+    """Make an executor from a name.
+
+    Parameters
+    ----------
+
+    executor : str or object with a `map` method
+        One of `EXECUTORS`. Objects implementing `map` are returned as
+        is.
+
+    num_workers : int, optional
+        Number of workers for thread and process pools. Defaults to
+        the number of CPUs.
+
+    Returns
+    -------
+
+    executor : object with a `map` method
+
+    """
+
+    if not isinstance(executor, str):
+        assert hasattr(executor, 'map'), "executor must implement a 'map' method"
+        return executor
+
+    assert executor in EXECUTORS, \
+        "executor must be one of {}, not {}".format(EXECUTORS, executor)
+
+    if executor == 'serial':
+        return SerialExecutor()
+
+    if num_workers is None:
+        num_workers = mulproc.cpu_count()
+
+    if executor == 'thread':
+        return ThreadPoolExecutor(max_workers=num_workers)
+
+    elif executor == 'process':
+        return ProcessPoolExecutor(max_workers=num_workers)
+
+
+def in_process(executor):
+    """Whether an executor runs its tasks in the calling process, so the
+    tasks can share caches with it.
+
+    Parameters
+    ----------
+
+    executor : str or object with a `map` method
+
+    Returns
+    -------
+
+    in_process : bool
+        True for 'serial', 'thread' and their executors.
+
+    """
+
+    if isinstance(executor, str):
+        return executor in ('serial', 'thread')
+
+    return isinstance(executor, (SerialExecutor, ThreadPoolExecutor))
+
+
+def pair_row_chunks(num_walkers, num_chunks):
+    """Split the rows of the upper triangle of an all-to-all matrix into
+    chunks with roughly the same number of pairs in each.
+
+    Parameters
+    ----------
+
+    num_walkers : int
+
+    num_chunks : int
+
+    Returns
+    -------
+
+    row_chunks : list of arraylike of int
+        The row indices for each chunk. Row `i` holds the pairs (i, j)
+        with j > i.
+
+    """
+
+    num_rows = num_walkers - 1
+
+    if num_rows < 1:
+        return []
+
+    # number of pairs before each row starts
+    row_pairs = np.arange(num_rows, 0, -1)
+    pair_offsets = np.cumsum(row_pairs) - row_pairs
+
+    num_chunks = max(1, min(num_chunks, num_rows))
+    chunk_bounds = np.linspace(0, row_pairs.sum(), num_chunks + 1)[1:-1]
+
+    split_idxs = np.unique(np.searchsorted(pair_offsets, chunk_bounds))
+
+    return [chunk for chunk in np.split(np.arange(num_rows), split_idxs)
+            if len(chunk) > 0]
+
+
+def image_distance_rows(distance, images, row_idxs):
+    """Compute the upper triangle rows of the distance matrix.
+
+    Parameters
+    ----------
+
+    distance : object implementing Distance
+
+    images : list of image objects
+
+    row_idxs : arraylike of int
+
+    Returns
+    -------
+
+    rows : list of tuple of (int, arraylike of float)
+        For each row index `i` the distances to the images j > i.
+
+    """
+
+    num_images = len(images)
+
+    rows = []
+    for i in row_idxs:
+        rows.append((i, np.array([distance.image_distance(images[i], images[j])
+                                  for j in range(i + 1, num_images)])))
+
+    return rows
@@ -0,0 +1,180 @@
+"""Level gated counters and phase timers for the resamplers.
+
+The resamplers count their trial and accepted clone and merge moves
+and time the phases of each cycle where walker images are made, the
+all-to-all distances are computed and the decisions are made. The
+values of the last cycle are saved in the resampler records and shown
+by `REVODashboardSection` instead of being written to the log.
+
+What is measured is set by the level:
+
+- 'off' : nothing, phases are entered with a shared no-op context
+  and counts are ignored.
+- 'counters' : only the numbers of trial and accepted moves.
+- 'timings' : the counters and the wall time of each phase.
+
+Only the record fields of what is measured are added to the
+resampler records, see `ResamplerInstrumentation.fields`, so at the
+'off' level the records are the same as without instrumentation.
+
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+INSTRUMENTATION_LEVELS = ('off', 'counters', 'timings')
+
+PHASES = ('image', 'distance', 'decide')
+
+COUNTERS = ('trial_moves', 'accepted_moves')
+
+# the resampler record fields, see `ResamplerInstrumentation.record`
+INSTRUMENTATION_FIELDS = ('num_trial_moves', 'num_accepted_moves', 'phase_times',)
+INSTRUMENTATION_SHAPES = ((1,), (1,), (len(PHASES),),)
+INSTRUMENTATION_DTYPES = (int, int, float,)
+
+# the fields recorded at each level
+LEVEL_FIELDS = {
+    'off' : (),
+    'counters' : ('num_trial_moves', 'num_accepted_moves',),
+    'timings' : INSTRUMENTATION_FIELDS,
+}
+
+_NULL_PHASE = nullcontext()
+
+
+class ResamplerInstrumentation():
+    """Counters and phase timers for a single resampling cycle.
+
+    Call `start_cycle` at the start of every cycle, then `count` and
+    `phase` while resampling, and `record` for the values of the
+    cycle.
+    """
+
+    def __init__(self, level='off'):
+        """Constructor for the ResamplerInstrumentation.
+
+        Parameters
+        ----------
+
+        level : str
+            One of `INSTRUMENTATION_LEVELS`.
+
+        """
+
+        assert level in INSTRUMENTATION_LEVELS, \
+            "level must be one of {}, not {}".format(INSTRUMENTATION_LEVELS, level)
+
+        self.level = level
+
+        self.counting = level in ('counters', 'timings')
+        self.timing = level == 'timings'
+
+        self.start_cycle()
+
+    def start_cycle(self):
+        """Reset the counters and timers for a new cycle."""
+
+        self.counts = {name : 0 for name in COUNTERS}
+        self.phase_times = {name : 0.0 for name in PHASES}
+
+    def count(self, name, value=1):
+        """Add to a counter of the cycle.
+
+        Parameters
+        ----------
+
+        name : str
+            One of `COUNTERS`.
+
+        value : int
+
+        """
+
+        if self.counting:
+            self.counts[name] += value
+
+    @contextmanager
+    def _timed_phase(self, name):
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[name] += time.perf_counter() - start
+
+    def phase(self, name):
+        """A context manager timing a phase of the cycle.
+
+        Phases entered more than once in a cycle accumulate their
+        times.
+
+        Parameters
+        ----------
+
+        name : str
+            One of `PHASES`.
+
+        Returns
+        -------
+
+        phase : context manager
+
+        """
+
+        if not self.timing:
+            return _NULL_PHASE
+
+        return self._timed_phase(name)
+
+    def fields(self):
+        """The names, shapes and dtypes of the resampler record fields
+        measured at the level.
+
+        Returns
+        -------
+
+        names : tuple of str
+
+        shapes : tuple
+
+        dtypes : tuple
+
+        """
+
+        field_specs = [field_spec for field_spec in zip(INSTRUMENTATION_FIELDS,
+                                                        INSTRUMENTATION_SHAPES,
+                                                        INSTRUMENTATION_DTYPES)
+                       if field_spec[0] in LEVEL_FIELDS[self.level]]
+
+        if len(field_specs) == 0:
+            return (), (), ()
+
+        names, shapes, dtypes = zip(*field_specs)
+
+        return names, shapes, dtypes
+
+    def record(self):
+        """The resampler record values of the cycle.
+
+        Returns
+        -------
+
+        record : dict of str : arraylike
+            The values of the fields measured at the level, see
+            `fields`, empty at the 'off' level.
+
+        """
+
+        record = {}
+
+        if self.counting:
+            record['num_trial_moves'] = np.array([self.counts['trial_moves']])
+            record['num_accepted_moves'] = np.array([self.counts['accepted_moves']])
+
+        if self.timing:
+            record['phase_times'] = np.array([self.phase_times[name] for name in PHASES])
+
+        return record
@@ -0,0 +1,479 @@
+"""Offline replay of the REVO resampler decisions from the records of
+finished simulations, for validating and profiling implementations of
+the resamplers without running any dynamics.
+
+The inputs to `decide` of every cycle, the walker weights and the
+distance matrix, are read from a WepyHDF5 file along with the
+progress, the recorded decisions and variation and, for runs that
+have it, the state of the resampler random number generator (see
+`rng_records`). Each resampler ("engine") then makes the decisions of
+every cycle again from the same inputs and the same random numbers
+and its latency, final variation and agreement with a reference are
+reported.
+
+The progress given to progress based resamplers is the
+'walker_progress' the resampler recorded, which is the progress of
+the walkers after warping. Runs without it only have the progress
+records of the boundary condition, which are from before warping, so
+the cycles with warps are replayed with the progress of the walkers
+that were warped away.
+
+When the run has 'rng_state' and, for progress based resamplers,
+'walker_progress' records the engine that made it will reproduce the
+recorded decisions exactly. For older runs the random
+numbers of each cycle are made from a seed and the cycle index, so
+engines can only be compared to each other and not to the recorded
+decisions. Distance matrices recorded as 'triu32' are single
+precision, so decisions that were close to a tie may also differ.
+
+Can be run as a script, see `main`.
+
+"""
+
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from wepy.hdf5 import WepyHDF5
+from wepy.walker import WalkerState
+from wepy.resampling.distances.distance import Distance
+from wepy.boundary_conditions.boundary import BoundaryConditions
+
+from stx_wepy.resampling.distance_records import distance_matrix_from_record
+from stx_wepy.resampling.rng_records import rng_from_record
+from stx_wepy.resampling.resamplers.revo import REVOResampler
+from stx_wepy.resampling.resamplers.decision_kernel import HAVE_NUMBA
+from stx_wepy.resampling.resamplers.variation_loss_revo import VariationLossREVOResampler
+from stx_wepy.resampling.resamplers.epsilon_variation_loss_revo import (
+    EpsilonVariationLossREVOResampler,
+)
+
+ReplayCycle = namedtuple('ReplayCycle', ['cycle_idx',
+                                         'walker_weights',
+                                         'distance_matrix',
+                                         'walker_progress',
+                                         'rng_state',
+                                         'variation',
+                                         'decisions'])
+"""The recorded inputs and outputs of one resampling cycle.
+
+`walker_progress`, `rng_state` and `decisions` are None if they were
+not recorded. `decisions` is a list of the (decision_id, target_idxs)
+of each walker.
+"""
+
+
+def _record_rows(records_grp, field, cycle_idxs, cycle_idx):
+
+    return [np.asarray(records_grp[field][row_idx]).ravel()
+            for row_idx in np.flatnonzero(cycle_idxs == cycle_idx)]
+
+
+def _default_progress_field(wepy_h5, progress_grp):
+
+    # the same field a progress based resampler uses by default, the
+    # first of the PROGRESS_FIELDS of the boundary condition, which
+    # the record fields setting has in the same order. Names starting
+    # with '_' are the bookkeeping datasets of the group
+    record_fields = wepy_h5.record_fields.get('progress', [])
+    fields = [field for field in record_fields if field in progress_grp]
+    fields.extend(sorted(field for field in progress_grp.keys()
+                         if field not in fields))
+    fields = [field for field in fields if not field.startswith('_')]
+
+    if len(fields) == 0:
+        return None
+
+    return fields[0]
+
+
+def read_replay_cycles(wepy_h5, run_idx=0, progress_field=None):
+    """Read the resampling cycles of a run.
+
+    Parameters
+    ----------
+
+    wepy_h5 : WepyHDF5
+        An open WepyHDF5 file.
+
+    run_idx : int
+
+    progress_field : str, optional
+        The progress record field given to progress based resamplers
+        if the run has no 'walker_progress' resampler records, by
+        default the first of the boundary condition progress fields,
+        e.g. 'native_rmsd' for the RebindingBC.
+
+    Returns
+    -------
+
+    cycles : list of ReplayCycle
+
+    """
+
+    num_walkers = wepy_h5.num_run_trajs(run_idx)
+
+    # the weights of the walkers that were resampled in each cycle are
+    # the weights of the trajectory frames
+    walker_weights = np.hstack([wepy_h5.get_traj_field(run_idx, traj_idx, 'weights')
+                                for traj_idx in range(num_walkers)])
+
+    resampler_grp = wepy_h5.records_grp(run_idx, 'resampler')
+    resampler_cycle_idxs = resampler_grp['_cycle_idxs'][:]
+
+    resampling_grp = wepy_h5.records_grp(run_idx, 'resampling')
+    resampling_cycle_idxs = resampling_grp['_cycle_idxs'][:]
+
+    progress_grp = wepy_h5.records_grp(run_idx, 'progress')
+    if progress_field is None:
+        progress_field = _default_progress_field(wepy_h5, progress_grp)
+
+    cycles = []
+    for row_idx, cycle_idx in enumerate(resampler_cycle_idxs):
+
+        distance_matrix = distance_matrix_from_record(
+            np.asarray(resampler_grp['distance_matrix'][row_idx]).ravel(),
+            int(np.ravel(resampler_grp['num_walkers'][row_idx])[0]))
+
+        walker_progress = None
+        if 'walker_progress' in resampler_grp:
+            # the progress the resampler actually used
+            walker_progress = np.asarray(resampler_grp['walker_progress'][row_idx],
+                                         dtype=float).ravel()
+        elif progress_field is not None:
+            walker_progress = np.asarray(progress_grp[progress_field][cycle_idx],
+                                         dtype=float).ravel()
+
+        rng_state = None
+        if 'rng_state' in resampler_grp:
+            rng_state = resampler_grp['rng_state'][row_idx]
+
+        # the decisions ordered by walker
+        decisions = None
+        if np.any(resampling_cycle_idxs == cycle_idx):
+            walker_idxs = np.concatenate(_record_rows(resampling_grp, 'walker_idx',
+                                                      resampling_cycle_idxs, cycle_idx))
+            decision_ids = np.concatenate(_record_rows(resampling_grp, 'decision_id',
+                                                       resampling_cycle_idxs, cycle_idx))
+            target_idxs = _record_rows(resampling_grp, 'target_idxs',
+                                       resampling_cycle_idxs, cycle_idx)
+            decisions = [(int(decision_ids[i]), tuple(int(idx) for idx in target_idxs[i]))
+                         for i in np.argsort(walker_idxs, kind='stable')]
+
+        cycles.append(ReplayCycle(cycle_idx=int(cycle_idx),
+                                  walker_weights=walker_weights[cycle_idx].tolist(),
+                                  distance_matrix=distance_matrix,
+                                  walker_progress=walker_progress,
+                                  rng_state=rng_state,
+                                  variation=float(np.ravel(resampler_grp['variation'][row_idx])[0]),
+                                  decisions=decisions))
+
+    return cycles
+
+
+def cycle_rng(cycle, seed=0):
+    """The random number generator a cycle is replayed with.
+
+    Parameters
+    ----------
+
+    cycle : ReplayCycle
+
+    seed : int
+        Used with the cycle index if the cycle has no recorded
+        generator state.
+
+    Returns
+    -------
+
+    rng : numpy.random.Generator
+
+    """
+
+    if cycle.rng_state is not None:
+        return rng_from_record(cycle.rng_state)
+
+    return np.random.default_rng([seed, cycle.cycle_idx])
+
+
+def replay_decide(resampler, cycle, seed=0):
+    """Make the decisions of a cycle with a resampler.
+
+    The random number generator of the resampler is replaced by the
+    one from `cycle_rng`.
+
+    Parameters
+    ----------
+
+    resampler : REVOResampler
+        Or one of its subclasses.
+
+    cycle : ReplayCycle
+
+    seed : int
+        See `cycle_rng`.
+
+    Returns
+    -------
+
+    decisions : list of (int, tuple of int)
+        The decision id and target indices of each walker.
+
+    variation : float
+
+    latency : float
+        The time `decide` took in seconds.
+
+    """
+
+    resampler.rng = cycle_rng(cycle, seed=seed)
+
+    num_walker_copies = [1 for i in range(len(cycle.walker_weights))]
+
+    if isinstance(resampler, EpsilonVariationLossREVOResampler):
+        assert cycle.walker_progress is not None, \
+            "The progress must be recorded to replay {}".format(type(resampler).__name__)
+        decide_args = (cycle.walker_progress,)
+    else:
+        decide_args = ()
+
+    start = time.perf_counter()
+    walker_actions, variation = resampler.decide(list(cycle.walker_weights),
+                                                 num_walker_copies,
+                                                 cycle.distance_matrix,
+                                                 *decide_args)
+    latency = time.perf_counter() - start
+
+    decisions = [(int(np.ravel(record['decision_id'])[0]),
+                  tuple(int(idx) for idx in np.ravel(record['target_idxs'])))
+                 for record in sorted(walker_actions, key=lambda record: record['walker_idx'][0])]
+
+    return decisions, float(variation), latency
+
+
+def decision_agreement(decisions, ref_decisions):
+    """The fraction of walkers with the same decision and targets.
+
+    Parameters
+    ----------
+
+    decisions : list of (int, tuple of int)
+
+    ref_decisions : list of (int, tuple of int)
+
+    Returns
+    -------
+
+    agreement : float
+
+    """
+
+    assert len(decisions) == len(ref_decisions), \
+        "Can't compare decisions for {} and {} walkers".format(len(decisions),
+                                                               len(ref_decisions))
+
+    return float(np.mean([decision == ref_decision
+                          for decision, ref_decision in zip(decisions, ref_decisions)]))
+
+
+def benchmark_decide(engines, cycles, reference=None, seed=0):
+    """Replay every cycle with every engine.
+
+    Parameters
+    ----------
+
+    engines : dict of str : REVOResampler
+        The resamplers to compare by name.
+
+    cycles : list of ReplayCycle
+
+    reference : str, optional
+        The name of the engine whose decisions the others are compared
+        to. By default they are compared to the recorded decisions.
+
+    seed : int
+        See `cycle_rng`.
+
+    Returns
+    -------
+
+    results : dict of str : list of dict
+        For each engine a record for each cycle with the 'cycle_idx',
+        'latency', 'variation' and 'agreement'. The agreement is NaN
+        if there are no decisions to compare to.
+
+    """
+
+    assert reference is None or reference in engines, \
+        "The reference {} is not one of the engines".format(reference)
+
+    # the reference goes first so its decisions are there to compare to
+    engine_names = sorted(engines, key=lambda name: name != reference)
+
+    results = {name : [] for name in engine_names}
+    for cycle in cycles:
+
+        ref_decisions = cycle.decisions
+        for name in engine_names:
+
+            decisions, variation, latency = replay_decide(engines[name], cycle, seed=seed)
+
+            if name == reference:
+                ref_decisions = decisions
+
+            if ref_decisions is None:
+                agreement = np.nan
+            else:
+                agreement = decision_agreement(decisions, ref_decisions)
+
+            results[name].append({'cycle_idx' : cycle.cycle_idx,
+                                  'latency' : latency,
+                                  'variation' : variation,
+                                  'agreement' : agreement})
+
+    return {name : results[name] for name in engines}
+
+
+def format_benchmark_report(results, per_cycle=False):
+    """Make a text table of the results of `benchmark_decide`.
+
+    Parameters
+    ----------
+
+    results : dict of str : list of dict
+
+    per_cycle : bool
+        Also make a row for every cycle of every engine.
+
+    Returns
+    -------
+
+    report : str
+
+    """
+
+    header = "{:<24} {:>8} {:>12} {:>12} {:>10} {:>16}".format(
+        'engine', 'cycle', 'latency (ms)', 'max (ms)', 'agreement', 'final variation')
+    lines = [header, '-' * len(header)]
+
+    for name, cycle_results in results.items():
+
+        latencies = np.array([result['latency'] for result in cycle_results]) * 1000
+        agreements = np.array([result['agreement'] for result in cycle_results])
+
+        if per_cycle:
+            for result in cycle_results:
+                lines.append("{:<24} {:>8} {:>12.3f} {:>12} {:>10.3f} {:>16.6g}".format(
+                    name, result['cycle_idx'], result['latency'] * 1000, '',
+                    result['agreement'], result['variation']))
+
+        lines.append("{:<24} {:>8} {:>12.3f} {:>12.3f} {:>10.3f} {:>16.6g}".format(
+            name, 'all', np.mean(latencies), np.max(latencies),
+            np.mean(agreements), cycle_results[-1]['variation']))
+
+    return '\n'.join(lines)
+
+
+def make_engines(init_state, merge_dist, char_dist,
+                 pmin=1e-12, pmax=0.1, dist_exponent=4,
+                 epsilon=None, best_prog=None):
+    """The resamplers to compare with the same parameters.
+
+    The distance metric and boundary condition aren't used when
+    replaying so placeholders are given to the resamplers. The
+    'revo-numba' engine is only made if numba is installed, otherwise
+    it would be the same as 'revo'.
+
+    Parameters
+    ----------
+
+    init_state : WalkerState
+
+    merge_dist : float
+
+    char_dist : float
+
+    pmin : float
+
+    pmax : float
+
+    dist_exponent : int
+
+    epsilon : float, optional
+        If given with best_prog an EpsilonVariationLossREVOResampler
+        is also made.
+
+    best_prog : str, optional
+
+    Returns
+    -------
+
+    engines : dict of str : REVOResampler
+
+    """
+
+    params = dict(merge_dist=merge_dist, char_dist=char_dist,
+                  distance=Distance(), init_state=init_state,
+                  pmin=pmin, pmax=pmax, dist_exponent=dist_exponent)
+
+    engines = {
+        'revo' : REVOResampler(**params),
+        'revo-full' : REVOResampler(variation_mode='full', **params),
+        'variation-loss' : VariationLossREVOResampler(**params),
+    }
+
+    if HAVE_NUMBA:
+        engines['revo-numba'] = REVOResampler(decision_kernel='numba', **params)
+
+    if epsilon is not None and best_prog is not None:
+        engines['epsilon-variation-loss'] = EpsilonVariationLossREVOResampler(
+            bc_condition=BoundaryConditions(), epsilon=epsilon, best_prog=best_prog,
+            **params)
+
+    return engines
+
+
+def main(argv=None):
+    """Replay the resampling of a WepyHDF5 run with all of the engines of
+    `make_engines` and print the report."""
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('wepy_h5_path')
+    parser.add_argument('--run-idx', type=int, default=0)
+    parser.add_argument('--merge-dist', type=float, required=True)
+    parser.add_argument('--char-dist', type=float, required=True)
+    parser.add_argument('--pmin', type=float, default=1e-12)
+    parser.add_argument('--pmax', type=float, default=0.1)
+    parser.add_argument('--dist-exponent', type=int, default=4)
+    parser.add_argument('--epsilon', type=float, default=None)
+    parser.add_argument('--best-prog', choices=EpsilonVariationLossREVOResampler.BEST_PROG_METHODS,
+                        default=None)
+    parser.add_argument('--progress-field', default=None)
+    parser.add_argument('--reference', default=None,
+                        help="Engine to compare to, by default the recorded decisions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--per-cycle', action='store_true')
+    args = parser.parse_args(argv)
+
+    with WepyHDF5(args.wepy_h5_path, mode='r') as wepy_h5:
+
+        cycles = read_replay_cycles(wepy_h5, run_idx=args.run_idx,
+                                    progress_field=args.progress_field)
+
+        init_fields = wepy_h5.initial_walker_fields(args.run_idx, ['positions', 'box_vectors'],
+                                                    walker_idxs=[0])
+        init_state = WalkerState(**{field : values[0] for field, values in init_fields.items()})
+
+    engines = make_engines(init_state, args.merge_dist, args.char_dist,
+                           pmin=args.pmin, pmax=args.pmax, dist_exponent=args.dist_exponent,
+                           epsilon=args.epsilon, best_prog=args.best_prog)
+
+    results = benchmark_decide(engines, cycles, reference=args.reference, seed=args.seed)
+
+    print(format_benchmark_report(results, per_cycle=args.per_cycle))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""A compiled version of the greedy clone and merge optimization in
+`REVOResampler.decide`.
+
+The loop works only on arrays and scalars so it can be compiled with
+numba, which is used if it is installed. The variation is updated
+incrementally exactly like the 'incremental' mode of
+`VariationTracker` and walkers are chosen with the same tie breaking
+as `REVOResampler.decide`, so given the same random numbers the
+decisions are the same.
+
+The random choices of which walker of a merged pair to keep are made
+from an array of uniform random numbers in [0, 1) passed in by the
+caller, so the results are reproducible from the seed of whatever
+stream they were drawn from.
+
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+from stx_wepy.resampling.resamplers.variation import (
+    variation_kernel,
+    walker_novelties,
+    calc_variation,
+    merge_neighbor_lists,
+)
+
+
+def _novelty(walker_weight, num_walker_copy, lpmin, weights):
+
+    novelty = 0.0
+    if walker_weight > 0 and num_walker_copy > 0:
+        if weights:
+            novelty = np.log(walker_weight / num_walker_copy) - lpmin
+        else:
+            novelty = 1.0
+
+    if novelty < 0:
+        novelty = 0.0
+
+    return novelty
+
+
+def _update_amplitude(idx, walker_weights, num_walker_copies, kernel,
+                      novelties, amplitudes, sums, variation, lpmin, weights):
+
+    novelty = _novelty(walker_weights[idx], num_walker_copies[idx], lpmin, weights)
+    amplitude = novelty * num_walker_copies[idx]
+
+    delta = amplitude - amplitudes[idx]
+
+    if delta != 0:
+        variation += delta * sums[idx]
+        for walker_idx in range(sums.shape[0]):
+            sums[walker_idx] += kernel[idx, walker_idx] * delta
+
+    amplitudes[idx] = amplitude
+    novelties[idx] = novelty
+
+    return variation
+
+
+def _decide_loop(walker_weights, num_walker_copies, kernel,
+                 novelties, amplitudes, sums, variation,
+                 neighbor_offsets, neighbor_idxs,
+                 pmin, pmax, lpmin, weights, uniforms):
+
+    num_walkers = walker_weights.shape[0]
+
+    merge_targets = np.zeros(num_walkers, dtype=np.bool_)
+
+    # (keep_idx, squash_idx, clone_idx) of each accepted move
+    moves = np.empty((num_walkers, 3), dtype=np.int64)
+    num_moves = 0
+    num_trials = 0
+
+    # the variation of the current ensemble
+    current_variation = variation
+
+    productive = True
+    while productive:
+        productive = False
+
+        # the clone candidate with the largest walker variation,
+        # ties go to the largest index, and the merge candidate with
+        # the smallest, ties go to the smallest index
+        max_idx = -1
+        min_idx = -1
+        max_value = 0.0
+        min_value = 0.0
+        for idx in range(num_walkers):
+
+            walker_variation = novelties[idx] * sums[idx]
+
+            if (num_walker_copies[idx] >= 1) and \
+               (walker_weights[idx] / (num_walker_copies[idx] + 1) > pmin) and \
+               not merge_targets[idx]:
+                if max_idx < 0 or walker_variation >= max_value:
+                    max_idx = idx
+                    max_value = walker_variation
+
+            if (num_walker_copies[idx] == 1) and (walker_weights[idx] < pmax):
+                if min_idx < 0 or walker_variation < min_value:
+                    min_idx = idx
+                    min_value = walker_variation
+
+        if min_idx < 0 or max_idx < 0 or min_idx == max_idx:
+            break
+
+        # the closest eligible merge partner of the min walker
+        closewalk = -1
+        for neighbor_pos in range(neighbor_offsets[min_idx], neighbor_offsets[min_idx + 1]):
+            idx = neighbor_idxs[neighbor_pos]
+            if (idx != max_idx) and \
+               (num_walker_copies[idx] == 1) and \
+               (walker_weights[idx] + walker_weights[min_idx] < pmax):
+                closewalk = idx
+                break
+
+        if closewalk < 0:
+            break
+
+        # the trial move
+        num_trials += 1
+        tempsum = walker_weights[min_idx] + walker_weights[closewalk]
+        num_walker_copies[min_idx] = walker_weights[min_idx] / tempsum
+        num_walker_copies[closewalk] = walker_weights[closewalk] / tempsum
+        num_walker_copies[max_idx] += 1
+
+        checkpoint = (current_variation, novelties.copy(), amplitudes.copy(), sums.copy())
+
+        new_variation = current_variation
+        for idx in (min_idx, closewalk, max_idx):
+            new_variation = _update_amplitude(idx, walker_weights, num_walker_copies, kernel,
+                                              novelties, amplitudes, sums, new_variation,
+                                              lpmin, weights)
+
+        # like in `REVOResampler.decide` trial moves are compared to
+        # the variation of the last accepted trial move, not the one
+        # after its merge
+        if new_variation > variation:
+            productive = True
+            variation = new_variation
+
+            r = uniforms[num_moves] * (walker_weights[closewalk] + walker_weights[min_idx])
+            if r < walker_weights[closewalk]:
+                keep_idx = closewalk
+                squash_idx = min_idx
+            else:
+                keep_idx = min_idx
+                squash_idx = closewalk
+
+            walker_weights[keep_idx] += walker_weights[squash_idx]
+            walker_weights[squash_idx] = 0.0
+
+            num_walker_copies[squash_idx] = 0
+            num_walker_copies[keep_idx] = 1
+
+            merge_targets[keep_idx] = True
+            merge_targets[squash_idx] = False
+
+            moves[num_moves, 0] = keep_idx
+            moves[num_moves, 1] = squash_idx
+            moves[num_moves, 2] = max_idx
+            num_moves += 1
+
+            for idx in (keep_idx, squash_idx):
+                new_variation = _update_amplitude(idx, walker_weights, num_walker_copies, kernel,
+                                                  novelties, amplitudes, sums, new_variation,
+                                                  lpmin, weights)
+            current_variation = new_variation
+
+        else:
+            num_walker_copies[min_idx] = 1
+            num_walker_copies[closewalk] = 1
+            num_walker_copies[max_idx] -= 1
+
+            current_variation = checkpoint[0]
+            novelties[:] = checkpoint[1]
+            amplitudes[:] = checkpoint[2]
+            sums[:] = checkpoint[3]
+
+    return moves[:num_moves], current_variation, num_trials
+
+
+if numba is not None:
+    _novelty = numba.njit(cache=True, nogil=True)(_novelty)
+    _update_amplitude = numba.njit(cache=True, nogil=True)(_update_amplitude)
+    _decide_loop_numba = numba.njit(cache=True, nogil=True)(_decide_loop)
+
+
+def revo_decide(walker_weights, num_walker_copies, distance_matrix,
+                pmin, pmax, merge_dist, char_dist, dist_exponent,
+                lpmin, uniforms, weights=True):
+    """Find the REVO clone and merge decisions for an ensemble.
+
+    Uses the compiled loop if numba is installed and the same loop as
+    plain Python otherwise.
+
+    Parameters
+    ----------
+
+    walker_weights : list of float
+
+    num_walker_copies : list of int
+
+    distance_matrix : list of arraylike of shape (num_walkers)
+
+    pmin : float
+
+    pmax : float
+
+    merge_dist : float
+
+    char_dist : float
+
+    dist_exponent : int
+
+    lpmin : float
+        The log of the novelty weight floor, see `REVOResampler.lpmin`.
+
+    uniforms : arraylike of float of shape (num_walkers,)
+        Uniform random numbers in [0, 1), one is used for each
+        accepted merge in order.
+
+    weights : bool
+        If False the novelty of each existing walker is 1.
+
+    Returns
+    -------
+
+    merge_groups : list of list of int
+        The walkers squashed into each walker.
+
+    walker_clone_nums : list of int
+        The number of clones to make of each walker.
+
+    variation : float
+        The optimized variation.
+
+    num_uniforms : int
+        How many of the uniforms were used, which is also the number
+        of accepted moves.
+
+    num_trials : int
+        The number of trial moves.
+
+    """
+
+    walker_weights = np.array(walker_weights, dtype=np.float64)
+    num_walker_copies = np.array(num_walker_copies, dtype=np.float64)
+    uniforms = np.asarray(uniforms, dtype=np.float64)
+
+    num_walkers = walker_weights.shape[0]
+
+    assert uniforms.shape[0] >= num_walkers, \
+        "At least one uniform random number per walker is needed"
+
+    kernel = variation_kernel(distance_matrix, char_dist, dist_exponent)
+
+    # the initial values are the same as the VariationTracker ones
+    novelties = walker_novelties(walker_weights, num_walker_copies, lpmin, weights=weights)
+    variation, _ = calc_variation(kernel, novelties, num_walker_copies)
+    amplitudes = novelties * num_walker_copies
+    sums = kernel.dot(amplitudes)
+
+    # the merge neighbors of walker i are
+    # neighbor_idxs[neighbor_offsets[i]:neighbor_offsets[i+1]]
+    neighbor_lists = merge_neighbor_lists(distance_matrix, merge_dist)
+    neighbor_offsets = np.zeros(num_walkers + 1, dtype=np.int64)
+    neighbor_offsets[1:] = np.cumsum([len(neighbors) for neighbors in neighbor_lists])
+    neighbor_idxs = np.array([idx for neighbors in neighbor_lists for idx in neighbors],
+                             dtype=np.int64)
+
+    if numba is not None:
+        decide_loop = _decide_loop_numba
+    else:
+        decide_loop = _decide_loop
+
+    moves, variation, num_trials = decide_loop(walker_weights, num_walker_copies, kernel,
+                                               novelties, amplitudes, sums, float(variation),
+                                               neighbor_offsets, neighbor_idxs,
+                                               float(pmin), float(pmax), float(lpmin), bool(weights),
+                                               uniforms)
+
+    merge_groups = [[] for i in range(num_walkers)]
+    walker_clone_nums = [0 for i in range(num_walkers)]
+    for keep_idx, squash_idx, clone_idx in moves.tolist():
+        merge_groups[keep_idx].append(squash_idx)
+        merge_groups[keep_idx].extend(merge_groups[squash_idx])
+        merge_groups[squash_idx] = []
+        walker_clone_nums[clone_idx] += 1
+
+    return merge_groups, walker_clone_nums, variation, len(moves), num_trials
@@ -1,18 +1,32 @@
-import random as rand
 import itertools as it
 import logging
 import numpy as np
 
 # TODO: rename to PatchedREVOResampler and refactor to only necessary changes
 from stx_wepy.resampling.resamplers.revo import REVOResampler
+from stx_wepy.resampling.distance_records import compress_distance_matrix
+from stx_wepy.resampling.rng_records import rng_state_record
+from stx_wepy.resampling.resamplers.variation import (
+    eligible_merge_pairs,
+    min_variation_loss_pair,
+)
 
 class EpsilonVariationLossREVOResampler(REVOResampler):
     BEST_PROG_METHODS = ('min', 'max')
 
+    # the progress of the walkers the decisions were made with, this
+    # is the progress after warping unlike the boundary condition
+    # progress records
+    RESAMPLER_FIELDS = REVOResampler.RESAMPLER_FIELDS + ('walker_progress',)
+    RESAMPLER_SHAPES = REVOResampler.RESAMPLER_SHAPES + (Ellipsis,)
+    RESAMPLER_DTYPES = REVOResampler.RESAMPLER_DTYPES + (float,)
+    TRIU32_RESAMPLER_DTYPES = REVOResampler.TRIU32_RESAMPLER_DTYPES + (float,)
+
     def __init__(self,
                  bc_condition=None,
                  epsilon=np.inf,
                  best_prog =None,
+                 progress_field=None,
                  **kwargs):
 
 
@@ -25,7 +39,9 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
 
         bc_condition: wepy boundary condition class.
             The boundary condition to used to calculate simulation
-            progress.
+            progress. Boundary conditions with a progress cache
+            (e.g. NewRebindingBC) give the values they computed while
+            warping this cycle.
 
         epsilon: float
             The range along the progress coordinate to clone walkers.
@@ -35,6 +51,11 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
             Determining if the progress is maximizing or minimizing the
             progress coordinate.
 
+        progress_field : str, optional
+            The progress field of the boundary condition used as the
+            progress coordinate, defaults to the first of its
+            PROGRESS_FIELDS, e.g. 'native_rmsd' for NewRebindingBC.
+
         """
 
 
@@ -46,6 +67,11 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
 
         self.bc_cond = bc_condition
 
+        if progress_field is None and len(self.bc_cond.PROGRESS_FIELDS) > 0:
+            progress_field = self.bc_cond.PROGRESS_FIELDS[0]
+
+        self.progress_field = progress_field
+
         self.epsilon = epsilon
 
         self.best_prog = best_prog
@@ -62,8 +88,9 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
         weights : list of float                                  
             The weights of all walkers. The sum of all weights should be 1.0.
 
-        eligible_pairs : list of tuples
-            Pairs of walker indexes that meet the criteria for merging.
+        eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+            The pairs of walkers that meet the criteria for merging, see
+            `_find_eligible_merge_pairs`.
                                                                                                                                                           
         Returns                                                                                                                              
         -------                                                       
@@ -73,28 +100,7 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
             for merging and minimize variation loss.
          """
 
-        v_loss_min = np.inf
-        
-        min_loss_pair = ()
-
-        for pair in eligible_pairs:
-            walker_i = pair[0]
-            walker_j = pair[1]
-
-            wt_i = weights[walker_i]
-            wt_j = weights[walker_j]
-
-            v_i = walker_variation[walker_i]
-            v_j = walker_variation[walker_j]
-
-            v_loss = (wt_j * v_i + wt_i * v_j) / (wt_i + wt_j)
-
-            if v_loss < v_loss_min:
-                min_loss_pair = pair
-
-                v_loss_min = v_loss
-
-        return min_loss_pair
+        return min_variation_loss_pair(walker_variation, weights, eligible_pairs)
 
     def _find_eligible_merge_pairs(self, weights, distance_matrix, max_var_idx, num_walker_copies):
         """ Find pairs of walkers that are eligible to be merged.
@@ -121,27 +127,27 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
         Returns
         -------
         
-        eligible_pairs : list of tuples                                                                                                                             
-            Pairs of walker indexes that meet the criteria for merging.
+        eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+            True for the pairs of walker indexes (i, j) with i < j that
+            meet the criteria for merging.
 
         """
 
-        eligible_pairs = []
-
-        for i in range(len(weights) - 1):
-            for j in range(i + 1, len(weights)):
-                if i != max_var_idx and j != max_var_idx:
-                    if num_walker_copies[i] == 1 and num_walker_copies[j] == 1:
-                        if weights[i] + weights[j] < self.pmax:
-                            if distance_matrix[i][j] < self.merge_dist:
-                                eligible_pairs.append((i,j))
-
-        return eligible_pairs
+        return eligible_merge_pairs(weights, num_walker_copies, distance_matrix,
+                                    self.pmax, self.merge_dist,
+                                    clone_idx=max_var_idx)
 
     def _calc_progress(self, walkers):
 
         """ Determine the progress of each walker toward the boundary condition.
 
+        The progress is the `progress_field` of the boundary
+        condition, using its batched `progress` method if it has one.
+        The resampler is called after the walkers are warped, so
+        boundary conditions with a progress cache (e.g. NewRebindingBC)
+        return the values they computed while warping this cycle
+        instead of computing them again.
+
         Parameters
         ----------
 
@@ -154,14 +160,23 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
             list containing the progress of each walker.
         """
 
+        assert self.progress_field is not None, \
+            "The boundary condition has no progress fields, progress_field must be given."
+
         n_walkers = len(walkers)
 
         progress = np.zeros([n_walkers])
-        
+
+        # boundary conditions that can compute the progress of all the
+        # walkers at once (e.g. NewRebindingBC) do so
+        if hasattr(self.bc_cond, 'progress'):
+            walker_progresses = self.bc_cond.progress(walkers)
+        else:
+            walker_progresses = [self.bc_cond._progress(walker) for walker in walkers]
+
         for walker in range(n_walkers):
-            warp, prog_dic = self.bc_cond._progress(walkers[walker])
-            keys = [*prog_dic][0]
-            progress[walker] = prog_dic[keys]
+            warp, prog_dic = walker_progresses[walker]
+            progress[walker] = prog_dic[self.progress_field]
 
 
         return progress
@@ -219,14 +234,17 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
 
 
         # calculate the initial variation which will be optimized
-        variation, walker_variations = self._calcvariation(walker_weights,
-                                                           new_num_walker_copies,
-                                                           distance_matrix)
+        variation_tracker = self._variation_tracker(new_walker_weights,
+                                                    new_num_walker_copies,
+                                                    distance_matrix)
+        variation = variation_tracker.variation
+        walker_variations = variation_tracker.walker_variations
         variations.append(variation)
 
-        # maximize the variance through cloning and merging
-        logging.info(f"Starting variance optimization: {variation}")
+        num_trial_moves = 0
+        num_accepted_moves = 0
 
+        # maximize the variance through cloning and merging
         productive = True
         while productive:
             productive = False
@@ -277,7 +295,9 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
             if len(merge_pair) > 0 and len(max_tups) > 0:
                 min_idx = merge_pair [0]
                 closewalk = merge_pair [1]
-                
+
+                num_trial_moves += 1
+
                 # change new_amp
                 tempsum = new_walker_weights[min_idx] + new_walker_weights[closewalk]
                 new_num_walker_copies[min_idx] = new_walker_weights[min_idx]/tempsum
@@ -285,12 +305,15 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
                 new_num_walker_copies[max_idx] += 1
 
                 # re-determine variation function, and walker_variations values
-                new_variation, walker_variations = self._calcvariation(new_walker_weights, new_num_walker_copies, distance_matrix)
+                variation_tracker.checkpoint()
+                new_variation, walker_variations = variation_tracker.update(
+                    [min_idx, closewalk, max_idx],
+                    new_walker_weights, new_num_walker_copies)
 
                 if new_variation > variation:
                     variations.append(new_variation)
 
-                    logging.info(f"Variance move to, {new_variation}, accepted")
+                    num_accepted_moves += 1
 
 
                     productive = True
@@ -300,7 +323,7 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
                     # (min_idx, or closewalk), equivalent to:
                     # `random.choices([closewalk, min_idx],
                     #                 weights=[new_walker_weights[closewalk], new_walker_weights[min_idx])`
-                    r = rand.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
+                    r = self.rng.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
 
                      # keeps closewalk and gets rid of min_idx
                     if r < new_walker_weights[closewalk]:
@@ -335,19 +358,24 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
                     walker_clone_nums[max_idx] += 1
 
                     # new variation for starting new stage
-                    new_variation, walker_variations = self._calcvariation(new_walker_weights,
-                                                                          new_num_walker_copies,
-                                                                          distance_matrix)
+                    new_variation, walker_variations = variation_tracker.update(
+                        [keep_idx, squash_idx],
+                        new_walker_weights, new_num_walker_copies)
                     variations.append(new_variation)
 
-                    logging.info(f"variance after selection: {new_variation}")
-
 
                 # if not productive
                 else:
                     new_num_walker_copies[min_idx] = 1
                     new_num_walker_copies[closewalk] = 1
                     new_num_walker_copies[max_idx] -= 1
+                    variation_tracker.rollback()
+
+        self.instrumentation.count('trial_moves', num_trial_moves)
+        self.instrumentation.count('accepted_moves', num_accepted_moves)
+
+        logging.debug("Variation optimized from %s to %s, %d of %d trial moves accepted",
+                      variations[0], variations[-1], num_accepted_moves, num_trial_moves)
 
         # given we know what we want to clone to specific slots
         # (squashing other walkers) we need to determine where these
@@ -389,18 +417,22 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
         walker_weights = [walker.weight for walker in walkers]
         num_walker_copies = [1 for i in range(num_walkers)]
 
+        self.instrumentation.start_cycle()
+
+        # the generator state the decisions of this cycle start from
+        rng_state = rng_state_record(self.rng)
+
         # calculate distance matrix
         distance_matrix, images = self._all_to_all_distance(walkers)
 
         # Calculate the walker progress
         walker_prog = self._calc_progress(walkers)
 
-        logging.info("distance_matrix")
-        logging.info("\n{}".format(str(np.array(distance_matrix))))
-
         # determine cloning and merging actions to be performed, by
         # maximizing the variation, i.e. the Decider
-        resampling_data, variation = self.decide(walker_weights, num_walker_copies, distance_matrix, walker_prog)
+        with self.instrumentation.phase('decide'):
+            resampling_data, variation = self.decide(walker_weights, num_walker_copies,
+                                                     distance_matrix, walker_prog)
 
         # convert the target idxs and decision_id to feature vector arrays
         for record in resampling_data:
@@ -412,9 +444,13 @@ class EpsilonVariationLossREVOResampler(REVOResampler):
 
        # flatten the distance matrix and give the number of walkers
         # as well for the resampler data, there is just one per cycle
-        resampler_data = [{'distance_matrix' : np.ravel(np.array(distance_matrix)),
+        resampler_data = [{'distance_matrix' : compress_distance_matrix(distance_matrix,
+                                                                        self.distance_storage),
                            'num_walkers' : np.array([len(walkers)]),
                            'variation' : np.array([variation]),
+                           'rng_state' : rng_state,
+                           'walker_progress' : np.asarray(walker_prog, dtype=float),
+                           **self.instrumentation.record(),
                          }]
 
         return resampled_walkers, resampling_data, resampler_data
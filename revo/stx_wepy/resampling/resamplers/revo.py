@@ -1,14 +1,40 @@
 
 import multiprocessing as mulproc
-import random as rand
 import itertools as it
+from functools import partial
 
 import logging
-from eliot import start_action, log_call
 import numpy as np
 from wepy.resampling.resamplers.resampler import Resampler
 from wepy.resampling.resamplers.clone_merge  import CloneMergeResampler
 from wepy.resampling.decisions.clone_merge import MultiCloneMergeDecision
+from stx_wepy.resampling.resamplers.variation import (
+    variation_kernel,
+    walker_novelties,
+    calc_variation,
+    merge_neighbor_lists,
+    VariationTracker,
+)
+from stx_wepy.resampling.resamplers.decision_kernel import (
+    HAVE_NUMBA,
+    revo_decide,
+)
+from stx_wepy.resampling.executors import (
+    make_executor,
+    in_process,
+    pair_row_chunks,
+    image_distance_rows,
+)
+from stx_wepy.resampling.sparse_distances import sparse_distance_matrix
+from stx_wepy.resampling.distance_records import (
+    DISTANCE_STORAGES,
+    compress_distance_matrix,
+)
+from stx_wepy.resampling.rng_records import (
+    RNG_STATE_SIZE,
+    rng_state_record,
+)
+from stx_wepy.resampling.instrumentation import ResamplerInstrumentation
 class REVOResampler(CloneMergeResampler):
     r"""Resampler implementing the REVO algorithm.
     You can find more detailed information in the paper "REVO:
@@ -68,16 +94,26 @@ class REVOResampler(CloneMergeResampler):
 
     # fields that can be used for a table like representation
     RESAMPLING_RECORD_FIELDS = CloneMergeResampler.RESAMPLING_RECORD_FIELDS
+    # the instrumentation fields are added for the instrumentation
+    # level of the resampler, see `resampler_field_names`
     RESAMPLER_FIELDS = CloneMergeResampler.RESAMPLER_FIELDS + \
-                       ('num_walkers', 'distance_matrix', 'variation',)
+                       ('num_walkers', 'distance_matrix', 'variation', 'rng_state',)
     RESAMPLER_SHAPES = CloneMergeResampler.RESAMPLER_SHAPES + \
-                       ((1,), Ellipsis, (1,),)
+                       ((1,), Ellipsis, (1,), (RNG_STATE_SIZE,),)
     RESAMPLER_DTYPES = CloneMergeResampler.RESAMPLER_DTYPES + \
-                       (np.int, np.float, np.float,)
+                       (int, float, float, np.uint64,)
+    # the dtypes when the distance matrix is stored as the float32
+    # upper triangle, see `distance_records`
+    TRIU32_RESAMPLER_DTYPES = CloneMergeResampler.RESAMPLER_DTYPES + \
+                              (int, np.float32, float, np.uint64,)
 
     # fields that can be used for a table like representation
     RESAMPLER_RECORD_FIELDS = CloneMergeResampler.RESAMPLER_RECORD_FIELDS + \
                               ('variation',)
+    DISTANCE_MODES = ('dense', 'sparse')
+    DECISION_KERNELS = ('python', 'numba')
+    SPARSE_RADIUS_FACTOR = 2.0
+    """The default sparse radius in units of the larger of merge_dist and char_dist."""
     def __init__(self,
                  merge_dist=None,
                  char_dist=None,
@@ -88,6 +124,15 @@ class REVOResampler(CloneMergeResampler):
                  pmax=0.1,
                  dist_exponent=4,
                  seed=None,
+                 variation_mode='incremental',
+                 executor='serial',
+                 num_workers=None,
+                 distance_mode='dense',
+                 sparse_radius=None,
+                 num_pivots=8,
+                 distance_storage=None,
+                 decision_kernel='python',
+                 instrumentation='off',
                  **kwargs):
         """Constructor for the REVO Resampler.
         Parameters
@@ -113,7 +158,62 @@ class REVOResampler(CloneMergeResampler):
         init_state : WalkerState object
             Used for automatically determining the state image shape.
         seed : None or int, optional
-            The random seed. If None, the system (random) one will be used.
+            The seed of the random number generator of the
+            resampler. If None, a fresh one from the system is used.
+            The state of the generator at the start of each cycle is
+            saved in the 'rng_state' resampler record, see
+            `rng_records`.
+        variation_mode : str, optional
+            How the variation is updated after each trial clone and
+            merge move, one of 'incremental' (default), 'full' or
+            'verify'. See `VariationTracker`.
+        executor : str or object with a `map` method, optional
+            Used to compute the walker images and the all-to-all
+            distances in parallel. One of 'serial' (default), 'thread'
+            or 'process', or an executor like
+            `concurrent.futures.ProcessPoolExecutor`. A state_cache
+            of the distance metric is only shared with the 'serial'
+            and 'thread' executors, see `state_cache`.
+        num_workers : int, optional
+            The number of workers for thread and process executors,
+            defaults to the number of CPUs.
+        distance_mode : str, optional
+            'dense' (default) computes every distance exactly. 'sparse'
+            only computes the pairs that may be within `sparse_radius`
+            exactly and approximates the others by a lower bound, see
+            `sparse_distance_matrix`. In the dense mode metrics with an
+            `image_distance_matrix` method compute all the distances at
+            once, in the sparse mode they are computed pair by pair
+            with `image_distance` so only the close pairs are
+            evaluated.
+        sparse_radius : float, optional
+            Must be at least merge_dist so that all pairs that may be
+            merged are exact. Defaults to SPARSE_RADIUS_FACTOR times
+            the larger of merge_dist and char_dist.
+        num_pivots : int, optional
+            The number of pivot walkers used for the lower bounds in
+            the sparse mode.
+        distance_storage : str, optional
+            How the distance matrix is stored in the resampler records,
+            'full' for the flattened float64 matrix or 'triu32' for
+            only its upper triangle as float32. Read records with
+            `distance_records.distance_matrix_from_record`. Defaults
+            to 'full' in the dense mode and 'triu32' in the sparse
+            mode.
+        decision_kernel : str, optional
+            'python' (default) makes the decisions with the loop in
+            `decide`. 'numba' uses the compiled loop of
+            `decision_kernel.revo_decide` which always updates the
+            variation incrementally. The compiled loop is checked
+            against the Python one when the resampler is made, see
+            `_check_decision_kernel`. If numba isn't installed a
+            warning is logged and the Python loop is used instead.
+        instrumentation : str, optional
+            What is measured each cycle, 'off' (default), 'counters'
+            for the numbers of trial and accepted moves or 'timings'
+            for the counters and the times of the image, distance and
+            decide phases. Only the fields of what is measured are
+            added to the resampler records, see `instrumentation`.
         """
         # call the init methods in the CloneMergeResampler
         # superclass. We set the min and max number of walkers to be
@@ -135,12 +235,80 @@ class REVOResampler(CloneMergeResampler):
         self.distance = distance
         # the characteristic distance, char_dist
         self.char_dist = char_dist
-        # setting the random seed
+        # the random number generator, this is only used by this
+        # resampler so other users of random numbers in the process
+        # don't change the decisions
         self.seed = seed
-        if seed is not None:
-            rand.seed(seed)
+        self.rng = np.random.default_rng(seed)
         # setting the weights parameter
         self.weights = weights
+        assert variation_mode in VariationTracker.VARIATION_MODES, \
+            "variation_mode must be one of {}".format(VariationTracker.VARIATION_MODES)
+        self.variation_mode = variation_mode
+        # the executor for images and distances, pools are only made
+        # when first used
+        self._executor_spec = executor
+        self.num_workers = num_workers if num_workers is not None else mulproc.cpu_count()
+        self._executor = None
+        # images made in worker processes can't use or fill a cache
+        # the distance metric shares with e.g. the boundary conditions
+        if getattr(distance, 'state_cache', None) is not None and not in_process(executor):
+            logging.info("The state_cache of the distance metric is only shared "
+                         "in-process, images made by the %s executor won't use it",
+                         executor)
+        assert distance_mode in self.DISTANCE_MODES, \
+            "distance_mode must be one of {}".format(self.DISTANCE_MODES)
+        self.distance_mode = distance_mode
+        if sparse_radius is None:
+            sparse_radius = self.SPARSE_RADIUS_FACTOR * max(self.merge_dist, self.char_dist)
+        assert sparse_radius >= self.merge_dist, \
+            "sparse_radius must not be smaller than merge_dist"
+        self.sparse_radius = sparse_radius
+        self.num_pivots = num_pivots
+        if distance_storage is None:
+            distance_storage = 'triu32' if self.distance_mode == 'sparse' else 'full'
+        assert distance_storage in DISTANCE_STORAGES, \
+            "distance_storage must be one of {}".format(DISTANCE_STORAGES)
+        self.distance_storage = distance_storage
+        assert decision_kernel in self.DECISION_KERNELS, \
+            "decision_kernel must be one of {}".format(self.DECISION_KERNELS)
+        if decision_kernel == 'numba' and not HAVE_NUMBA:
+            logging.warning("numba is not installed, using the python decision loop")
+            decision_kernel = 'python'
+        self.decision_kernel = decision_kernel
+        self.instrumentation = ResamplerInstrumentation(instrumentation)
+        # compile the loop now and make sure it agrees with the python one
+        if self.decision_kernel == 'numba':
+            self._check_decision_kernel()
+    def resampler_field_names(self):
+        """The names of the resampler record fields, with the fields
+        measured at the instrumentation level."""
+        return self.RESAMPLER_FIELDS + self.instrumentation.fields()[0]
+    def resampler_field_shapes(self):
+        """The shapes of the resampler record fields, see
+        `resampler_field_names`."""
+        return self.RESAMPLER_SHAPES + self.instrumentation.fields()[1]
+    def resampler_field_dtypes(self):
+        """The dtypes of the resampler record fields for the distance
+        matrix storage, see `resampler_field_names`."""
+        if self.distance_storage == 'triu32':
+            return self.TRIU32_RESAMPLER_DTYPES + self.instrumentation.fields()[2]
+        return self.RESAMPLER_DTYPES + self.instrumentation.fields()[2]
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # pools can't be pickled, the executor is made again when first
+        # used. An executor that was given is replaced by a serial one
+        state['_executor'] = None
+        if not isinstance(self._executor_spec, str):
+            state['_executor_spec'] = 'serial'
+        return state
+    @property
+    def executor(self):
+        """The executor used for computing images and distances."""
+        if self._executor is None:
+            self._executor = make_executor(self._executor_spec,
+                                           num_workers=self.num_workers)
+        return self._executor
 
     def _novelty(self, walker_weight, num_walker_copy):
         """Calculates the novelty fuction value.
@@ -164,6 +332,20 @@ class REVOResampler(CloneMergeResampler):
         if novelty < 0:
             novelty = 0
         return novelty
+    def _novelties(self, walker_weights, num_walker_copies):
+        """Calculates the novelty function value of all walkers.
+        Parameters
+        ----------
+        walker_weights : list of float
+            The weights of all walkers.
+        num_walker_copies : list of int
+            The number of copies of each walker.
+        Returns
+        -------
+        novelties : arraylike of shape (num_walkers)
+        """
+        return walker_novelties(walker_weights, num_walker_copies,
+                                self.lpmin, weights=self.weights)
     def _calcvariation(self, walker_weights, num_walker_copies, distance_matrix):
         """Calculates the variation value.
         Parameters
@@ -183,25 +365,27 @@ class REVOResampler(CloneMergeResampler):
         walker_variations : arraylike of shape (num_walkers)
            The Vi value of each walker.
         """
-        num_walkers = len(walker_weights)
-        # set the novelty values
-        walker_novelties = np.array([self._novelty(walker_weights[i], num_walker_copies[i])
-                               for i in range(num_walkers)])
-        # the value to be optimized
-        variation = 0
-        # the walker variation values (Vi values)
-        walker_variations = np.zeros(num_walkers)
-        # calculate the variation and walker variation values
-        for i in range(num_walkers - 1):
-            if num_walker_copies[i] > 0:
-                for j in range(i+1, num_walkers):
-                    if num_walker_copies[j] > 0:
-                        partial_variation = ((distance_matrix[i][j] / self.char_dist) ** self.dist_exponent) \
-                        * walker_novelties[i] * walker_novelties[j]
-                        variation += partial_variation * num_walker_copies[i] * num_walker_copies[j]
-                        walker_variations[i] += partial_variation * num_walker_copies[j]
-                        walker_variations[j] += partial_variation * num_walker_copies[i]
-        return variation, walker_variations
+        kernel = variation_kernel(distance_matrix, self.char_dist, self.dist_exponent)
+        novelties = self._novelties(walker_weights, num_walker_copies)
+        return calc_variation(kernel, novelties, num_walker_copies)
+    def _variation_tracker(self, walker_weights, num_walker_copies, distance_matrix):
+        """Makes the object that keeps track of the variation during the
+        optimization in `decide`.
+        Parameters
+        ----------
+        walker_weights : list of float
+            The weights of all walkers. The sum of all weights should be 1.0.
+        num_walker_copies : list of int
+            The number of copies of each walker.
+        distance_matrix : list of arraylike of shape (num_walkers)
+        Returns
+        -------
+        variation_tracker : VariationTracker
+        """
+        kernel = variation_kernel(distance_matrix, self.char_dist, self.dist_exponent)
+        return VariationTracker(kernel, self._novelties,
+                                walker_weights, num_walker_copies,
+                                mode=self.variation_mode)
     def decide(self, walker_weights, num_walker_copies, distance_matrix):
         """Optimize the trajectory variation by making decisions for resampling.
         Parameters
@@ -221,20 +405,31 @@ class REVOResampler(CloneMergeResampler):
         resampling_data : list of dict of str: value
             The resampling records resulting from the decisions.
         """
+        if self.decision_kernel == 'numba':
+            return self._kernel_decide(walker_weights, num_walker_copies, distance_matrix)
         num_walkers = len(walker_weights)
         variations = []
         merge_groups = [[] for i in range(num_walkers)]
         walker_clone_nums = [0 for i in range(num_walkers)]
-        # make copy of walkers properties
-        new_walker_weights = walker_weights.copy()
-        new_num_walker_copies = num_walker_copies.copy()
+        # make copy of walkers properties, the copies are floats since
+        # they are fractional during a trial move
+        new_walker_weights = np.array(walker_weights, dtype=np.float64)
+        new_num_walker_copies = np.array(num_walker_copies, dtype=np.float64)
+        # walkers that are the keep target of a merge group
+        merge_targets = np.zeros(num_walkers, dtype=bool)
+        # the distances don't change so the merge partners of each
+        # walker are sorted once, closest first
+        merge_neighbors = merge_neighbor_lists(distance_matrix, self.merge_dist)
         # calculate the initial variation which will be optimized
-        variation, walker_variations = self._calcvariation(walker_weights,
-                                                           new_num_walker_copies,
-                                                           distance_matrix)
+        variation_tracker = self._variation_tracker(new_walker_weights,
+                                                    new_num_walker_copies,
+                                                    distance_matrix)
+        variation = variation_tracker.variation
+        walker_variations = variation_tracker.walker_variations
         variations.append(variation)
+        num_trial_moves = 0
+        num_accepted_moves = 0
         # maximize the variance through cloning and merging
-        logging.info("Starting variance optimization: {}".format(variation))
         productive = True
         while productive:
             productive = False
@@ -246,67 +441,63 @@ class REVOResampler(CloneMergeResampler):
             # maximum walker_variations walker (distance to other walkers) will be
             # tagged for cloning (stored in maxwind), except if it is
             # already a keep merge target
-            max_tups = []
-            for i, value in enumerate(walker_variations):
-                # 1. must have an amp >=1 which gives the number of clones to be made of it
-                # 2. clones for the given amplitude must not be smaller than the minimum probability
-                # 3. must not already be a keep merge target
-                if (new_num_walker_copies[i] >= 1) and \
-                   (new_walker_weights[i]/(new_num_walker_copies[i] + 1) > self.pmin) and \
-                   (len(merge_groups[i]) == 0):
-                    max_tups.append((value, i))
-            if len(max_tups) > 0:
-                max_value, max_idx = max(max_tups)
+            # 1. must have an amp >=1 which gives the number of clones to be made of it
+            # 2. clones for the given amplitude must not be smaller than the minimum probability
+            # 3. must not already be a keep merge target
+            clone_candidates = (new_num_walker_copies >= 1) & \
+                               (new_walker_weights/(new_num_walker_copies + 1) > self.pmin) & \
+                               ~merge_targets
+            if clone_candidates.any():
+                # the largest value, ties go to the largest index
+                clone_values = np.where(clone_candidates, walker_variations, -np.inf)
+                max_idx = num_walkers - 1 - int(np.argmax(clone_values[::-1]))
             # walker with the lowest walker_variations (distance to other walkers)
             # will be tagged for merging (stored in min_idx)
-            min_tups = [(value, i) for i,value in enumerate(walker_variations)
-                        if new_num_walker_copies[i] == 1 and (new_walker_weights[i]  < self.pmax)]
-            if len(min_tups) > 0:
-                min_value, min_idx = min(min_tups)
+            merge_candidates = (new_num_walker_copies == 1) & (new_walker_weights < self.pmax)
+            if merge_candidates.any():
+                # the smallest value, ties go to the smallest index
+                merge_values = np.where(merge_candidates, walker_variations, np.inf)
+                min_idx = int(np.argmin(merge_values))
             # does min_idx have an eligible merging partner?
             # closedist = self.merge_dist
             closewalk = None
-            condition_list = np.array([i is not None for i in [min_idx, max_idx]])
-            if condition_list.all() and min_idx != max_idx:
-                # get the walkers that aren't the minimum and the max
-                # walker_variations walkers, as candidates for merging
-                closewalks = set(range(num_walkers)).difference([min_idx, max_idx])
-                # remove those walkers that if they were merged with
-                # the min walker_variations walker would violate the pmax
-                closewalks = [idx for idx in closewalks
-                                      if (new_num_walker_copies[idx]==1) and
-                                       (new_walker_weights[idx] + new_walker_weights[min_idx] < self.pmax)
-                                      ]
-                # if there are any walkers left, get the distances of
-                # the close walkers to the min walker_variations walker if that
-                # distance is less than the maximum merge distance
-                if len(closewalks) > 0:
-                    closewalks_dists = [(distance_matrix[min_idx][i], i) for i in closewalks
-                                            if distance_matrix[min_idx][i] < (self.merge_dist)]
-                    # if any were found set this as the closewalk
-                    if len(closewalks_dists) > 0:
-                        closedist, closewalk = min(closewalks_dists)
+            if min_idx is not None and max_idx is not None and min_idx != max_idx:
+                # the closest walker within the merge distance that
+                # isn't the max walker_variations walker and that
+                # wouldn't violate pmax if merged with the min
+                # walker_variations walker, walkers that are no longer
+                # eligible are skipped
+                for idx in merge_neighbors[min_idx]:
+                    if (idx != max_idx) and \
+                       (new_num_walker_copies[idx] == 1) and \
+                       (new_walker_weights[idx] + new_walker_weights[min_idx] < self.pmax):
+                        closewalk = idx
+                        break
             # did we find a closewalk?
             condition_list = np.array([i is not None for i in [min_idx, max_idx, closewalk]])
             #if we find a walker for cloning, a walker and its close neighbor for merging
             if condition_list.all() :
+                num_trial_moves += 1
                 # change new_amp
                 tempsum = new_walker_weights[min_idx] + new_walker_weights[closewalk]
                 new_num_walker_copies[min_idx] = new_walker_weights[min_idx]/tempsum
                 new_num_walker_copies[closewalk] = new_walker_weights[closewalk]/tempsum
                 new_num_walker_copies[max_idx] += 1
                 # re-determine variation function, and walker_variations values
-                new_variation, walker_variations = self._calcvariation(new_walker_weights, new_num_walker_copies, distance_matrix)
+                variation_tracker.checkpoint()
+                new_variation, walker_variations = variation_tracker.update(
+                    [min_idx, closewalk, max_idx],
+                    new_walker_weights, new_num_walker_copies)
                 if new_variation > variation:
                     variations.append(new_variation)
-                    logging.info("Variance move to {} accepted".format(new_variation))
+                    num_accepted_moves += 1
                     productive = True
                     variation = new_variation
                     # make a decision on which walker to keep
                     # (min_idx, or closewalk), equivalent to:
                     # `random.choices([closewalk, min_idx],
                     #                 weights=[new_walker_weights[closewalk], new_walker_weights[min_idx])`
-                    r = rand.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
+                    r = self.rng.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
                      # keeps closewalk and gets rid of min_idx
                     if r < new_walker_weights[closewalk]:
                         keep_idx = closewalk
@@ -328,20 +519,26 @@ class REVOResampler(CloneMergeResampler):
                     merge_groups[keep_idx].extend(merge_groups[squash_idx])
                     # reset the merge group that was just squashed to empty
                     merge_groups[squash_idx] = []
+                    merge_targets[keep_idx] = True
+                    merge_targets[squash_idx] = False
                     # increase the number of clones that the cloned
                     # walker has
                     walker_clone_nums[max_idx] += 1
                     # new variation for starting new stage
-                    new_variation, walker_variations = self._calcvariation(new_walker_weights,
-                                                                          new_num_walker_copies,
-                                                                          distance_matrix)
+                    new_variation, walker_variations = variation_tracker.update(
+                        [keep_idx, squash_idx],
+                        new_walker_weights, new_num_walker_copies)
                     variations.append(new_variation)
-                    logging.info("variance after selection: {}".format(new_variation))
                 # if not productive
                 else:
                     new_num_walker_copies[min_idx] = 1
                     new_num_walker_copies[closewalk] = 1
                     new_num_walker_copies[max_idx] -= 1
+                    variation_tracker.rollback()
+        self.instrumentation.count('trial_moves', num_trial_moves)
+        self.instrumentation.count('accepted_moves', num_accepted_moves)
+        logging.debug("Variation optimized from %s to %s, %d of %d trial moves accepted",
+                      variations[0], variations[-1], num_accepted_moves, num_trial_moves)
         # given we know what we want to clone to specific slots
         # (squashing other walkers) we need to determine where these
         # squashed walkers will be merged
@@ -353,6 +550,89 @@ class REVOResampler(CloneMergeResampler):
             walker_record['step_idx'] = np.array([0])
             walker_record['walker_idx'] = np.array([walker_idx])
         return walker_actions, variations[-1]
+    def _check_decision_kernel(self, num_walkers=16, seed=0, rtol=1e-12):
+        """Check that the compiled decision loop makes the same decisions
+        as the Python loop of `REVOResampler.decide` for a random
+        ensemble and the same random numbers.
+        This also compiles the loop, or loads it from the numba cache,
+        so the first cycle doesn't wait for it. The random number
+        generator and instrumentation of the resampler are left as
+        they were.
+        Parameters
+        ----------
+        num_walkers : int
+        seed : int
+            The seed of the ensemble and of the random numbers for the
+            merges.
+        rtol : float
+            The compiled loop may round the variation differently in
+            the last digits, so it is only compared to this relative
+            tolerance.
+        """
+        ens_rng = np.random.default_rng(seed)
+        # points spread over a few merge distances so there are merges
+        points = ens_rng.random((num_walkers, 2)) * 4 * self.merge_dist
+        distance_matrix = np.linalg.norm(points[:, None] - points[None], axis=-1)
+        walker_weights = list(ens_rng.dirichlet(np.ones(num_walkers)))
+        num_walker_copies = [1 for i in range(num_walkers)]
+        rng, instrumentation, decision_kernel = self.rng, self.instrumentation, self.decision_kernel
+        self.instrumentation = ResamplerInstrumentation('off')
+        try:
+            results = {}
+            for kernel in ('python', 'numba'):
+                self.decision_kernel = kernel
+                self.rng = np.random.default_rng(seed)
+                walker_actions, variation = REVOResampler.decide(self, walker_weights,
+                                                                 num_walker_copies,
+                                                                 distance_matrix)
+                decisions = [(int(record['decision_id']), tuple(record['target_idxs']))
+                             for record in walker_actions]
+                # the generator should also be advanced the same
+                results[kernel] = (decisions, variation, self.rng.random())
+        finally:
+            self.rng, self.instrumentation, self.decision_kernel = rng, instrumentation, decision_kernel
+        python_decisions, python_variation, python_next = results['python']
+        numba_decisions, numba_variation, numba_next = results['numba']
+        assert numba_decisions == python_decisions and numba_next == python_next, \
+            "The numba decision kernel doesn't make the same decisions as the python loop"
+        assert np.isclose(numba_variation, python_variation, rtol=rtol, atol=0.0), \
+            "The numba decision kernel variation {} doesn't match the python loop {}".format(
+                numba_variation, python_variation)
+    def _kernel_decide(self, walker_weights, num_walker_copies, distance_matrix):
+        """Same as `decide` but using the compiled decision loop, see
+        `decision_kernel.revo_decide`.
+        Parameters
+        ----------
+        walker_weights : list of flaot
+        num_walker_copies : list of int
+        distance_matrix : list of arraylike of shape (num_walkers)
+        Returns
+        -------
+        variation : float
+            The optimized value of the trajectory variation.
+        resampling_data : list of dict of str: value
+            The resampling records resulting from the decisions.
+        """
+        num_walkers = len(walker_weights)
+        # the loop can't draw from the generator itself so it gets
+        # one uniform per possible merge, the generator is then rewound
+        # and only the ones that were used are drawn again so it
+        # advances the same as with the python loop
+        rng_state = self.rng.bit_generator.state
+        uniforms = self.rng.random(num_walkers)
+        merge_groups, walker_clone_nums, variation, num_uniforms, num_trials = revo_decide(
+            walker_weights, num_walker_copies, distance_matrix,
+            self.pmin, self.pmax, self.merge_dist, self.char_dist, self.dist_exponent,
+            self.lpmin, uniforms, weights=self.weights)
+        self.rng.bit_generator.state = rng_state
+        self.rng.random(num_uniforms)
+        self.instrumentation.count('trial_moves', num_trials)
+        self.instrumentation.count('accepted_moves', num_uniforms)
+        walker_actions = self.assign_clones(merge_groups, walker_clone_nums)
+        for walker_idx, walker_record in enumerate(walker_actions):
+            walker_record['step_idx'] = np.array([0])
+            walker_record['walker_idx'] = np.array([walker_idx])
+        return walker_actions, variation
     def _all_to_all_distance(self, walkers):
         """ Calculate the pairwise all-to-all distances between walkers.
         Parameters
@@ -363,23 +643,69 @@ class REVOResampler(CloneMergeResampler):
         distance_matrix : list of arraylike of shape (num_walkers)
         images : list of image obeject
         """
-        # initialize an all-to-all matrix, with 0.0 for self distances
-        dist_mat = np.zeros((len(walkers), len(walkers)))
-        # make images for all the walker states for us to compute distances on
-        images = []
-        for walker in walkers:
-            image = self.distance.image(walker.state)
-            images.append(image)
-        # get the combinations of indices for all walker pairs
-        for i, j in it.combinations(range(len(images)), 2):
-            # calculate the distance between the two walkers
-            dist = self.distance.image_distance(images[i], images[j])
-            # save this in the matrix in both spots
-            dist_mat[i][j] = dist
-            dist_mat[j][i] = dist
+        num_walkers = len(walkers)
+        # split the work into a few chunks per worker
+        if self._executor_spec == 'serial':
+            num_chunks = 1
+        else:
+            num_chunks = 4 * self.num_workers
+        # make images for all the walker states for us to compute
+        # distances on, once per walker
+        states = [walker.state for walker in walkers]
+        chunksize = max(1, num_walkers // num_chunks)
+        with self.instrumentation.phase('image'):
+            if hasattr(self.distance, 'images'):
+                # distance metrics that can make images for many states at
+                # once get a chunk of the states at a time
+                state_chunks = [states[i:i + chunksize]
+                                for i in range(0, num_walkers, chunksize)]
+                images = [image
+                          for chunk_images in self.executor.map(self.distance.images, state_chunks)
+                          for image in chunk_images]
+            else:
+                images = list(self.executor.map(self.distance.image, states,
+                                                chunksize=chunksize))
+        with self.instrumentation.phase('distance'):
+            dist_mat = self._image_distance_matrix(images, num_chunks)
         return [walker_dists for walker_dists in dist_mat], images
-    @log_call(include_args=[],
-              include_result=False)
+    def _image_distance_matrix(self, images, num_chunks):
+        """Calculate the all-to-all distance matrix of the walker images.
+        Parameters
+        ----------
+        images : list of image obeject
+        num_chunks : int
+            The number of chunks the work is split into for the executor.
+        Returns
+        -------
+        distance_matrix : arraylike of shape (num_walkers, num_walkers)
+        """
+        num_walkers = len(images)
+        # the sparse mode is used even for metrics that can compute all
+        # the distances at once so the far pairs are never computed
+        if self.distance_mode == 'sparse':
+            dist_mat, exact_pairs = sparse_distance_matrix(self.distance, images,
+                                                           self.sparse_radius,
+                                                           num_pivots=self.num_pivots,
+                                                           executor=self.executor,
+                                                           num_chunks=num_chunks)
+            logging.debug("%d of %d distances computed exactly",
+                          (np.count_nonzero(exact_pairs) - num_walkers) // 2,
+                          num_walkers * (num_walkers - 1) // 2)
+            return dist_mat
+        # distance metrics that can compute all the distances at once
+        # don't need to go through the executor
+        if hasattr(self.distance, 'image_distance_matrix'):
+            return self.distance.image_distance_matrix(np.array(images))
+        # initialize an all-to-all matrix, with 0.0 for self distances
+        dist_mat = np.zeros((num_walkers, num_walkers))
+        # compute the upper triangle in chunks of rows
+        row_chunk_func = partial(image_distance_rows, self.distance, images)
+        for rows in self.executor.map(row_chunk_func,
+                                      pair_row_chunks(num_walkers, num_chunks)):
+            for i, row_dists in rows:
+                dist_mat[i, i+1:] = row_dists
+        # save the distances in both spots
+        return dist_mat + dist_mat.T
     def resample(self, walkers):
         """Resamples walkers based on REVO algorithm
         Parameters
@@ -397,13 +723,16 @@ class REVOResampler(CloneMergeResampler):
         num_walkers = len(walkers)
         walker_weights = [walker.weight for walker in walkers]
         num_walker_copies = [1 for i in range(num_walkers)]
+        self.instrumentation.start_cycle()
+        # the generator state the decisions of this cycle start from
+        rng_state = rng_state_record(self.rng)
         # calculate distance matrix
         distance_matrix, images = self._all_to_all_distance(walkers)
-        logging.info("distance_matrix")
-        logging.info("\n{}".format(str(np.array(distance_matrix))))
         # determine cloning and merging actions to be performed, by
         # maximizing the variation, i.e. the Decider
-        resampling_data, variation = self.decide(walker_weights, num_walker_copies, distance_matrix)
+        with self.instrumentation.phase('decide'):
+            resampling_data, variation = self.decide(walker_weights, num_walker_copies,
+                                                     distance_matrix)
         # convert the target idxs and decision_id to feature vector arrays
         for record in resampling_data:
             record['target_idxs'] = np.array(record['target_idxs'])
@@ -412,8 +741,11 @@ class REVOResampler(CloneMergeResampler):
         resampled_walkers = self.DECISION.action(walkers, [resampling_data])
        # flatten the distance matrix and give the number of walkers
         # as well for the resampler data, there is just one per cycle
-        resampler_data = [{'distance_matrix' : np.ravel(np.array(distance_matrix)),
+        resampler_data = [{'distance_matrix' : compress_distance_matrix(distance_matrix,
+                                                                        self.distance_storage),
                            'num_walkers' : np.array([len(walkers)]),
-                           'variation' : np.array([variation])}]
+                           'variation' : np.array([variation]),
+                           'rng_state' : rng_state,
+                           **self.instrumentation.record()}]
 
         return resampled_walkers, resampling_data, resampler_data
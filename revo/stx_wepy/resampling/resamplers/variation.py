@@ -0,0 +1,447 @@
+r"""Array based evaluation of the REVO trajectory variation.
+
+The REVO resamplers repeatedly evaluate the trajectory variation
+
+.. math::
+    V = \sum_{i<j} (\frac{d_{ij}}{d_0})^{\alpha} \phi_i \phi_j c_i c_j
+
+where :math:`\phi_i` is the novelty and :math:`c_i` the number of
+copies of walker `i`. The functions here do this with NumPy array
+operations instead of a double loop over walker pairs.
+
+The partial sums are accumulated in the same order as the original
+pure-Python loop (row-major over the upper triangle of the distance
+matrix) so that the results are bit-for-bit identical to it and
+existing `variation` records stay comparable.
+
+"""
+
+import numpy as np
+
+
+def variation_kernel(distance_matrix, char_dist, dist_exponent):
+    r"""Calculate the distance part of the variation for all walker pairs.
+
+    Parameters
+    ----------
+
+    distance_matrix : list of arraylike of shape (num_walkers)
+        The all-to-all distance matrix. Only the upper triangle is
+        used.
+
+    char_dist : float
+        The characteristic distance (d0).
+
+    dist_exponent : int
+        The distance exponent (alpha).
+
+    Returns
+    -------
+
+    kernel : arraylike of shape (num_walkers, num_walkers)
+        Symmetric matrix of :math:`(d_{ij}/d_0)^{\alpha}` with zeros on
+        the diagonal.
+
+    """
+
+    distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+
+    # compute from the upper triangle only and mirror it so that the
+    # value for a pair does not depend on its order
+    kernel = np.triu(np.power(distance_matrix / char_dist, dist_exponent), k=1)
+
+    return kernel + kernel.T
+
+
+def walker_novelties(walker_weights, num_walker_copies, lpmin, weights=True):
+    """Calculates the novelty function value for all walkers.
+
+    Parameters
+    ----------
+
+    walker_weights : list of float
+        The weights of all walkers.
+
+    num_walker_copies : list of int
+        The number of copies of each walker.
+
+    lpmin : float
+        The log of the novelty weight floor, see `REVOResampler.lpmin`.
+
+    weights : bool
+        If False the novelty of each existing walker is 1.
+
+    Returns
+    -------
+
+    novelties : arraylike of shape (num_walkers)
+
+    """
+
+    walker_weights = np.asarray(walker_weights, dtype=np.float64)
+    num_walker_copies = np.asarray(num_walker_copies, dtype=np.float64)
+
+    novelties = np.zeros(walker_weights.shape[0])
+
+    alive = (walker_weights > 0) & (num_walker_copies > 0)
+
+    if weights:
+        novelties[alive] = np.log(walker_weights[alive] / num_walker_copies[alive]) - lpmin
+    else:
+        novelties[alive] = 1
+
+    novelties[novelties < 0] = 0
+
+    return novelties
+
+
+def calc_variation(kernel, novelties, num_walker_copies):
+    """Calculates the variation value and the Vi value of each walker.
+
+    Parameters
+    ----------
+
+    kernel : arraylike of shape (num_walkers, num_walkers)
+        The output of `variation_kernel`.
+
+    novelties : arraylike of shape (num_walkers)
+        The output of `walker_novelties`.
+
+    num_walker_copies : list of int
+        The number of copies of each walker, walkers with 0 copies
+        do not contribute.
+
+    Returns
+    -------
+
+    variation : float
+       The calculated variation value.
+
+    walker_variations : arraylike of shape (num_walkers)
+       The Vi value of each walker.
+
+    """
+
+    num_walker_copies = np.asarray(num_walker_copies, dtype=np.float64)
+    num_walkers = num_walker_copies.shape[0]
+
+    if num_walkers < 2:
+        return 0.0, np.zeros(num_walkers)
+
+    alive = num_walker_copies > 0
+    pair_mask = np.triu(alive[:, None] & alive[None, :], k=1)
+
+    # the partial variation for each pair, built from the upper
+    # triangle in the same operation order as the original loop
+    partial_variations = np.where(pair_mask,
+                                  kernel * novelties[:, None] * novelties[None, :],
+                                  0.0)
+
+    # cumulative sums are strictly sequential which reproduces the
+    # summation order of the loop, np.sum would use pairwise summation
+    upper_idxs = np.triu_indices(num_walkers, k=1)
+    pair_variations = (partial_variations * num_walker_copies[:, None])[upper_idxs] \
+                      * num_walker_copies[upper_idxs[1]]
+    variation = np.cumsum(pair_variations)[-1]
+
+    partial_variations = partial_variations + partial_variations.T
+    walker_variations = np.cumsum(partial_variations * num_walker_copies[None, :],
+                                  axis=1)[:, -1]
+
+    return variation, walker_variations
+
+
+def merge_neighbor_lists(distance_matrix, merge_dist):
+    """For every walker the other walkers within the merge distance,
+    sorted from the closest to the farthest.
+
+    The distances between walkers don't change during resampling so
+    these only need to be made once per cycle. Walkers at the same
+    distance are ordered by their index.
+
+    Parameters
+    ----------
+
+    distance_matrix : list of arraylike of shape (num_walkers)
+
+    merge_dist : float
+
+    Returns
+    -------
+
+    neighbor_lists : list of list of int
+
+    """
+
+    distance_matrix = np.asarray(distance_matrix)
+
+    neighbor_lists = []
+    for walker_idx, distances in enumerate(distance_matrix):
+
+        neighbor_idxs = np.flatnonzero(distances < merge_dist)
+        neighbor_idxs = neighbor_idxs[neighbor_idxs != walker_idx]
+
+        # a stable sort keeps the ties in index order
+        neighbor_lists.append(
+            neighbor_idxs[np.argsort(distances[neighbor_idxs], kind='stable')].tolist())
+
+    return neighbor_lists
+
+
+def eligible_merge_pairs(walker_weights, num_walker_copies, distance_matrix,
+                         pmax, merge_dist, clone_idx=None):
+    """Find all pairs of walkers that are eligible to be merged.
+
+    A pair is eligible if neither walker is the walker to be cloned,
+    both have exactly one copy, their combined weight is less than
+    pmax and their distance is less than the merge distance.
+
+    Parameters
+    ----------
+
+    walker_weights : list of float
+
+    num_walker_copies : list of int
+
+    distance_matrix : list of arraylike of shape (num_walkers)
+
+    pmax : float
+
+    merge_dist : float
+
+    clone_idx : int, optional
+        The index of the walker that will be cloned.
+
+    Returns
+    -------
+
+    eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+        True for the eligible pairs (i, j) with i < j.
+
+    """
+
+    walker_weights = np.asarray(walker_weights, dtype=np.float64)
+    distance_matrix = np.asarray(distance_matrix)
+
+    single_copies = np.asarray(num_walker_copies) == 1
+
+    if clone_idx is not None:
+        single_copies[clone_idx] = False
+
+    eligible_pairs = single_copies[:, None] & single_copies[None, :]
+    eligible_pairs &= (walker_weights[:, None] + walker_weights[None, :]) < pmax
+    eligible_pairs &= distance_matrix < merge_dist
+
+    return np.triu(eligible_pairs, k=1)
+
+
+def min_variation_loss_pair(walker_variations, walker_weights, eligible_pairs):
+    """Find the eligible pair of walkers which loses the least variation
+    when merged.
+
+    The loss of merging walkers i and j is
+    :math:`(w_j V_i + w_i V_j) / (w_i + w_j)`. Ties are broken in
+    favor of the first pair in row-major order.
+
+    Parameters
+    ----------
+
+    walker_variations : arraylike of shape (num_walkers)
+
+    walker_weights : list of float
+
+    eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+        The output of `eligible_merge_pairs`.
+
+    Returns
+    -------
+
+    merge_pair : tuple of int
+        The indices (i, j) of the pair, or an empty tuple if there is
+        no pair with a finite loss.
+
+    """
+
+    if not np.any(eligible_pairs):
+        return ()
+
+    walker_variations = np.asarray(walker_variations, dtype=np.float64)
+    walker_weights = np.asarray(walker_weights, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variation_losses = ((walker_weights[None, :] * walker_variations[:, None] +
+                             walker_weights[:, None] * walker_variations[None, :]) /
+                            (walker_weights[:, None] + walker_weights[None, :]))
+
+    # pairs that aren't eligible or have no defined loss are never picked
+    variation_losses[~eligible_pairs | np.isnan(variation_losses)] = np.inf
+
+    min_idx = np.argmin(variation_losses)
+
+    if not variation_losses.flat[min_idx] < np.inf:
+        return ()
+
+    return tuple(int(idx) for idx in np.unravel_index(min_idx, variation_losses.shape))
+
+
+class VariationTracker():
+    """Keeps the variation of an ensemble up to date while the REVO
+    greedy optimization tries out clone and merge moves.
+
+    A move only changes the weights and number of copies of a few
+    walkers. Writing :math:`a_i = \\phi_i c_i` the variation is
+    :math:`V = \\sum_{i<j} K_{ij} a_i a_j` and the walker variations are
+    :math:`V_i = \\phi_i S_i` with :math:`S_i = \\sum_j K_{ij} a_j`, so
+    changing :math:`a_k` only needs one row of the kernel to update
+    :math:`V` and all :math:`S_i` in O(N).
+
+    Parameters
+    ----------
+
+    kernel : arraylike of shape (num_walkers, num_walkers)
+        The output of `variation_kernel`, this is cached for the whole
+        optimization.
+
+    novelty_func : callable
+        Function with the signature of `walker_novelties` without the
+        resampler parameters, i.e. `(walker_weights, num_walker_copies)`.
+
+    walker_weights : list of float
+
+    num_walker_copies : list of int
+
+    mode : str
+        One of `VARIATION_MODES`. 'incremental' does the O(N) updates,
+        'full' recomputes the variation from scratch with
+        `calc_variation` after each move (the reference behavior) and
+        'verify' does both and raises an error if they disagree.
+
+    """
+
+    VARIATION_MODES = ('incremental', 'full', 'verify')
+
+    def __init__(self, kernel, novelty_func,
+                 walker_weights, num_walker_copies,
+                 mode='incremental'):
+
+        assert mode in self.VARIATION_MODES, \
+            "variation mode must be one of {}".format(self.VARIATION_MODES)
+
+        self.kernel = kernel
+        self.mode = mode
+        self._novelty_func = novelty_func
+
+        num_walker_copies = np.asarray(num_walker_copies, dtype=np.float64)
+
+        self.novelties = self._novelty_func(walker_weights, num_walker_copies)
+
+        # the initial values are always calculated exactly
+        self.variation, self._walker_variations = calc_variation(self.kernel,
+                                                                 self.novelties,
+                                                                 num_walker_copies)
+
+        self._amplitudes = self.novelties * num_walker_copies
+        self._sums = self.kernel.dot(self._amplitudes)
+
+        self._checkpoint = None
+
+    @property
+    def walker_variations(self):
+        """The Vi value of each walker."""
+
+        if self.mode == 'incremental':
+            return self.novelties * self._sums
+
+        return self._walker_variations
+
+    def _incremental_update(self, walker_idxs, walker_weights, num_walker_copies):
+
+        for idx in walker_idxs:
+
+            novelty = self._novelty_func([walker_weights[idx]],
+                                         [num_walker_copies[idx]])[0]
+            amplitude = novelty * num_walker_copies[idx]
+
+            delta = amplitude - self._amplitudes[idx]
+
+            if delta != 0:
+                # the kernel has a zero diagonal so the sum for this
+                # walker doesn't contain itself
+                self.variation += delta * self._sums[idx]
+                self._sums += self.kernel[idx] * delta
+
+            self._amplitudes[idx] = amplitude
+            self.novelties[idx] = novelty
+
+    def update(self, walker_idxs, walker_weights, num_walker_copies):
+        """Update the variation after the weights or number of copies of
+        some walkers have changed.
+
+        Parameters
+        ----------
+
+        walker_idxs : list of int
+            The walkers that have changed.
+
+        walker_weights : list of float
+            The current weights of all walkers.
+
+        num_walker_copies : list of int
+            The current number of copies of all walkers.
+
+        Returns
+        -------
+
+        variation : float
+           The updated variation value.
+
+        walker_variations : arraylike of shape (num_walkers)
+           The updated Vi value of each walker.
+
+        """
+
+        if self.mode in ('incremental', 'verify'):
+            self._incremental_update(walker_idxs, walker_weights, num_walker_copies)
+
+        if self.mode in ('full', 'verify'):
+            novelties = self._novelty_func(walker_weights, num_walker_copies)
+            variation, walker_variations = calc_variation(self.kernel,
+                                                          novelties,
+                                                          num_walker_copies)
+
+            if self.mode == 'verify':
+                tolerance = 1e-8 * np.max(np.abs(walker_variations), initial=0.0)
+                assert np.isclose(variation, self.variation, rtol=1e-8, atol=0.0) and \
+                    np.allclose(walker_variations, self.novelties * self._sums,
+                                rtol=1e-8, atol=tolerance), \
+                    "Incremental variation {} does not match the full calculation {}".format(
+                        self.variation, variation)
+            else:
+                self.novelties = novelties
+
+            self.variation = variation
+            self._walker_variations = walker_variations
+
+        return self.variation, self.walker_variations
+
+    def checkpoint(self):
+        """Save the current state so a trial move can be rolled back."""
+
+        self._checkpoint = (self.variation,
+                            self._walker_variations,
+                            self.novelties.copy(),
+                            self._amplitudes.copy(),
+                            self._sums.copy())
+
+    def rollback(self):
+        """Restore the state saved by the last `checkpoint` call."""
+
+        assert self._checkpoint is not None, "No checkpoint to roll back to."
+
+        (self.variation,
+         self._walker_variations,
+         self.novelties,
+         self._amplitudes,
+         self._sums) = self._checkpoint
+
+        self._checkpoint = None
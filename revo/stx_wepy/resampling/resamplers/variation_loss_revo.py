@@ -1,9 +1,12 @@
-import random as rand
 import itertools as it
 import logging
 import numpy as np
 
-from wepy.resampling.resamplers.revo import REVOResampler
+from stx_wepy.resampling.resamplers.revo import REVOResampler
+from stx_wepy.resampling.resamplers.variation import (
+    eligible_merge_pairs,
+    min_variation_loss_pair,
+)
 
 class VariationLossREVOResampler(REVOResampler):
     """Resampler implementing the REVO algorithm.
@@ -84,109 +87,6 @@ class VariationLossREVOResampler(REVOResampler):
 
     """
 
-    def _novelty(self, walker_weight, num_walker_copy):
-        """Calculates the novelty fuction value.
-
-        Parameters
-        ----------
-
-        walker_weight : float
-            The weight of the walker.
-
-        num_walker_copy : int
-          The number of copies of the walker.
-
-        Returns
-        -------
-        novelty : float
-        The calcualted value of novelty for the given walker.
-
-        """
-
-        novelty = 0
-
-        if walker_weight > 0 and num_walker_copy > 0:
-
-            if self.weights:
-
-                novelty = np.log(walker_weight/num_walker_copy) - self.lpmin
-
-            else:
-
-                novelty = 1
-
-        if novelty < 0:
-
-            novelty = 0
-
-        return novelty
-
-
-    def _calcvariation(self, walker_weights, num_walker_copies, distance_matrix):
-        """Calculates the variation value.
-
-        Parameters
-        ----------
-
-        walker_weights : list of float
-            The weights of all walkers. The sum of all weights should be 1.0.
-
-        num_walker_copies : list of int
-            The number of copies of each walker.
-            0 means the walker is not exists anymore.
-            1 means there is one of the this walker.
-            >1 means it should be cloned to this number of walkers.
-
-        distance_matrix : list of arraylike of shape (num_walkers)
-
-        images: list of arraylike of shape (num_walkers)
-
-        Returns
-        -------
-        variation : float
-           The calculated variation value.
-
-        walker_variations : arraylike of shape (num_walkers)
-           The Vi value of each walker.
-
-        """
-
-        num_walkers = len(walker_weights)
-
-
-
-        # set the novelty values
-        walker_novelties = np.array([self._novelty(walker_weights[i], num_walker_copies[i])
-                                     for i in range(num_walkers)])
-
-
-
-        # the value to be optimized
-        variation = 0
-
-        # the walker variation values (Vi values)
-        walker_variations = np.zeros(num_walkers)
-
-
-        # calculate the variation and walker variation values
-        for i in range(num_walkers - 1):
-
-            if num_walker_copies[i] > 0:
-                for j in range(i+1, num_walkers):
-
-                    if num_walker_copies[j] > 0:
-
-                        partial_variation = ((distance_matrix[i][j] / self.char_dist) ** self.dist_exponent) \
-                        * walker_novelties[i] * walker_novelties[j]
-
-                        variation += partial_variation * num_walker_copies[i] * num_walker_copies[j]
-                        walker_variations[i] += partial_variation * num_walker_copies[j]
-                        walker_variations[j] += partial_variation * num_walker_copies[i]
-
-
-        return variation, walker_variations
-
-    
     def _calc_variation_loss(self, walker_variation, weights, eligible_pairs):
         """Calculates the loss to variation through merging of eligible walkers.                                                                                                                  
  
@@ -199,8 +99,9 @@ class VariationLossREVOResampler(REVOResampler):
         weights : list of float                                  
             The weights of all walkers. The sum of all weights should be 1.0.
 
-        eligible_pairs : list of tuples
-            Pairs of walker indexes that meet the criteria for merging.
+        eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+            The pairs of walkers that meet the criteria for merging, see
+            `_find_eligible_merge_pairs`.
                                                                                                                                                                                                          
         Returns                                                                                                                                                                                            
         -------                                                       
@@ -210,31 +111,7 @@ class VariationLossREVOResampler(REVOResampler):
             for merging and minimize variation loss.
          """
 
-        v_loss_min = np.inf
-        
-        min_loss_pair = ()
-
-        for pair in eligible_pairs:
-            walker_i = pair[0]
-            walker_j = pair[1]
-
-            wt_i = weights[walker_i]
-            wt_j = weights[walker_j]
-
-            v_i = walker_variation[walker_i]
-            v_j = walker_variation[walker_j]
-
-            v_loss = (wt_j * v_i + wt_i * v_j) / (wt_i + wt_j)
-
-            if v_loss < v_loss_min:
-                min_loss_pair = pair
-
-                print(pair)
-                print(wt_i, wt_j)
-                
-                v_loss_min = v_loss
-
-        return(min_loss_pair)
+        return min_variation_loss_pair(walker_variation, weights, eligible_pairs)
 
     def _find_eligible_merge_pairs(self, weights, distance_matrix, max_var_idx, num_walker_copies):
         """ Find pairs of walkers that are eligible to be merged.
@@ -261,23 +138,15 @@ class VariationLossREVOResampler(REVOResampler):
         Returns
         -------
         
-        eligible_pairs : list of tuples                                                                                                                             
-            Pairs of walker indexes that meet the criteria for merging.
+        eligible_pairs : arraylike of bool of shape (num_walkers, num_walkers)
+            True for the pairs of walker indexes (i, j) with i < j that
+            meet the criteria for merging.
 
         """
 
-        eligible_pairs = []
-
-        for i in range(len(weights) - 1):
-            for j in range(i + 1, len(weights)):
-                if i != max_var_idx and j != max_var_idx:
-                    if num_walker_copies[i] == 1 and num_walker_copies[j] == 1:
-                        if weights[i] + weights[j] < self.pmax:
-                            if distance_matrix[i][j] < self.merge_dist:
-                                eligible_pairs.append((i,j))
-                                #print(weights[i], weights[j])
-
-        return(eligible_pairs)
+        return eligible_merge_pairs(weights, num_walker_copies, distance_matrix,
+                                    self.pmax, self.merge_dist,
+                                    clone_idx=max_var_idx)
 
     def decide(self, walker_weights, num_walker_copies, distance_matrix):
         """Optimize the trajectory variation by making decisions for resampling.
@@ -319,14 +188,17 @@ class VariationLossREVOResampler(REVOResampler):
 
 
         # calculate the initial variation which will be optimized
-        variation, walker_variations = self._calcvariation(walker_weights,
-                                                           new_num_walker_copies,
-                                                           distance_matrix)
+        variation_tracker = self._variation_tracker(new_walker_weights,
+                                                    new_num_walker_copies,
+                                                    distance_matrix)
+        variation = variation_tracker.variation
+        walker_variations = variation_tracker.walker_variations
         variations.append(variation)
 
-        # maximize the variance through cloning and merging
-        logging.info("Starting variance optimization:", variation)
+        num_trial_moves = 0
+        num_accepted_moves = 0
 
+        # maximize the variance through cloning and merging
         productive = True
         while productive:
             productive = False
@@ -352,7 +224,6 @@ class VariationLossREVOResampler(REVOResampler):
             #print('Walker to be cloned is:', max_tups)
             if len(max_tups) > 0:
                 max_value, max_weight, max_idx = max(max_tups)
-                print('Walker to be cloned is', max_value, max_weight)
 
             pot_merge_pairs = self._find_eligible_merge_pairs(new_walker_weights, distance_matrix, max_idx, new_num_walker_copies)
 
@@ -364,7 +235,9 @@ class VariationLossREVOResampler(REVOResampler):
             if len(merge_pair) != 0:
                 min_idx = merge_pair [0]
                 closewalk = merge_pair [1]
-                
+
+                num_trial_moves += 1
+
                 # change new_amp
                 tempsum = new_walker_weights[min_idx] + new_walker_weights[closewalk]
                 new_num_walker_copies[min_idx] = new_walker_weights[min_idx]/tempsum
@@ -372,12 +245,15 @@ class VariationLossREVOResampler(REVOResampler):
                 new_num_walker_copies[max_idx] += 1
 
                 # re-determine variation function, and walker_variations values
-                new_variation, walker_variations = self._calcvariation(new_walker_weights, new_num_walker_copies, distance_matrix)
+                variation_tracker.checkpoint()
+                new_variation, walker_variations = variation_tracker.update(
+                    [min_idx, closewalk, max_idx],
+                    new_walker_weights, new_num_walker_copies)
 
                 if new_variation > variation:
                     variations.append(new_variation)
 
-                    logging.info("Variance move to", new_variation, "accepted")
+                    num_accepted_moves += 1
 
 
                     productive = True
@@ -387,7 +263,7 @@ class VariationLossREVOResampler(REVOResampler):
                     # (min_idx, or closewalk), equivalent to:
                     # `random.choices([closewalk, min_idx],
                     #                 weights=[new_walker_weights[closewalk], new_walker_weights[min_idx])`
-                    r = rand.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
+                    r = self.rng.uniform(0.0, new_walker_weights[closewalk] + new_walker_weights[min_idx])
 
                      # keeps closewalk and gets rid of min_idx
                     if r < new_walker_weights[closewalk]:
@@ -422,19 +298,24 @@ class VariationLossREVOResampler(REVOResampler):
                     walker_clone_nums[max_idx] += 1
 
                     # new variation for starting new stage
-                    new_variation, walker_variations = self._calcvariation(new_walker_weights,
-                                                                          new_num_walker_copies,
-                                                                          distance_matrix)
+                    new_variation, walker_variations = variation_tracker.update(
+                        [keep_idx, squash_idx],
+                        new_walker_weights, new_num_walker_copies)
                     variations.append(new_variation)
 
-                    logging.info("variance after selection:", new_variation)
-
 
                 # if not productive
                 else:
                     new_num_walker_copies[min_idx] = 1
                     new_num_walker_copies[closewalk] = 1
                     new_num_walker_copies[max_idx] -= 1
+                    variation_tracker.rollback()
+
+        self.instrumentation.count('trial_moves', num_trial_moves)
+        self.instrumentation.count('accepted_moves', num_accepted_moves)
+
+        logging.debug("Variation optimized from %s to %s, %d of %d trial moves accepted",
+                      variations[0], variations[-1], num_accepted_moves, num_trial_moves)
 
         # given we know what we want to clone to specific slots
         # (squashing other walkers) we need to determine where these
@@ -0,0 +1,83 @@
+"""Storage of the state of a resampler random number generator in the
+resampler records.
+
+The resamplers draw all of their random numbers from their own
+`numpy.random.Generator` and record its state at the start of every
+cycle. Restoring a generator from the record of a cycle reproduces the
+random decisions of that cycle exactly, e.g. to replay a run or to
+compare two implementations of a resampler on the same random
+numbers.
+
+Only the default PCG64 bit generator is supported. Its state is two
+128 bit integers plus a buffered 32 bit value which are stored as an
+array of `RNG_STATE_SIZE` unsigned 64 bit integers.
+
+"""
+
+import numpy as np
+
+RNG_STATE_SIZE = 6
+
+_UINT64_MASK = (1 << 64) - 1
+
+
+def rng_state_record(rng):
+    """Make the resampler record value of the state of a generator.
+
+    Parameters
+    ----------
+
+    rng : numpy.random.Generator
+        Must use the PCG64 bit generator.
+
+    Returns
+    -------
+
+    rng_state : arraylike of uint64 of shape (RNG_STATE_SIZE,)
+
+    """
+
+    state = rng.bit_generator.state
+
+    assert state['bit_generator'] == 'PCG64', \
+        "Only PCG64 generators can be recorded, not {}".format(state['bit_generator'])
+
+    return np.array([state['state']['state'] >> 64,
+                     state['state']['state'] & _UINT64_MASK,
+                     state['state']['inc'] >> 64,
+                     state['state']['inc'] & _UINT64_MASK,
+                     state['has_uint32'],
+                     state['uinteger']],
+                    dtype=np.uint64)
+
+
+def rng_from_record(rng_state):
+    """Make a generator in the state of a record.
+
+    Parameters
+    ----------
+
+    rng_state : arraylike of uint64 of shape (RNG_STATE_SIZE,)
+        The 'rng_state' value of a resampler record.
+
+    Returns
+    -------
+
+    rng : numpy.random.Generator
+
+    """
+
+    rng_state = [int(value) for value in rng_state]
+
+    assert len(rng_state) == RNG_STATE_SIZE, \
+        "An rng state record must have {} values, not {}".format(RNG_STATE_SIZE,
+                                                                 len(rng_state))
+
+    bit_generator = np.random.PCG64()
+    bit_generator.state = {'bit_generator' : 'PCG64',
+                           'state' : {'state' : (rng_state[0] << 64) | rng_state[1],
+                                      'inc' : (rng_state[2] << 64) | rng_state[3]},
+                           'has_uint32' : rng_state[4],
+                           'uinteger' : rng_state[5]}
+
+    return np.random.Generator(bit_generator)
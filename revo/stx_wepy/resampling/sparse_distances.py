@@ -0,0 +1,250 @@
+r"""All-to-all walker distances where only the close pairs are computed
+exactly.
+
+For metrics that satisfy the triangle inequality the distances of
+every walker to a few pivot walkers give a lower bound on the distance
+of every pair,
+
+.. math::
+    d_{ij} \geq \max_p |d_{ip} - d_{jp}|
+
+Only the pairs whose bound is within a radius are computed with the
+distance metric, the others are set to their bound. As long as the
+radius is at least the merge distance every pair that could be merged
+is exact, and the approximated pairs are only ever underestimated.
+
+"""
+
+from functools import partial
+
+import numpy as np
+
+
+def image_distances_to(distance, image, images):
+    """Distances from one image to a list of images.
+
+    Parameters
+    ----------
+
+    distance : object implementing Distance
+
+    image : image object
+
+    images : list of image objects
+
+    Returns
+    -------
+
+    distances : arraylike of float of shape (n_images,)
+
+    """
+
+    # metrics that can compute many distances at once get the image
+    # together with the others
+    if hasattr(distance, 'image_distance_matrix'):
+        return distance.image_distance_matrix(np.array([image] + list(images)))[0, 1:]
+
+    return np.array([distance.image_distance(image, other_image)
+                     for other_image in images])
+
+
+def image_distance_pairs(distance, images, pairs):
+    """Distances between pairs of images.
+
+    Parameters
+    ----------
+
+    distance : object implementing Distance
+
+    images : list of image objects
+
+    pairs : arraylike of int of shape (n_pairs, 2)
+
+    Returns
+    -------
+
+    distances : arraylike of float of shape (n_pairs,)
+
+    """
+
+    # metrics that can compute many distances at once get the block
+    # of all the images in the pairs and the pairs are picked out of it
+    if hasattr(distance, 'image_distance_matrix'):
+
+        block_idxs, block_pairs = np.unique(pairs, return_inverse=True)
+        block_pairs = block_pairs.reshape(np.shape(pairs))
+
+        block = distance.image_distance_matrix(np.array([images[i] for i in block_idxs]))
+
+        return block[block_pairs[:, 0], block_pairs[:, 1]]
+
+    return np.array([distance.image_distance(images[i], images[j])
+                     for i, j in pairs])
+
+
+def map_chunks(func, chunks, executor=None):
+    """Map a function over chunks of work with an executor.
+
+    Parameters
+    ----------
+
+    func : callable
+
+    chunks : list
+
+    executor : object with a `map` method, optional
+        By default the chunks are done serially.
+
+    Returns
+    -------
+
+    results : list
+        The result for each chunk, in order.
+
+    """
+
+    if executor is None:
+        return list(map(func, chunks))
+
+    return list(executor.map(func, chunks))
+
+
+def pivot_distances(distance, images, num_pivots, executor=None, num_chunks=1):
+    """Choose pivot walkers by farthest point sampling and compute their
+    distances to all walkers.
+
+    The first pivot is walker 0 and every following pivot is the
+    walker farthest from all of the pivots so far.
+
+    Parameters
+    ----------
+
+    distance : object implementing Distance
+
+    images : list of image objects
+
+    num_pivots : int
+
+    executor : object with a `map` method, optional
+        Used to compute each pivot row in chunks, by default they are
+        computed serially.
+
+    num_chunks : int
+        Number of chunks to split each pivot row into.
+
+    Returns
+    -------
+
+    pivot_idxs : list of int
+
+    pivot_dists : arraylike of shape (num_pivots, n_images)
+
+    """
+
+    num_pivots = min(num_pivots, len(images))
+
+    # the pivots depend on each other so only the rows are split up
+    chunk_idxs = np.array_split(np.arange(len(images)),
+                                max(1, min(num_chunks, len(images))))
+    image_chunks = [[images[i] for i in idxs] for idxs in chunk_idxs]
+
+    def pivot_row(pivot_idx):
+
+        row_func = partial(image_distances_to, distance, images[pivot_idx])
+
+        return np.concatenate(map_chunks(row_func, image_chunks, executor))
+
+    pivot_idxs = [0]
+    pivot_dists = [pivot_row(0)]
+
+    while len(pivot_idxs) < num_pivots:
+
+        min_pivot_dists = np.min(pivot_dists, axis=0)
+        min_pivot_dists[pivot_idxs] = -np.inf
+
+        pivot_idx = int(np.argmax(min_pivot_dists))
+
+        pivot_idxs.append(pivot_idx)
+        pivot_dists.append(pivot_row(pivot_idx))
+
+    return pivot_idxs, np.array(pivot_dists)
+
+
+def sparse_distance_matrix(distance, images, radius,
+                           num_pivots=8, executor=None, num_chunks=1):
+    """All-to-all distance matrix with exact distances only for the
+    pairs that may be within a radius of each other.
+
+    Parameters
+    ----------
+
+    distance : object implementing Distance
+        Must satisfy the triangle inequality.
+
+    images : list of image objects
+
+    radius : float
+        Pairs with a lower bound below this are computed exactly.
+
+    num_pivots : int
+        Number of pivot walkers used for the lower bounds.
+
+    executor : object with a `map` method, optional
+        Used to compute the pivot rows and the exact pairs, by default
+        they are computed serially.
+
+    num_chunks : int
+        Number of chunks to split the pivot rows and the exact pairs
+        into.
+
+    Returns
+    -------
+
+    distance_matrix : arraylike of shape (n_images, n_images)
+
+    exact_pairs : arraylike of bool of shape (n_images, n_images)
+        True for the distances that were computed exactly.
+
+    """
+
+    num_images = len(images)
+
+    pivot_idxs, pivot_dists = pivot_distances(distance, images, num_pivots,
+                                              executor=executor,
+                                              num_chunks=num_chunks)
+
+    # the best triangle inequality lower bound over the pivots
+    lower_bounds = np.zeros((num_images, num_images))
+    for dists in pivot_dists:
+        np.maximum(lower_bounds, np.abs(dists[:, None] - dists[None, :]),
+                   out=lower_bounds)
+
+    exact_pairs = np.triu(lower_bounds < radius, k=1)
+
+    # the rows of the pivots are already exact
+    exact_pairs[pivot_idxs, :] = False
+    exact_pairs[:, pivot_idxs] = False
+
+    distance_matrix = np.triu(lower_bounds, k=1)
+
+    pairs = np.argwhere(exact_pairs)
+    if len(pairs) > 0:
+
+        pair_chunks = np.array_split(pairs, max(1, min(num_chunks, len(pairs))))
+        pair_func = partial(image_distance_pairs, distance, images)
+
+        chunk_dists = map_chunks(pair_func, pair_chunks, executor)
+
+        distance_matrix[pairs[:, 0], pairs[:, 1]] = np.concatenate(chunk_dists)
+
+    distance_matrix = distance_matrix + distance_matrix.T
+
+    for pivot_idx, dists in zip(pivot_idxs, pivot_dists):
+        distance_matrix[pivot_idx, :] = dists
+        distance_matrix[:, pivot_idx] = dists
+
+    exact_pairs = exact_pairs | exact_pairs.T
+    exact_pairs[pivot_idxs, :] = True
+    exact_pairs[:, pivot_idxs] = True
+
+    return distance_matrix, exact_pairs
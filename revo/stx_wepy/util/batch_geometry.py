@@ -0,0 +1,166 @@
+"""Versions of the geomm and wepy geometry functions used in making
+images that operate on a stack of frames at once.
+
+All coordinates are arrays of shape (n_frames, n_atoms, 3) and each
+function gives the same result as applying its single frame
+counterpart to every frame.
+
+"""
+
+import numpy as np
+
+
+def box_vectors_to_lengths(box_vectors):
+    """Lengths of the box vectors for a stack of frames.
+
+    See `wepy.util.util.box_vectors_to_lengths_angles`.
+
+    Parameters
+    ----------
+
+    box_vectors : arraylike of shape (n_frames, 3, 3)
+
+    Returns
+    -------
+
+    box_lengths : arraylike of shape (n_frames, 3)
+
+    """
+
+    return np.linalg.norm(box_vectors, axis=-1)
+
+
+def group_pair(coords, unitcell_side_lengths, member_a_idxs, member_b_idxs):
+    """Move member b of each frame into the periodic image closest to
+    member a, see `geomm.grouping.group_pair`.
+
+    Parameters
+    ----------
+
+    coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    unitcell_side_lengths : arraylike of shape (n_frames, 3)
+
+    member_a_idxs : arraylike of int
+
+    member_b_idxs : arraylike of int
+
+    Returns
+    -------
+
+    grouped_coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    """
+
+    unitcell_half_lengths = unitcell_side_lengths * 0.5
+
+    centroid_dist = (coords[:, member_a_idxs].mean(axis=1) -
+                     coords[:, member_b_idxs].mean(axis=1))
+
+    # shift by a whole unitcell in the dimensions where the centroids
+    # are more than half a unitcell apart
+    shifts = (np.where(centroid_dist > unitcell_half_lengths, unitcell_side_lengths, 0.0) -
+              np.where(centroid_dist < -unitcell_half_lengths, unitcell_side_lengths, 0.0))
+
+    grouped_coords = np.copy(coords)
+    grouped_coords[:, member_b_idxs] += shifts[:, None, :]
+
+    return grouped_coords
+
+
+def center_around(coords, idxs):
+    """Center each frame on the centroid of a subset of its atoms, see
+    `geomm.centering.center_around`.
+
+    Parameters
+    ----------
+
+    coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    idxs : arraylike of int
+
+    Returns
+    -------
+
+    centered_coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    """
+
+    return coords - coords[:, idxs].mean(axis=1)[:, None, :]
+
+
+def superimpose(ref_coords, coords, idxs=None):
+    """Superimpose each frame onto a single reference, see
+    `geomm.superimpose.superimpose`.
+
+    The rotations are found with a batched SVD (Kabsch) instead of
+    Theobald-QCP. Like the geomm function the frames are rotated
+    about the origin, so they should already be centered, and then
+    translated to the centroid of the reference.
+
+    Parameters
+    ----------
+
+    ref_coords : arraylike of shape (n_atoms, 3)
+
+    coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    idxs : arraylike of int, optional
+        Only use these atoms to find the rotations.
+
+    Returns
+    -------
+
+    superimposed_coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    rotation_matrices : arraylike of shape (n_frames, 3, 3)
+
+    """
+
+    if idxs is None:
+        idxs = np.arange(ref_coords.shape[0])
+
+    align_ref_coords = ref_coords[idxs]
+
+    # the correlation matrix of each frame with the reference
+    correlations = np.einsum('fni,nj->fij', coords[:, idxs], align_ref_coords)
+
+    U, _, Vt = np.linalg.svd(correlations)
+
+    # correct for reflections so these are proper rotations
+    reflections = np.linalg.det(np.matmul(U, Vt)) < 0.0
+    U[reflections, :, -1] *= -1
+
+    rotation_matrices = np.matmul(U, Vt)
+
+    superimposed_coords = (np.matmul(coords, rotation_matrices) +
+                           align_ref_coords.mean(axis=0))
+
+    return superimposed_coords, rotation_matrices
+
+
+def calc_rmsd(ref_coords, coords, idxs=None):
+    """RMSD of each frame to a single reference without any alignment,
+    see `geomm.rmsd.calc_rmsd`.
+
+    Parameters
+    ----------
+
+    ref_coords : arraylike of shape (n_atoms, 3)
+
+    coords : arraylike of shape (n_frames, n_atoms, 3)
+
+    idxs : arraylike of int, optional
+
+    Returns
+    -------
+
+    rmsds : arraylike of shape (n_frames,)
+
+    """
+
+    if idxs is None:
+        idxs = np.arange(ref_coords.shape[0])
+
+    return np.sqrt(np.sum(np.square(coords[:, idxs] - ref_coords[idxs]),
+                          axis=(1, 2)) / idxs.shape[0])
@@ -0,0 +1,152 @@
+"""Read only arrays that can be shared with worker processes.
+
+Process executors pickle everything they send to their workers, so
+precomputed arrays like the reference images of a boundary condition
+would be copied for every task. `SharedArrays` puts a set of arrays
+into a single block of shared memory instead and pickles only the
+name of the block and where each array is in it, so the workers map
+the same memory.
+
+The process that made a `SharedArrays` owns the block and frees it
+when the object is deleted or `unlink` is called. Pickled copies are
+only valid as long as the owner exists, so they shouldn't be used for
+saving anything to disk.
+
+"""
+
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# the offset of each array in the block is aligned to this
+ALIGNMENT = 64
+
+
+def frozen_array(array, dtype=None):
+    """Make a contiguous read only copy of an array.
+
+    Parameters
+    ----------
+
+    array : arraylike
+
+    dtype : numpy dtype, optional
+        Defaults to the dtype of the array.
+
+    Returns
+    -------
+
+    frozen_array : arraylike
+
+    """
+
+    array = np.array(array, dtype=dtype, order='C', copy=True)
+    array.setflags(write=False)
+
+    return array
+
+
+class SharedArrays():
+    """Named read only arrays in a block of shared memory.
+
+    The arrays are accessed by name like a dict.
+    """
+
+    def __init__(self, arrays):
+        """Constructor for SharedArrays.
+
+        Parameters
+        ----------
+
+        arrays : dict of str : arraylike
+            The arrays are copied into the shared memory.
+
+        """
+
+        arrays = {name : np.ascontiguousarray(array) for name, array in arrays.items()}
+
+        # (name, dtype, shape, offset) of each array
+        layout = []
+        offset = 0
+        for name, array in arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout.append((name, array.dtype.str, array.shape, offset))
+            offset += array.nbytes
+
+        self._shm = SharedMemory(create=True, size=max(offset, 1))
+        self._owner = True
+        self._layout = layout
+
+        self._arrays = self._views(writeable=True)
+        for name, array in arrays.items():
+            self._arrays[name][...] = array
+            self._arrays[name].setflags(write=False)
+
+    def _views(self, writeable=False):
+
+        views = {}
+        for name, dtype, shape, offset in self._layout:
+            view = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=offset)
+            view.setflags(write=writeable)
+            views[name] = view
+
+        return views
+
+    @property
+    def name(self):
+        """The name of the shared memory block."""
+        return self._shm.name
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def keys(self):
+        return self._arrays.keys()
+
+    def __getstate__(self):
+
+        # only the location of the arrays, never their values
+        return {'name' : self._shm.name,
+                'layout' : self._layout}
+
+    def __setstate__(self, state):
+
+        self._shm = SharedMemory(name=state['name'])
+        self._owner = False
+        self._layout = state['layout']
+
+        self._arrays = self._views()
+
+    def close(self):
+        """Stop using the shared memory in this process. The arrays can't
+        be used afterwards."""
+
+        if self._shm is None:
+            return
+
+        # the views must be released before the block can be closed
+        self._arrays = {}
+        self._shm.close()
+
+    def unlink(self):
+        """Close and, if this is the owner, free the shared memory."""
+
+        if self._shm is None:
+            return
+
+        self.close()
+
+        if self._owner:
+            self._shm.unlink()
+
+        self._shm = None
+
+    def __del__(self):
+
+        try:
+            self.unlink()
+        except (AttributeError, FileNotFoundError):
+            pass
@@ -0,0 +1,399 @@
+"""Caches of the preprocessing and progress of walker states that are
+shared by several distance metrics, boundary conditions and
+resamplers.
+
+Composite distance metrics make an image for each of their component
+metrics from the same state. Each component converts the box vectors
+and regroups and centers its image atoms, so with a shared
+`StatePreprocessingCache` this is only done once per state.
+
+The same cache can also be shared between a boundary condition and a
+distance metric, e.g. `NewRebindingBC` and `RebindingDistance` which
+both superimpose the ligand and binding site of every walker onto the
+native state each cycle. The superimposed images are cached as well
+so whichever of them comes first does the work for both.
+
+Entries are keyed by the identity of the state object so they are
+only valid as long as the state isn't modified, i.e. within a single
+resampling cycle. Owners of a cache should `evict` states once they
+are done with them or `clear` it every cycle. The caches only hold
+weak references to the states, so only the derived values are kept
+and the entry of a state is dropped when the state is deleted.
+
+Sharing only helps within a process, i.e. with the 'serial' and
+'thread' executors. Pickled caches are empty, so with a 'process'
+executor the workers get a cache of their own for every task, which
+still shares the preprocessing between the components of a composite
+metric but never sees what the boundary condition computed.
+
+"""
+
+import weakref
+
+import numpy as np
+
+from wepy.util.util import box_vectors_to_lengths_angles
+
+from geomm.grouping import group_pair
+from geomm.centering import center_around
+from geomm.superimpose import superimpose
+
+from stx_wepy.util import batch_geometry
+
+
+class _StateEntries():
+    """Values for states keyed by their identity, holding only weak
+    references to the states."""
+
+    def __init__(self):
+
+        # id(state) -> (weakref to state, value)
+        self._entries = {}
+
+    def get(self, state):
+
+        entry = self._entries.get(id(state))
+
+        # the reference makes sure the id isn't from a deleted state
+        if entry is None or entry[0]() is not state:
+            return None
+
+        return entry[1]
+
+    def add(self, state, value):
+
+        state_id = id(state)
+        entries = self._entries
+
+        def drop(state_ref):
+            # only if the entry wasn't replaced already
+            entry = entries.get(state_id)
+            if entry is not None and entry[0] is state_ref:
+                del entries[state_id]
+
+        entries[state_id] = (weakref.ref(state, drop), value)
+
+    def remove(self, state):
+
+        if self.get(state) is not None:
+            del self._entries[id(state)]
+
+    def clear(self):
+
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+
+        # the states aren't sent along so the entries are useless
+        # anywhere else
+        return {}
+
+    def __setstate__(self, state):
+
+        self._entries = {}
+
+
+def centered_image(positions, box_lengths, image_idxs, member_a_idxs, member_b_idxs):
+    """Slice the image atoms out of the positions of a state, group
+    member b into the periodic image of member a and center them
+    around member a.
+
+    This gives the same result as grouping and centering all of the
+    positions and slicing the image out afterwards, but only the image
+    atoms are ever copied.
+
+    Parameters
+    ----------
+
+    positions : arraylike of shape (n_atoms, 3)
+
+    box_lengths : arraylike of shape (3,)
+
+    image_idxs : arraylike of int
+        Indices of the image atoms in the positions.
+
+    member_a_idxs : arraylike of int
+        Indices of member a within the image.
+
+    member_b_idxs : arraylike of int
+        Indices of member b within the image.
+
+    Returns
+    -------
+
+    centered_image : arraylike of shape (n_image_atoms, 3)
+
+    """
+
+    image = positions[image_idxs]
+
+    grouped_image = group_pair(image, box_lengths, member_a_idxs, member_b_idxs)
+
+    return center_around(grouped_image, member_a_idxs)
+
+
+class StatePreprocessingCache():
+    """Per state cache of the box lengths and the regrouped and centered
+    images of a state.
+
+    The images are cached for each set of indices they were made with,
+    and the superimposed images also for the reference image, so
+    metrics sharing a cache with different groups still get the
+    correct images.
+    """
+
+    def __init__(self):
+
+        # state -> (box_lengths, {image_key : image})
+        self._entries = _StateEntries()
+
+    def _entry(self, state):
+
+        entry = self._entries.get(state)
+
+        if entry is None:
+
+            box_lengths, _ = box_vectors_to_lengths_angles(state['box_vectors'])
+
+            entry = (box_lengths, {})
+            self._entries.add(state, entry)
+
+        return entry
+
+    def box_lengths(self, state):
+        """The lengths of the box vectors of a state.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        Returns
+        -------
+
+        box_lengths : arraylike of shape (3,)
+
+        """
+
+        return self._entry(state)[0]
+
+    def centered_image(self, state, image_idxs, member_a_idxs, member_b_idxs):
+        """The image of a state made by `centered_image` using the
+        cached box lengths.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        image_idxs : arraylike of int
+
+        member_a_idxs : arraylike of int
+            Indices of member a within the image.
+
+        member_b_idxs : arraylike of int
+            Indices of member b within the image.
+
+        Returns
+        -------
+
+        centered_image : arraylike of shape (n_image_atoms, 3)
+            This is shared by all the users of the cache and should not
+            be modified.
+
+        """
+
+        box_lengths, images = self._entry(state)
+
+        image_key = self._image_key(image_idxs, member_a_idxs, member_b_idxs)
+
+        if image_key not in images:
+            images[image_key] = centered_image(state['positions'], box_lengths,
+                                               image_idxs, member_a_idxs, member_b_idxs)
+
+        return images[image_key]
+
+    @staticmethod
+    def _image_key(image_idxs, member_a_idxs, member_b_idxs, ref_image=None):
+
+        # the same idxs give the same key whatever their integer dtype
+        image_key = (np.asarray(image_idxs, dtype=np.int64).tobytes(),
+                     np.asarray(member_a_idxs, dtype=np.int64).tobytes(),
+                     np.asarray(member_b_idxs, dtype=np.int64).tobytes())
+
+        if ref_image is not None:
+            image_key += (np.asarray(ref_image).tobytes(),)
+
+        return image_key
+
+    def superimposed_image(self, state, image_idxs, member_a_idxs, member_b_idxs,
+                           ref_image):
+        """The centered image of a state, see `centered_image`,
+        superimposed onto a reference image matching member a only.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        image_idxs : arraylike of int
+
+        member_a_idxs : arraylike of int
+            Indices of member a within the image.
+
+        member_b_idxs : arraylike of int
+            Indices of member b within the image.
+
+        ref_image : arraylike of shape (n_image_atoms, 3)
+
+        Returns
+        -------
+
+        superimposed_image : arraylike of shape (n_image_atoms, 3)
+            This is shared by all the users of the cache and should not
+            be modified.
+
+        """
+
+        _, images = self._entry(state)
+
+        image_key = self._image_key(image_idxs, member_a_idxs, member_b_idxs,
+                                    ref_image=ref_image)
+
+        if image_key not in images:
+            state_image = self.centered_image(state, image_idxs,
+                                              member_a_idxs, member_b_idxs)
+            images[image_key], _, _ = superimpose(ref_image, state_image,
+                                                  idxs=member_a_idxs)
+
+        return images[image_key]
+
+    def superimposed_images(self, states, image_idxs, member_a_idxs, member_b_idxs,
+                            ref_image):
+        """The `superimposed_image` of many states.
+
+        The images of the states that aren't cached yet are all made
+        together on stacked arrays, see `batch_geometry`.
+
+        Parameters
+        ----------
+
+        states : list of objects implementing WalkerState
+
+        image_idxs : arraylike of int
+
+        member_a_idxs : arraylike of int
+            Indices of member a within the image.
+
+        member_b_idxs : arraylike of int
+            Indices of member b within the image.
+
+        ref_image : arraylike of shape (n_image_atoms, 3)
+
+        Returns
+        -------
+
+        superimposed_images : arraylike of shape (n_states, n_image_atoms, 3)
+
+        """
+
+        image_key = self._image_key(image_idxs, member_a_idxs, member_b_idxs,
+                                    ref_image=ref_image)
+
+        entries = [self._entry(state) for state in states]
+
+        missing_idxs = [state_idx for state_idx, entry in enumerate(entries)
+                        if image_key not in entry[1]]
+
+        if len(missing_idxs) > 0:
+
+            # only the image atoms are stacked so the rest of the
+            # system is never copied
+            positions = np.stack([states[state_idx]['positions'][image_idxs]
+                                  for state_idx in missing_idxs])
+            box_lengths = np.stack([entries[state_idx][0] for state_idx in missing_idxs])
+
+            grouped_positions = batch_geometry.group_pair(positions, box_lengths,
+                                                          member_a_idxs, member_b_idxs)
+            centered_positions = batch_geometry.center_around(grouped_positions,
+                                                              member_a_idxs)
+            sup_images, _ = batch_geometry.superimpose(ref_image, centered_positions,
+                                                       idxs=member_a_idxs)
+
+            for state_idx, sup_image in zip(missing_idxs, sup_images):
+                entries[state_idx][1][image_key] = sup_image
+
+        return np.stack([entry[1][image_key] for entry in entries])
+
+    def evict(self, state):
+        """Remove the entry for a state.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        """
+
+        self._entries.remove(state)
+
+    def clear(self):
+        """Remove all of the entries."""
+
+        self._entries.clear()
+
+
+class ProgressCache():
+    """Per state cache of the boundary condition progress of a state.
+
+    The boundary conditions compute the progress of every walker when
+    warping and resamplers that use the progress can get the same
+    values from the cache instead of computing them again. Like
+    `StatePreprocessingCache` the entries are keyed by state identity
+    and should be cleared every cycle.
+    """
+
+    def __init__(self):
+
+        # state -> progress
+        self._entries = _StateEntries()
+
+    def get(self, state):
+        """The cached progress of a state.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        Returns
+        -------
+
+        progress : object or None
+            What was added for the state, or None if it isn't cached.
+
+        """
+
+        return self._entries.get(state)
+
+    def add(self, state, progress):
+        """Cache the progress of a state.
+
+        Parameters
+        ----------
+
+        state : object implementing WalkerState
+
+        progress : object
+
+        """
+
+        self._entries.add(state, progress)
+
+    def clear(self):
+        """Remove all of the entries."""
+
+        self._entries.clear()
@@ -0,0 +1,559 @@
+"""Synthetic walker ensembles for benchmarking the distance metrics,
+boundary conditions and resamplers without a real molecular system.
+
+`SyntheticSystem` makes a topology and native positions with the
+sizes of the target-PROTAC-ligase ternary complexes simulated in
+`python_scripts` (see `SYSTEM_SIZES`): the target protein, the ligase
+protein, the PROTAC with its warhead, linker and ligand atom names
+and enough water to fill the box of the solvated system. The two
+proteins are balls of residues touching at an interface with the
+PROTAC bridging them, which is enough for the selections of the
+simulation scripts (interfaces, binding site, PROTAC contacts) to
+pick out realistically sized sets of atoms.
+
+Walker states are made by randomly moving the ligase and PROTAC as a
+rigid body relative to the target and adding noise to every atom,
+both with controllable amplitudes.
+
+Run as a script to time the components at `BENCHMARK_NUM_WALKERS`
+walkers, see `main`.
+
+"""
+
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+import mdtraj as mdj
+from scipy.spatial.distance import cdist
+from scipy.spatial.transform import Rotation
+
+from wepy.walker import Walker, WalkerState
+from wepy.util.mdtraj import mdtraj_to_json_topology
+
+from stx_wepy.resampling.distances.rebinding import RebindingDistance
+from stx_wepy.resampling.distances.protein_protein_contacts import ProteinProteinContacts
+from stx_wepy.resampling.distances.contacts import CONTACT_BACKENDS
+from stx_wepy.resampling.distances.protein_protein_contacts_warhead_rmsd_target_protein_contacts import (
+    ProteinProteinContactsWarheadRMSDProteinProtacContacts,
+)
+from stx_wepy.boundary_conditions.new_rebinding_bc import NewRebindingBC
+from stx_wepy.resampling.resamplers.revo import REVOResampler
+
+SystemSize = namedtuple('SystemSize', ['n_target_residues',
+                                       'n_ligase_residues',
+                                       'protac_resname',
+                                       'n_protac_atoms',
+                                       'n_atoms',
+                                       'box_lengths'])
+"""The sizes of a solvated ternary complex, lengths in nanometers."""
+
+SYSTEM_SIZES = {
+    # 6hax.chainAB.complex.wat
+    '6HAX' : SystemSize(n_target_residues=116,
+                        n_ligase_residues=148,
+                        protac_resname='FWZ',
+                        n_protac_atoms=125,
+                        n_atoms=68820,
+                        box_lengths=(11.3957919, 8.4824045, 8.4431626)),
+    # acbi1.chainAB.complex.wat from the 6HAY inputs
+    'ACBI1' : SystemSize(n_target_residues=116,
+                         n_ligase_residues=148,
+                         protac_resname='LIG',
+                         n_protac_atoms=126,
+                         n_atoms=69625,
+                         box_lengths=(11.1689446, 8.3511524, 8.8178145)),
+}
+
+BENCHMARK_NUM_WALKERS = (48, 96, 256, 1024)
+
+# the heavy atom names of the PROTAC moieties as selected in the
+# simulation scripts
+PROTAC_WARHEAD_ATOM_NAMES = ('C30', 'C31', 'C32', 'C33', 'C34', 'C35', 'C36', 'C37',
+                             'C38', 'C39', 'C40', 'C41', 'C42', 'C43',
+                             'N5', 'N6', 'N7', 'N8', 'N9', 'O6')
+PROTAC_LINKER_ATOM_NAMES = ('C28', 'C29', 'C44', 'C45', 'C46', 'C47', 'C48', 'C49')
+PROTAC_LIGAND_ATOM_NAMES = tuple(['C{}'.format(i) for i in range(1, 28)] +
+                                 ['O{}'.format(i) for i in range(1, 6)] +
+                                 ['N{}'.format(i) for i in range(1, 5)] +
+                                 ['F1', 'F2'])
+
+# a residue has about 17 atoms of which about half are heavy atoms
+RESIDUE_ATOMS = (('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O'),
+                 ('CB', 'C'), ('CG', 'C'), ('CD', 'C'), ('CE', 'C'),
+                 ('H', 'H'), ('HA', 'H'), ('HB1', 'H'), ('HB2', 'H'), ('HG1', 'H'),
+                 ('HG2', 'H'), ('HD1', 'H'), ('HD2', 'H'), ('HE1', 'H'))
+
+# the number of interface residues of the simulation scripts
+N_TARGET_INTERFACE_RESIDUES = 29
+N_LIGASE_INTERFACE_RESIDUES = 12
+
+# radius of a protein ball per cube root of its number of residues
+RESIDUE_PACKING_RADIUS = 0.36 # nm
+RESIDUE_ATOM_SPREAD = 0.12 # nm
+INTERFACE_GAP = 0.3 # nm
+BINDING_SITE_CUTOFF = 0.8 # nm
+PROTAC_CONTACT_CUTOFF = 0.8 # nm
+
+
+class SyntheticSystem():
+    """A synthetic target-PROTAC-ligase complex in a box of water.
+
+    Parameters
+    ----------
+
+    system : str
+        One of the keys of `SYSTEM_SIZES`.
+
+    solvent : bool
+        If False only the complex is made, otherwise water is added
+        up to the number of atoms of the solvated system.
+
+    seed : int, optional
+        Seed of the random numbers for the native structure and the
+        walker states.
+
+    """
+
+    def __init__(self, system='6HAX', solvent=True, seed=None):
+
+        assert system in SYSTEM_SIZES, \
+            "system must be one of {}".format(tuple(SYSTEM_SIZES))
+
+        self.system = system
+        self.sizes = SYSTEM_SIZES[system]
+        self.rng = np.random.default_rng(seed)
+
+        self.box_vectors = np.diag(self.sizes.box_lengths)
+
+        self.topology = self._make_topology(solvent)
+        self.native_positions = self._make_positions()
+
+        self._make_selections()
+
+        self._json_top = None
+
+    def _make_topology(self, solvent):
+
+        top = mdj.Topology()
+
+        chain = top.add_chain()
+        for res_idx in range(self.sizes.n_target_residues + self.sizes.n_ligase_residues):
+
+            residue = top.add_residue('ALA', chain, resSeq=res_idx + 1)
+            for name, element in RESIDUE_ATOMS:
+                top.add_atom(name, mdj.element.get_by_symbol(element), residue)
+
+        protac_chain = top.add_chain()
+        protac_residue = top.add_residue(self.sizes.protac_resname, protac_chain)
+        heavy_names = (PROTAC_WARHEAD_ATOM_NAMES + PROTAC_LINKER_ATOM_NAMES +
+                       PROTAC_LIGAND_ATOM_NAMES)
+        for name in heavy_names:
+            top.add_atom(name, mdj.element.get_by_symbol(name[0]), protac_residue)
+        for h_idx in range(self.sizes.n_protac_atoms - len(heavy_names)):
+            top.add_atom('H{}'.format(h_idx + 1), mdj.element.hydrogen, protac_residue)
+
+        if solvent:
+            n_solvent_atoms = self.sizes.n_atoms - top.n_atoms
+
+            water_chain = top.add_chain()
+            for water_idx in range(n_solvent_atoms // 3):
+                water = top.add_residue('HOH', water_chain)
+                top.add_atom('O', mdj.element.oxygen, water)
+                top.add_atom('H1', mdj.element.hydrogen, water)
+                top.add_atom('H2', mdj.element.hydrogen, water)
+
+            # the rest are ions
+            for ion_idx in range(n_solvent_atoms % 3):
+                ion = top.add_residue('Cl-', water_chain)
+                top.add_atom('Cl-', mdj.element.chlorine, ion)
+
+        return top
+
+    def _protein_ball(self, center, n_residues):
+
+        radius = RESIDUE_PACKING_RADIUS * n_residues**(1/3)
+
+        directions = self.rng.normal(size=(n_residues, 3))
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+
+        res_centers = center + directions * radius * self.rng.random((n_residues, 1))**(1/3)
+
+        positions = (np.repeat(res_centers, len(RESIDUE_ATOMS), axis=0) +
+                     self.rng.normal(0.0, RESIDUE_ATOM_SPREAD,
+                                     (n_residues * len(RESIDUE_ATOMS), 3)))
+
+        return positions, res_centers, radius
+
+    def _make_positions(self):
+
+        box_center = np.array(self.sizes.box_lengths) / 2
+        axis = np.array([1.0, 0.0, 0.0])
+
+        target_radius = RESIDUE_PACKING_RADIUS * self.sizes.n_target_residues**(1/3)
+        ligase_radius = RESIDUE_PACKING_RADIUS * self.sizes.n_ligase_residues**(1/3)
+
+        # the two proteins on either side of the box center
+        target_center = box_center - axis * (target_radius + INTERFACE_GAP / 2)
+        ligase_center = box_center + axis * (ligase_radius + INTERFACE_GAP / 2)
+
+        target_positions, self._target_res_centers, _ = self._protein_ball(
+            target_center, self.sizes.n_target_residues)
+        ligase_positions, self._ligase_res_centers, _ = self._protein_ball(
+            ligase_center, self.sizes.n_ligase_residues)
+
+        # the PROTAC bridges the interface off to the side, the
+        # warhead on the target and the ligand on the ligase
+        side = np.array([0.0, 0.6, 0.0])
+        anchors = ((box_center - axis * 0.5 + side, len(PROTAC_WARHEAD_ATOM_NAMES)),
+                   (box_center + side, len(PROTAC_LINKER_ATOM_NAMES)),
+                   (box_center + axis * 0.5 + side, len(PROTAC_LIGAND_ATOM_NAMES)))
+
+        protac_heavy_positions = np.concatenate(
+            [anchor + self.rng.normal(0.0, 0.2, (n_moiety_atoms, 3))
+             for anchor, n_moiety_atoms in anchors])
+
+        n_protac_h = self.sizes.n_protac_atoms - len(protac_heavy_positions)
+        protac_h_positions = (protac_heavy_positions[self.rng.integers(len(protac_heavy_positions),
+                                                                       size=n_protac_h)] +
+                              self.rng.normal(0.0, 0.1, (n_protac_h, 3)))
+
+        positions = [target_positions, ligase_positions,
+                     protac_heavy_positions, protac_h_positions]
+
+        n_solvent_atoms = self.topology.n_atoms - sum(len(pos) for pos in positions)
+        positions.append(self.rng.random((n_solvent_atoms, 3)) * self.sizes.box_lengths)
+
+        return np.concatenate(positions)
+
+    def _make_selections(self):
+
+        top = self.topology
+
+        n_target = self.sizes.n_target_residues
+        n_ligase = self.sizes.n_ligase_residues
+        protac_resid = n_target + n_ligase
+
+        self.target_idxs = top.select('resid 0 to {}'.format(n_target - 1))
+        self.ligase_idxs = top.select('resid {} to {}'.format(n_target, protac_resid - 1))
+        self.protac_idxs = top.select('resid {}'.format(protac_resid))
+        self.protac_resids = [protac_resid]
+
+        protac_atom_names = np.array([atom.name for atom in top.residue(protac_resid).atoms])
+        self.warhead_idxs = self.protac_idxs[np.isin(protac_atom_names, PROTAC_WARHEAD_ATOM_NAMES)]
+        self.linker_idxs = self.protac_idxs[np.isin(protac_atom_names, PROTAC_LINKER_ATOM_NAMES)]
+        self.ligand_idxs = self.protac_idxs[np.isin(protac_atom_names, PROTAC_LIGAND_ATOM_NAMES)]
+
+        # the residues of each protein closest to the other one
+        target_dists = np.linalg.norm(self._target_res_centers -
+                                      self._ligase_res_centers.mean(axis=0), axis=1)
+        self.target_interface_resids = np.sort(
+            np.argsort(target_dists)[:N_TARGET_INTERFACE_RESIDUES]).tolist()
+
+        ligase_dists = np.linalg.norm(self._ligase_res_centers -
+                                      self._target_res_centers.mean(axis=0), axis=1)
+        self.ligase_interface_resids = (n_target + np.sort(
+            np.argsort(ligase_dists)[:N_LIGASE_INTERFACE_RESIDUES])).tolist()
+
+        self.target_interface_idxs = self._resids_atom_idxs(self.target_interface_resids)
+        self.ligase_interface_idxs = self._resids_atom_idxs(self.ligase_interface_resids)
+
+        # the target atoms near the warhead
+        warhead_dists = cdist(self.native_positions[self.target_idxs],
+                              self.native_positions[self.warhead_idxs])
+        self.binding_site_idxs = self.target_idxs[warhead_dists.min(axis=1) < BINDING_SITE_CUTOFF]
+
+        # the target residues in contact with the heavy atoms of the
+        # PROTAC
+        heavy_protac_idxs = np.concatenate((self.warhead_idxs, self.linker_idxs,
+                                            self.ligand_idxs))
+        atom_protac_dists = cdist(self.native_positions[self.target_idxs],
+                                  self.native_positions[heavy_protac_idxs]).min(axis=1)
+        target_atom_resids = np.array([top.atom(idx).residue.index for idx in self.target_idxs])
+        self.target_protac_resids = np.unique(
+            target_atom_resids[atom_protac_dists < PROTAC_CONTACT_CUTOFF]).tolist()
+        self.target_protac_idxs = self._resids_atom_idxs(self.target_protac_resids)
+
+    def _resids_atom_idxs(self, resids):
+
+        return np.concatenate([[atom.index for atom in self.topology.residue(resid).atoms]
+                               for resid in resids])
+
+    @property
+    def json_top(self):
+        """The topology in the wepy JSON format."""
+
+        if self._json_top is None:
+            self._json_top = mdtraj_to_json_topology(self.topology)
+
+        return self._json_top
+
+    def native_state(self):
+        """The state with the native positions.
+
+        Returns
+        -------
+
+        native_state : WalkerState
+
+        """
+
+        return WalkerState(positions=self.native_positions.copy(),
+                           box_vectors=self.box_vectors.copy())
+
+    def trajectory(self):
+        """A single frame trajectory of the native positions.
+
+        Returns
+        -------
+
+        trajectory : mdtraj.Trajectory
+
+        """
+
+        return mdj.Trajectory([self.native_positions], self.topology,
+                              unitcell_lengths=[self.sizes.box_lengths],
+                              unitcell_angles=[[90.0, 90.0, 90.0]])
+
+    def states(self, num_walkers, amplitude=0.1, noise=0.02):
+        """Make perturbed copies of the native state.
+
+        Every state has its own positions, about 1.6 MB for the
+        solvated systems, so 1024 walkers need about 1.7 GB.
+
+        Parameters
+        ----------
+
+        num_walkers : int
+
+        amplitude : float
+            The typical displacement in nanometers of the ligase and
+            PROTAC relative to the target. They are rotated about the
+            target center and translated as a rigid body.
+
+        noise : float
+            The standard deviation in nanometers of the noise added to
+            every atom.
+
+        Returns
+        -------
+
+        states : list of WalkerState
+
+        """
+
+        mobile_idxs = np.concatenate((self.ligase_idxs, self.protac_idxs))
+
+        target_center = self.native_positions[self.target_idxs].mean(axis=0)
+        lever = np.linalg.norm(self.native_positions[mobile_idxs].mean(axis=0) - target_center)
+
+        states = []
+        for walker_idx in range(num_walkers):
+
+            positions = self.native_positions + self.rng.normal(0.0, noise,
+                                                                self.native_positions.shape)
+
+            rotation = Rotation.from_rotvec(self.rng.normal(0.0, amplitude / lever, 3))
+            positions[mobile_idxs] = (rotation.apply(positions[mobile_idxs] - target_center) +
+                                      target_center + self.rng.normal(0.0, amplitude, 3))
+
+            states.append(WalkerState(positions=positions,
+                                      box_vectors=self.box_vectors.copy()))
+
+        return states
+
+    def walkers(self, num_walkers, amplitude=0.1, noise=0.02):
+        """Walkers with equal weights for the states from `states`.
+
+        Returns
+        -------
+
+        walkers : list of Walker
+
+        """
+
+        return [Walker(state, 1.0 / num_walkers)
+                for state in self.states(num_walkers, amplitude=amplitude, noise=noise)]
+
+    def rebinding_distance(self, **kwargs):
+        """The warhead RMSD distance of the simulation scripts.
+
+        Returns
+        -------
+
+        distance : RebindingDistance
+
+        """
+
+        return RebindingDistance(ligand_idxs=self.warhead_idxs,
+                                 binding_site_idxs=self.binding_site_idxs,
+                                 ref_state=self.native_state(),
+                                 **kwargs)
+
+    def protein_protein_contacts(self, **kwargs):
+        """The target-ligase interface contacts distance.
+
+        Returns
+        -------
+
+        distance : ProteinProteinContacts
+
+        """
+
+        return ProteinProteinContacts(prot_1_resids=self.target_interface_resids,
+                                      prot_2_resids=self.ligase_interface_resids,
+                                      prot_1_idxs=self.target_interface_idxs,
+                                      prot_2_idxs=self.ligase_interface_idxs,
+                                      trajectory=self.trajectory(),
+                                      native_state=self.native_state(),
+                                      **kwargs)
+
+    def triple_distance(self, **kwargs):
+        """The combined distance of the `*_triple_distance_metric.py`
+        scripts.
+
+        Returns
+        -------
+
+        distance : ProteinProteinContactsWarheadRMSDProteinProtacContacts
+
+        """
+
+        return ProteinProteinContactsWarheadRMSDProteinProtacContacts(
+            ligand_idxs=self.warhead_idxs,
+            binding_site_idxs=self.binding_site_idxs,
+            prot_1_resids=self.target_interface_resids,
+            prot_2_resids=self.ligase_interface_resids,
+            target_resids=self.target_protac_resids,
+            protac_resids=self.protac_resids,
+            prot_1_idxs=self.target_interface_idxs,
+            prot_2_idxs=self.ligase_interface_idxs,
+            target_idxs=self.target_protac_idxs,
+            protac_idxs=self.protac_idxs,
+            trajectory=self.trajectory(),
+            ref_state=self.native_state(),
+            **kwargs)
+
+    def rebinding_bc(self, initial_states=None, **kwargs):
+        """The boundary conditions of the simulation scripts.
+
+        Parameters
+        ----------
+
+        initial_states : list of WalkerState, optional
+            Defaults to the native state.
+
+        Returns
+        -------
+
+        bc : NewRebindingBC
+
+        """
+
+        if initial_states is None:
+            initial_states = [self.native_state()]
+
+        return NewRebindingBC(native_state=self.native_state(),
+                              initial_states=initial_states,
+                              ligand_idxs=self.ligase_interface_idxs,
+                              binding_site_idxs=self.target_interface_idxs,
+                              **kwargs)
+
+
+def _timed(func, *args):
+
+    start = time.perf_counter()
+    result = func(*args)
+
+    return result, time.perf_counter() - start
+
+
+def benchmark(synthetic_system, num_walkers_list=BENCHMARK_NUM_WALKERS,
+              amplitude=0.1, noise=0.02, contacts_backend=None):
+    """Time the components on ensembles of different sizes.
+
+    Parameters
+    ----------
+
+    synthetic_system : SyntheticSystem
+
+    num_walkers_list : list of int
+
+    amplitude : float
+        See `SyntheticSystem.states`.
+
+    noise : float
+        See `SyntheticSystem.states`.
+
+    contacts_backend : str, optional
+        The backend of the contacts distances, see
+        `ProteinProteinContacts`.
+
+    Returns
+    -------
+
+    timings : list of dict
+        The seconds taken by each component for each number of
+        walkers.
+
+    """
+
+    rebinding_distance = synthetic_system.rebinding_distance()
+    contacts_distance = synthetic_system.protein_protein_contacts(contacts_backend=contacts_backend)
+    bc = synthetic_system.rebinding_bc()
+
+    timings = []
+    for num_walkers in num_walkers_list:
+
+        walkers = synthetic_system.walkers(num_walkers, amplitude=amplitude, noise=noise)
+        states = [walker.state for walker in walkers]
+
+        _, rebinding_time = _timed(rebinding_distance.images, states)
+        _, contacts_time = _timed(lambda: [contacts_distance.image(state) for state in states])
+        (warped_walkers, *_), bc_time = _timed(bc.warp_walkers, walkers, 0)
+
+        resampler = REVOResampler(merge_dist=0.2, char_dist=0.15, dist_exponent=6,
+                                  distance=rebinding_distance,
+                                  init_state=synthetic_system.native_state(),
+                                  pmax=0.1, seed=0)
+        _, resample_time = _timed(resampler.resample, warped_walkers)
+
+        timings.append({'num_walkers' : num_walkers,
+                        'rebinding_images' : rebinding_time,
+                        'contacts_images' : contacts_time,
+                        'bc_warp' : bc_time,
+                        'revo_resample' : resample_time})
+
+    return timings
+
+
+def main(argv=None):
+    """Time the distance metrics, boundary conditions and REVO resampler
+    on synthetic walker ensembles."""
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--system', choices=tuple(SYSTEM_SIZES), default='6HAX')
+    parser.add_argument('--num-walkers', type=int, nargs='+', default=BENCHMARK_NUM_WALKERS)
+    parser.add_argument('--amplitude', type=float, default=0.1)
+    parser.add_argument('--noise', type=float, default=0.02)
+    parser.add_argument('--no-solvent', action='store_true')
+    parser.add_argument('--contacts-backend', choices=CONTACT_BACKENDS, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    synthetic_system = SyntheticSystem(args.system, solvent=not args.no_solvent, seed=args.seed)
+
+    timings = benchmark(synthetic_system, args.num_walkers,
+                        amplitude=args.amplitude, noise=args.noise,
+                        contacts_backend=args.contacts_backend)
+
+    fields = ('rebinding_images', 'contacts_images', 'bc_warp', 'revo_resample')
+    print("{:>8} ".format('walkers') + ' '.join("{:>16}".format(field) for field in fields))
+    for timing in timings:
+        print("{:>8} ".format(timing['num_walkers']) +
+              ' '.join("{:>16.3f}".format(timing[field]) for field in fields))
+
+
+if __name__ == '__main__':
+    main()